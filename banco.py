@@ -0,0 +1,496 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Acesso ao banco de dados SQLite (conexões, esquema, migrações e inserções em lote), sem dependência do Streamlit.
+# Usado pela aplicação (unificado.py) e pela linha de comando (bytebook.py).
+
+CAMINHO_BANCO = 'bytebook.db'
+MAX_CONEXOES_LEITURA_OCIOSAS = 8 # Conexões de leitura mantidas abertas para reaproveitamento
+
+# Tabelas mantidas por triggers a partir de cada tabela (em minúsculas): uma escrita na tabela também as altera
+TABELAS_DERIVADAS = {
+    'ncm_x_atrib_x_pn': ('pn_x_atrib', 'stats_totais', 'stats_ncm_freq'),
+    'pn_x_atrib': ('stats_attr_freq',),
+    'ncm_x_atrib': ('stats_ncm_atrib',),
+}
+
+def tabelas_afetadas(tabelas):
+    """As tabelas informadas (em minúsculas) mais todas as que os triggers alteram a partir delas, sem repetições."""
+    afetadas = {}
+    pendentes = [tabela.lower() for tabela in tabelas]
+    while pendentes:
+        tabela = pendentes.pop(0)
+        if tabela not in afetadas:
+            afetadas[tabela] = None
+            pendentes.extend(TABELAS_DERIVADAS.get(tabela, ()))
+    return list(afetadas)
+
+class GerenciadorConexoes:
+    """
+    Mantém conexões abertas com o banco de dados, compartilhadas por todas as sessões do servidor.
+    Leituras usam conexões de um pool (cada thread recebe uma conexão exclusiva enquanto a usa) e
+    escritas passam por uma única conexão, serializada por um lock, para que sessões concorrentes
+    não disputem o lock de escrita do SQLite. O banco opera em modo WAL, então leitores não são
+    bloqueados pelo escritor.
+    As gerações de escrita de cada tabela (chave do cache de leituras) ficam no próprio banco, na tabela
+    geracoes_escrita, para que escritas de outros processos (outra instância da aplicação ou a linha de
+    comando) também invalidem o cache.
+    """
+
+    def __init__(self, caminho_banco=CAMINHO_BANCO):
+        self.caminho_banco = caminho_banco
+        self._lock_pool = threading.Lock()
+        self._conexoes_leitura = []
+        self._lock_escrita = threading.Lock()
+        self._conexao_escrita = None
+
+    def _abrir_conexao(self):
+        conn = sqlite3.connect(self.caminho_banco, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL") # Seguro em WAL e bem mais rápido que FULL
+        conn.execute("PRAGMA cache_size=-65536") # 64 MB de cache de páginas
+        conn.execute("PRAGMA mmap_size=268435456") # 256 MB lidos via mmap
+        conn.execute("PRAGMA temp_store=MEMORY") # Tabelas temporárias (staging) em memória
+        return conn
+
+    @contextmanager
+    def leitura(self):
+        """Empresta uma conexão de leitura exclusiva para a thread atual e a devolve ao pool no final."""
+        with self._lock_pool:
+            conn = self._conexoes_leitura.pop() if self._conexoes_leitura else None
+        if conn is None:
+            conn = self._abrir_conexao()
+        try:
+            yield conn
+        finally:
+            with self._lock_pool:
+                if len(self._conexoes_leitura) < MAX_CONEXOES_LEITURA_OCIOSAS:
+                    self._conexoes_leitura.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    @contextmanager
+    def escrita(self, *tabelas):
+        """
+        Entrega a conexão de escrita com exclusividade; faz commit ao final ou rollback em caso de erro.
+        Na mesma transação, avança a geração das tabelas informadas e das mantidas a partir delas por triggers
+        (ou de todas, se nenhuma for informada), invalidando as leituras em cache dessas tabelas em todos os processos.
+        """
+        with self._lock_escrita:
+            if self._conexao_escrita is None:
+                self._conexao_escrita = self._abrir_conexao()
+                self._conexao_escrita.execute(
+                    "CREATE TABLE IF NOT EXISTS geracoes_escrita (tabela TEXT PRIMARY KEY, geracao INTEGER NOT NULL)"
+                )
+                self._conexao_escrita.commit()
+            conn = self._conexao_escrita
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                # O bloco pode ter feito commits antes do erro (como as migrações): o cache também é invalidado
+                try:
+                    self._avancar_geracoes(conn, tabelas)
+                    conn.commit()
+                except sqlite3.Error:
+                    conn.rollback()
+                raise
+            self._avancar_geracoes(conn, tabelas)
+            conn.commit()
+
+    def _avancar_geracoes(self, conn, tabelas):
+        conn.executemany(
+            "INSERT INTO geracoes_escrita (tabela, geracao) VALUES (?, 1) ON CONFLICT (tabela) DO UPDATE SET geracao = geracao + 1",
+            [(tabela,) for tabela in tabelas_afetadas(tabelas or ('*',))]
+        )
+
+    def geracao(self, tabela):
+        """
+        Geração de escrita atual de uma tabela, usada como chave do cache de leituras: (geração geral, geração da tabela).
+        Lida do banco a cada chamada, então reflete também as escritas feitas por outros processos.
+        """
+        with self.leitura() as conn:
+            try:
+                geracoes = dict(conn.execute(
+                    "SELECT tabela, geracao FROM geracoes_escrita WHERE tabela IN ('*', ?)", (tabela.lower(),)
+                ).fetchall())
+            except sqlite3.OperationalError:
+                geracoes = {} # Nenhuma escrita feita ainda pelo gerenciador neste banco
+        return (geracoes.get('*', 0), geracoes.get(tabela.lower(), 0))
+
+def create_table_ncm_x_atrib_x_pn(conn):
+    """Cria a tabela de pecas se ela não existir, com a nova coluna 'descricao'."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ncm_x_atrib_x_pn (
+            part_number TEXT PRIMARY KEY,
+            descricao TEXT,
+            ncm TEXT,
+            atributos_usados TEXT
+        )
+    ''')
+
+def create_table_cod_atributos(conn):
+    """Cria a tabela COD_ATRIBUTOS se ela não existir."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS COD_ATRIBUTOS (
+            NOME_ATRIBUTO TEXT,
+            CODIGO_ATRIB TEXT PRIMARY KEY,
+            MODALIDADE TEXT,
+            ORGAO TEXT
+        )
+    ''')
+
+def create_table_ncm_x_atrib(conn):
+    """Cria a tabela NCM_X_ATRIB se ela não existir, com chave primária composta."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS NCM_X_ATRIB (
+            NCM TEXT,
+            ATRIB TEXT,
+            PRIMARY KEY (NCM, ATRIB)
+        )
+    ''')
+
+
+def chaves_unicas(cursor, table_name):
+    """Retorna as chaves que impedem duplicatas em uma tabela: a chave primária e os índices UNIQUE, cada uma como lista de colunas."""
+    info_colunas = cursor.execute(f'PRAGMA table_info("{table_name}")').fetchall()
+    chaves = []
+    chave_primaria = [col[1] for col in sorted(info_colunas, key=lambda col: col[5]) if col[5] > 0]
+    if chave_primaria:
+        chaves.append(chave_primaria)
+
+    for indice in cursor.execute(f'PRAGMA index_list("{table_name}")').fetchall():
+        if indice[2] and indice[3] != 'pk': # Índices UNIQUE (a chave primária já foi considerada)
+            chaves.append([col[2] for col in cursor.execute(f'PRAGMA index_info("{indice[1]}")').fetchall()])
+    return chaves
+
+def inserir_em_lote(conn, df, table_name):
+    """
+    Insere um DataFrame em uma tabela de uma só vez, ignorando duplicatas.
+    As linhas são carregadas com executemany em uma tabela temporária de staging e copiadas com
+    INSERT OR IGNORE ... SELECT. Os novos registros são as linhas que o INSERT realmente gravou, ignoradas
+    por qualquer chave da tabela (chave primária ou índice UNIQUE).
+    Retorna (novos_itens, ignorados, erros, chaves_novas), onde erros é uma lista de (linha, exceção) apenas das
+    linhas que falharam e chaves_novas é o conjunto das chaves inseridas (vazio se a tabela não tiver chave).
+    """
+    cursor = conn.cursor()
+    colunas = list(df.columns)
+    colunas_sql = ", ".join(f'"{col}"' for col in colunas)
+    placeholders = ", ".join("?" * len(colunas))
+    linhas = list(df.itertuples(index=False, name=None))
+    erros = []
+    if not linhas:
+        return 0, 0, erros, set()
+
+    cursor.execute("DROP TABLE IF EXISTS temp.staging_insercao")
+    cursor.execute(f'CREATE TEMP TABLE staging_insercao AS SELECT {colunas_sql} FROM "{table_name}" WHERE 0')
+    try:
+        sql_staging = f"INSERT INTO temp.staging_insercao ({colunas_sql}) VALUES ({placeholders})"
+        try:
+            cursor.executemany(sql_staging, linhas)
+        except Exception:
+            # Alguma linha não pôde ser carregada: refaz linha a linha apenas para identificar as que falham
+            cursor.execute("DELETE FROM temp.staging_insercao")
+            for linha in linhas:
+                try:
+                    cursor.execute(sql_staging, linha)
+                except Exception as e:
+                    erros.append((linha, e))
+
+        # As chaves inseridas são identificadas pela primeira chave da tabela coberta pelas colunas do lote:
+        # as que passam a existir na tabela depois do INSERT e não existiam antes
+        chave = next((chave for chave in chaves_unicas(cursor, table_name) if set(chave) <= set(colunas)), None)
+        if chave:
+            chave_sql = ", ".join(f'staging."{col}"' for col in chave)
+            condicao_join = " AND ".join(f'destino."{col}" = staging."{col}"' for col in chave)
+            sql_chaves_existentes = f'SELECT {chave_sql} FROM temp.staging_insercao AS staging JOIN "{table_name}" AS destino ON {condicao_join}'
+            chaves_existentes = set(cursor.execute(sql_chaves_existentes).fetchall())
+
+        cursor.execute(f'INSERT OR IGNORE INTO "{table_name}" ({colunas_sql}) SELECT {colunas_sql} FROM temp.staging_insercao ORDER BY rowid')
+        # rowcount conta apenas as linhas gravadas por este INSERT: não inclui as alteradas pelos triggers
+        # nem as ignoradas por qualquer chave da tabela, inclusive um índice UNIQUE diferente da chave acima
+        novos_itens = cursor.rowcount
+        chaves_novas = set(cursor.execute(sql_chaves_existentes).fetchall()) - chaves_existentes if chave else set()
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.staging_insercao")
+
+    return novos_itens, len(linhas) - len(erros) - novos_itens, erros, chaves_novas
+
+def registrar_atributos_das_pecas(conn, df_pecas, chaves_novas):
+    """
+    Mantém a tabela normalizada pn_x_atrib para as peças recém-inseridas em ncm_x_atrib_x_pn,
+    uma linha por (part_number, atributo) a partir da coluna atributos_usados.
+    """
+    part_numbers_novos = {chave[0] for chave in chaves_novas}
+    # A primeira ocorrência de cada part number é a que foi gravada
+    df_novas = df_pecas[df_pecas['part_number'].isin(part_numbers_novos)].drop_duplicates(subset=['part_number'])
+    linhas = [
+        (part_number, atrib.strip())
+        for part_number, atributos_usados in zip(df_novas['part_number'].tolist(), df_novas['atributos_usados'].tolist())
+        if isinstance(atributos_usados, str)
+        for atrib in atributos_usados.split(',')
+        if atrib.strip()
+    ]
+    conn.executemany("INSERT OR IGNORE INTO pn_x_atrib (part_number, atrib) VALUES (?, ?)", linhas)
+
+def inserir_pecas(conn, df_pecas):
+    """
+    Insere peças em ncm_x_atrib_x_pn, ignorando duplicatas, e registra os atributos das novas em pn_x_atrib.
+    Retorna (novos_itens, erros), com erros como em `inserir_em_lote`.
+    """
+    df_pecas = df_pecas[['part_number', 'descricao', 'ncm', 'atributos_usados']]
+    novos_itens, _, erros, chaves_novas = inserir_em_lote(conn, df_pecas, 'ncm_x_atrib_x_pn')
+    registrar_atributos_das_pecas(conn, df_pecas, chaves_novas)
+    return novos_itens, erros
+
+def inserir_dados(conn, df, table_name):
+    """
+    Insere um DataFrame em uma tabela, ignorando duplicatas; peças inseridas em ncm_x_atrib_x_pn também
+    têm os atributos registrados em pn_x_atrib. Retorna (novos_itens, erros).
+    """
+    novos_itens, _, erros, chaves_novas = inserir_em_lote(conn, df, table_name)
+    if table_name.lower() == 'ncm_x_atrib_x_pn' and {'part_number', 'atributos_usados'} <= set(df.columns):
+        registrar_atributos_das_pecas(conn, df, chaves_novas)
+    return novos_itens, erros
+
+def create_table_cnpj_options(conn):
+    """Cria a tabela cnpj_options se ela não existir."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cnpj_options (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            cpf_cnpj_raiz TEXT NOT NULL
+        )
+    ''')
+
+# --- Migrações do Esquema do Banco de Dados ---
+def migracao_tabelas_iniciais(conn):
+    """Cria as tabelas base da aplicação."""
+    create_table_ncm_x_atrib_x_pn(conn)
+    create_table_cod_atributos(conn)
+    create_table_ncm_x_atrib(conn)
+    create_table_cnpj_options(conn)
+
+def migracao_pn_x_atrib_e_indices(conn):
+    """
+    Cria a tabela normalizada pn_x_atrib (uma linha por peça e atributo), preenchida a partir de
+    ncm_x_atrib_x_pn.atributos_usados, e os índices usados pelas análises e consultas.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pn_x_atrib (
+            part_number TEXT NOT NULL,
+            atrib TEXT NOT NULL,
+            PRIMARY KEY (part_number, atrib)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pn_x_atrib_atrib ON pn_x_atrib (atrib)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ncm_x_atrib_x_pn_ncm ON ncm_x_atrib_x_pn (ncm)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cod_atributos_codigo ON COD_ATRIBUTOS (CODIGO_ATRIB)")
+    # Exclusões feitas diretamente em SQL (aba de gerenciamento) também limpam a tabela normalizada
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_ncm_x_atrib_x_pn_delete AFTER DELETE ON ncm_x_atrib_x_pn
+        BEGIN
+            DELETE FROM pn_x_atrib WHERE part_number = OLD.part_number;
+        END
+    ''')
+    reconstruir_pn_x_atrib(conn)
+
+def reconstruir_pn_x_atrib(conn):
+    """Recria todo o conteúdo de pn_x_atrib a partir de ncm_x_atrib_x_pn."""
+    df_pecas = pd.read_sql_query("SELECT part_number, atributos_usados FROM ncm_x_atrib_x_pn WHERE part_number IS NOT NULL", conn)
+    conn.execute("DELETE FROM pn_x_atrib")
+    registrar_atributos_das_pecas(conn, df_pecas, {(part_number,) for part_number in df_pecas['part_number']})
+
+def migracao_estatisticas_materializadas(conn):
+    """
+    Cria as tabelas de estatísticas pré-agregadas da aba de análises e os triggers que as mantêm
+    atualizadas na mesma transação de cada inserção, alteração ou exclusão nas tabelas base.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS stats_totais (chave TEXT PRIMARY KEY, valor INTEGER NOT NULL DEFAULT 0)")
+    conn.execute("CREATE TABLE IF NOT EXISTS stats_ncm_freq (ncm TEXT PRIMARY KEY, frequencia INTEGER NOT NULL DEFAULT 0)")
+    conn.execute("CREATE TABLE IF NOT EXISTS stats_attr_freq (atrib TEXT PRIMARY KEY, frequencia INTEGER NOT NULL DEFAULT 0)")
+    conn.execute("CREATE TABLE IF NOT EXISTS stats_ncm_atrib (NCM TEXT PRIMARY KEY, atributos TEXT NOT NULL)")
+
+    # Peças: total e frequência por NCM
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_pecas_insert AFTER INSERT ON ncm_x_atrib_x_pn
+        BEGIN
+            INSERT INTO stats_totais (chave, valor) VALUES ('part_numbers', 1)
+                ON CONFLICT (chave) DO UPDATE SET valor = valor + 1;
+            INSERT INTO stats_ncm_freq (ncm, frequencia) VALUES (IFNULL(NEW.ncm, ''), 1)
+                ON CONFLICT (ncm) DO UPDATE SET frequencia = frequencia + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_pecas_delete AFTER DELETE ON ncm_x_atrib_x_pn
+        BEGIN
+            UPDATE stats_totais SET valor = valor - 1 WHERE chave = 'part_numbers';
+            UPDATE stats_ncm_freq SET frequencia = frequencia - 1 WHERE ncm = IFNULL(OLD.ncm, '');
+            DELETE FROM stats_ncm_freq WHERE ncm = IFNULL(OLD.ncm, '') AND frequencia <= 0;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_pecas_update_ncm AFTER UPDATE OF ncm ON ncm_x_atrib_x_pn
+        BEGIN
+            UPDATE stats_ncm_freq SET frequencia = frequencia - 1 WHERE ncm = IFNULL(OLD.ncm, '');
+            DELETE FROM stats_ncm_freq WHERE ncm = IFNULL(OLD.ncm, '') AND frequencia <= 0;
+            INSERT INTO stats_ncm_freq (ncm, frequencia) VALUES (IFNULL(NEW.ncm, ''), 1)
+                ON CONFLICT (ncm) DO UPDATE SET frequencia = frequencia + 1;
+        END
+    ''')
+
+    # Atributos: frequência de uso pelas peças
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_attr_insert AFTER INSERT ON pn_x_atrib
+        BEGIN
+            INSERT INTO stats_attr_freq (atrib, frequencia) VALUES (NEW.atrib, 1)
+                ON CONFLICT (atrib) DO UPDATE SET frequencia = frequencia + 1;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_attr_delete AFTER DELETE ON pn_x_atrib
+        BEGIN
+            UPDATE stats_attr_freq SET frequencia = frequencia - 1 WHERE atrib = OLD.atrib;
+            DELETE FROM stats_attr_freq WHERE atrib = OLD.atrib AND frequencia <= 0;
+        END
+    ''')
+
+    # Visão agrupada de atributos por NCM
+    criar_gatilhos_stats_ncm_atrib(conn)
+
+    reconstruir_estatisticas(conn)
+
+def _sql_recalcular_stats_ncm_atrib(ncms):
+    """
+    INSERT que recalcula stats_ncm_atrib para os NCMs da consulta `ncms` (uma coluna `ncm`, com '' no lugar de nulo).
+    Os atributos de cada NCM são concatenados na ordem de inserção (rowid), a mesma em que o trigger de inserção
+    os acrescenta; o mesmo SQL é usado pelos triggers e pela reconstrução completa, para o texto sair sempre igual.
+    """
+    return f'''
+        INSERT INTO stats_ncm_atrib (NCM, atributos)
+            SELECT ncm, atributos FROM (
+                SELECT chaves.ncm AS ncm, (
+                    SELECT group_concat(IFNULL(ATRIB, ''), ', ') FROM (
+                        SELECT ATRIB FROM NCM_X_ATRIB
+                        WHERE NCM = chaves.ncm OR (NCM IS NULL AND chaves.ncm = '')
+                        ORDER BY rowid
+                    )
+                ) AS atributos
+                FROM ({ncms}) AS chaves
+            )
+            WHERE atributos IS NOT NULL
+    '''
+
+def criar_gatilhos_stats_ncm_atrib(conn):
+    """(Re)cria os triggers que mantêm stats_ncm_atrib em dia com as inserções, exclusões e alterações em NCM_X_ATRIB."""
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_ncm_atrib_insert AFTER INSERT ON NCM_X_ATRIB
+        BEGIN
+            INSERT INTO stats_ncm_atrib (NCM, atributos) VALUES (IFNULL(NEW.NCM, ''), IFNULL(NEW.ATRIB, ''))
+                ON CONFLICT (NCM) DO UPDATE SET atributos = atributos || ', ' || excluded.atributos;
+        END
+    ''')
+    conn.execute("DROP TRIGGER IF EXISTS trg_stats_ncm_atrib_delete")
+    conn.execute(f'''
+        CREATE TRIGGER trg_stats_ncm_atrib_delete AFTER DELETE ON NCM_X_ATRIB
+        BEGIN
+            DELETE FROM stats_ncm_atrib WHERE NCM = IFNULL(OLD.NCM, '');
+            {_sql_recalcular_stats_ncm_atrib("SELECT IFNULL(OLD.NCM, '') AS ncm")};
+        END
+    ''')
+    # Alterações feitas pelo SQL livre da aba de gerenciamento: recalcula o NCM antigo e o novo
+    conn.execute("DROP TRIGGER IF EXISTS trg_stats_ncm_atrib_update")
+    conn.execute(f'''
+        CREATE TRIGGER trg_stats_ncm_atrib_update AFTER UPDATE OF NCM, ATRIB ON NCM_X_ATRIB
+        BEGIN
+            DELETE FROM stats_ncm_atrib WHERE NCM IN (IFNULL(OLD.NCM, ''), IFNULL(NEW.NCM, ''));
+            {_sql_recalcular_stats_ncm_atrib("SELECT IFNULL(OLD.NCM, '') AS ncm UNION SELECT IFNULL(NEW.NCM, '')")};
+        END
+    ''')
+
+def reconstruir_estatisticas(conn):
+    """Recalcula do zero as tabelas de estatísticas a partir das tabelas base."""
+    conn.execute("DELETE FROM stats_totais")
+    conn.execute("INSERT INTO stats_totais (chave, valor) SELECT 'part_numbers', COUNT(*) FROM ncm_x_atrib_x_pn")
+    conn.execute("DELETE FROM stats_ncm_freq")
+    conn.execute("INSERT INTO stats_ncm_freq (ncm, frequencia) SELECT IFNULL(ncm, ''), COUNT(*) FROM ncm_x_atrib_x_pn GROUP BY IFNULL(ncm, '')")
+    conn.execute("DELETE FROM stats_attr_freq")
+    conn.execute("INSERT INTO stats_attr_freq (atrib, frequencia) SELECT atrib, COUNT(*) FROM pn_x_atrib GROUP BY atrib")
+    conn.execute("DELETE FROM stats_ncm_atrib")
+    conn.execute(_sql_recalcular_stats_ncm_atrib("SELECT DISTINCT IFNULL(NCM, '') AS ncm FROM NCM_X_ATRIB"))
+
+def migracao_indice_consulta_ncm(conn):
+    """Índice (NCM, ATRIB) de NCM_X_ATRIB, usado pela consulta de atributos por NCM exato e por prefixo."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ncm_x_atrib_ncm_atrib ON NCM_X_ATRIB (NCM, ATRIB)")
+
+def migracao_gatilho_atualizacao_pn_x_atrib(conn):
+    """
+    Trigger que refaz as linhas de pn_x_atrib de uma peça quando o part number ou atributos_usados são alterados
+    diretamente em SQL, mantendo stats_attr_freq em dia pelos triggers de pn_x_atrib. A lista separada por vírgulas
+    é desmembrada com json_each, já que triggers do SQLite não aceitam CTEs recursivas.
+    """
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_ncm_x_atrib_x_pn_update AFTER UPDATE OF part_number, atributos_usados ON ncm_x_atrib_x_pn
+        BEGIN
+            DELETE FROM pn_x_atrib WHERE part_number = OLD.part_number;
+            INSERT OR IGNORE INTO pn_x_atrib (part_number, atrib)
+                SELECT NEW.part_number, trim(value, ' ' || char(9, 10, 13))
+                FROM json_each('["' || replace(replace(replace(replace(replace(replace(NEW.atributos_usados,
+                    '\\', '\\\\'), '"', '\\"'), char(9), '\\t'), char(10), '\\n'), char(13), '\\r'), ',', '","') || '"]')
+                WHERE NEW.part_number IS NOT NULL AND trim(value, ' ' || char(9, 10, 13)) <> '';
+        END
+    ''')
+    # Alterações feitas antes do trigger podem ter deixado pn_x_atrib (e stats_attr_freq) desatualizada
+    reconstruir_pn_x_atrib(conn)
+
+def migracao_gatilhos_ordenados_stats_ncm_atrib(conn):
+    """
+    Recria os triggers de stats_ncm_atrib com a concatenação na ordem de inserção, acrescenta o de alteração
+    de NCM_X_ATRIB e recalcula a tabela, que pode ter ficado com outra ordem ou desatualizada.
+    """
+    criar_gatilhos_stats_ncm_atrib(conn)
+    conn.execute("DELETE FROM stats_ncm_atrib")
+    conn.execute(_sql_recalcular_stats_ncm_atrib("SELECT DISTINCT IFNULL(NCM, '') AS ncm FROM NCM_X_ATRIB"))
+
+# Migrações em ordem de versão. Para alterar o esquema, adicione um novo passo ao final da lista;
+# cada passo é aplicado uma única vez e registrado na tabela schema_version.
+MIGRACOES = [
+    (1, "Tabelas iniciais", migracao_tabelas_iniciais),
+    (2, "Tabela pn_x_atrib e índices por NCM e atributo", migracao_pn_x_atrib_e_indices),
+    (3, "Estatísticas materializadas da aba de análises", migracao_estatisticas_materializadas),
+    (4, "Índice da consulta de atributos por NCM", migracao_indice_consulta_ncm),
+    (5, "Trigger de alteração de atributos_usados em pn_x_atrib", migracao_gatilho_atualizacao_pn_x_atrib),
+    (6, "Triggers de stats_ncm_atrib na ordem de inserção e de alteração de NCM_X_ATRIB", migracao_gatilhos_ordenados_stats_ncm_atrib),
+]
+
+def aplicar_migracoes(conn):
+    """Aplica, em ordem, as migrações ainda não registradas em schema_version. Retorna as versões aplicadas."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            versao INTEGER PRIMARY KEY,
+            descricao TEXT,
+            aplicada_em TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    versoes_aplicadas = []
+    for versao, descricao, migracao in MIGRACOES:
+        # Cada migração roda na sua própria transação; a versão é conferida de novo dentro dela
+        # para que processos concorrentes não apliquem o mesmo passo duas vezes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ja_aplicada = conn.execute("SELECT 1 FROM schema_version WHERE versao = ?", (versao,)).fetchone()
+            if not ja_aplicada:
+                migracao(conn)
+                conn.execute("INSERT INTO schema_version (versao, descricao) VALUES (?, ?)", (versao, descricao))
+                versoes_aplicadas.append(versao)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return versoes_aplicadas
@@ -0,0 +1,54 @@
+import sys
+import time
+
+from exportacao import BACKENDS_JSON, FORMATOS_JSON, serializar_json
+
+# Mede a velocidade de serialização dos JSONs de exportação em cada formato e codificador disponível.
+# Uso: python benchmark_json.py [quantidade_de_itens] [repeticoes]
+
+def gerar_itens(quantidade):
+    """Gera itens sintéticos com a mesma estrutura produzida por converter_para_json."""
+    return [
+        {
+            "seq": seq,
+            "descricao": f"PARA-CHOQUE DIANTEIRO MODELO {seq % 97} - AÇO GALVANIZADO",
+            "denominacao": f"Peça de reposição número {seq}",
+            "cpfCnpjRaiz": "39318225",
+            "situacao": "Ativado",
+            "modalidade": "IMPORTACAO",
+            "ncm": "87082999",
+            "atributos": [{"atributo": f"ATT_{codigo}", "valor": f"{seq % (codigo + 2):02d}"} for codigo in range(8)],
+            "codigosInterno": [f"PN{seq:08d}"],
+            "atributosMultivalorados": [],
+            "atributosCompostos": [],
+            "atributosCompostosMultivalorados": []
+        }
+        for seq in range(1, quantidade + 1)
+    ]
+
+def medir(itens, formato, backend, repeticoes):
+    """Retorna (tamanho em bytes, melhor tempo em segundos) entre as repetições."""
+    melhor = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        dados = serializar_json(itens, formato, backend)
+        duracao = time.perf_counter() - inicio
+        melhor = duracao if melhor is None else min(melhor, duracao)
+    return len(dados), melhor
+
+def main():
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    itens = gerar_itens(quantidade)
+
+    print(f"{quantidade} itens, melhor de {repeticoes} execuções")
+    print(f"{'formato':<10} {'codificador':<12} {'tamanho (MB)':>13} {'tempo (s)':>10} {'MB/s':>9}")
+    for formato in FORMATOS_JSON:
+        for backend in BACKENDS_JSON:
+            tamanho, duracao = medir(itens, formato, backend, repeticoes)
+            print(f"{formato:<10} {backend:<12} {tamanho / 1e6:>13.2f} {duracao:>10.3f} {tamanho / 1e6 / duracao:>9.1f}")
+    if 'orjson' not in BACKENDS_JSON:
+        print("orjson não está instalado; apenas o módulo json da biblioteca padrão foi medido.")
+
+if __name__ == "__main__":
+    main()
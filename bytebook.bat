@@ -0,0 +1,3 @@
+@echo off
+rem Conversao e importacao de planilhas em lote pela linha de comando (ex.: bytebook import planilhas --cpf-cnpj-raiz 39318225)
+python "%~dp0bytebook.py" %*
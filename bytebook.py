@@ -0,0 +1,277 @@
+import argparse
+import io
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from banco import CAMINHO_BANCO, GerenciadorConexoes, aplicar_migracoes, inserir_dados, inserir_pecas
+from exportacao import (
+    ExportacaoJson, ItensEmDisco, CRITERIOS_LOTE, CRITERIO_LOTE_PADRAO, TAMANHO_LOTE_PADRAO, LIMITE_BYTES_LOTE_PADRAO,
+    FORMATOS_JSON, FORMATO_JSON_PADRAO, BACKENDS_JSON, BACKEND_JSON_PADRAO
+)
+from processamento import converter_aba, ler_planilha, processar_arquivo, TAMANHO_BLOCO_STREAMING, LIMITE_STREAMING_BYTES
+
+# Linha de comando para converter e importar planilhas em lote, sem navegador, com o mesmo processamento da Aba 1.
+# Uso:
+#   python bytebook.py convert PLANILHAS_OU_PASTAS... --cpf-cnpj-raiz 39318225 --saida jsons [--workers N]
+#   python bytebook.py import PLANILHAS_OU_PASTAS... --cpf-cnpj-raiz 39318225 [--banco bytebook.db] [--saida jsons] [--workers N]
+# convert apenas gera os JSONs; import grava no banco (e também gera os JSONs se --saida for informado).
+
+EXTENSOES_PLANILHA = ('.xlsx', '.csv')
+
+def listar_planilhas(caminhos):
+    """Arquivos informados diretamente e planilhas (.xlsx/.csv) das pastas informadas, sem repetições."""
+    arquivos = []
+    for caminho in caminhos:
+        if os.path.isdir(caminho):
+            # Ignora os arquivos temporários que o Excel cria ao abrir uma planilha (~$...)
+            arquivos.extend(sorted(
+                os.path.join(caminho, nome) for nome in os.listdir(caminho)
+                if nome.lower().endswith(EXTENSOES_PLANILHA) and not nome.startswith('~$')
+            ))
+        else:
+            arquivos.append(caminho)
+    return list(dict.fromkeys(arquivos))
+
+def converter_arquivo(caminho, cpf_cnpj_raiz, streaming, tamanho_bloco):
+    """Lê e converte um arquivo; executada nos processos do pool. Retorna (abas, segundos de conversão)."""
+    inicio = time.perf_counter()
+    with open(caminho, 'rb') as arquivo:
+        conteudo = arquivo.read()
+    abas = processar_arquivo(os.path.basename(caminho), conteudo, cpf_cnpj_raiz, streaming, tamanho_bloco)
+    return abas, time.perf_counter() - inicio
+
+def abas_em_blocos(caminho, cpf_cnpj_raiz, tamanho_bloco):
+    """
+    Abas de um arquivo em modo streaming, como pares (nome_aba, eventos de converter_aba) lidos e convertidos
+    no próprio processo à medida que são consumidos: apenas um bloco fica em memória por vez.
+    """
+    with open(caminho, 'rb') as arquivo:
+        conteudo = io.BytesIO(arquivo.read())
+    conteudo.name = os.path.basename(caminho)
+    for sheet_name, blocos in ler_planilha(conteudo, True, tamanho_bloco):
+        yield sheet_name, converter_aba(sheet_name, blocos, cpf_cnpj_raiz, streaming=True)
+
+def tratar_aba(eventos, gerenciador=None, streaming=False):
+    """
+    Percorre os eventos de `converter_aba` de uma aba. Com um gerenciador de conexões, grava no banco na mesma ordem
+    da Aba 1: peças e NCM_X_ATRIB a cada bloco convertido (numa única transação por bloco) e COD_ATRIBUTOS no final.
+    No modo streaming o JSON da aba vai para um arquivo temporário, bloco a bloco, em vez de ficar em memória.
+    Retorna {'json', 'linhas', 'contagens', 'avisos', 'erro'}; 'json' só é preenchido se a aba for concluída.
+    """
+    resultado = {'json': None, 'linhas': 0, 'avisos': [], 'erro': None,
+                 'contagens': {'novos_itens': 0, 'novas_combinacoes': 0, 'novos_atributos': 0}}
+    contagens = resultado['contagens']
+    json_aba = ItensEmDisco() if streaming else []
+    try:
+        for evento in eventos:
+            tipo = evento['tipo']
+            if tipo == 'formato_invalido':
+                resultado['erro'] = "colunas de atributos com formato incorreto (o correto é 'ATT_...'): " + ', '.join(evento['colunas'])
+                break
+            if tipo == 'bloco_lido':
+                resultado['linhas'] += evento['linhas']
+            elif tipo == 'duplicados':
+                resultado['avisos'].append("Part Numbers duplicados; apenas a primeira ocorrência foi processada.")
+            elif tipo == 'erro':
+                resultado['erro'] = evento['mensagem']
+                if evento['numero'] > 1 and gerenciador is not None:
+                    resultado['erro'] += f" Os {len(json_aba)} itens dos blocos anteriores já foram gravados no banco de dados."
+                break
+            elif tipo == 'bloco_convertido':
+                json_aba.extend(evento['json'])
+                if gerenciador is not None:
+                    with gerenciador.escrita('ncm_x_atrib_x_pn', 'pn_x_atrib', 'NCM_X_ATRIB') as conn:
+                        novos_itens, erros_pecas = inserir_pecas(conn, evento['df_pecas'])
+                        novas_combinacoes, erros_combinacoes = inserir_dados(conn, evento['df_ncm_x_atrib'], 'NCM_X_ATRIB')
+                    contagens['novos_itens'] += novos_itens
+                    contagens['novas_combinacoes'] += novas_combinacoes
+                    for linha, e in erros_pecas + erros_combinacoes:
+                        resultado['avisos'].append(f"Erro ao inserir {linha[0]}: {e}")
+            elif tipo == 'vazia':
+                resultado['avisos'].append("A aba não possui linhas para processar.")
+            elif tipo == 'concluido':
+                resultado['json'] = json_aba
+                if gerenciador is not None:
+                    with gerenciador.escrita('COD_ATRIBUTOS') as conn:
+                        contagens['novos_atributos'], erros = inserir_dados(conn, evento['df_cod_atributos'], 'COD_ATRIBUTOS')
+                    for linha, e in erros:
+                        resultado['avisos'].append(f"Erro ao inserir o atributo {linha[0]}: {e}")
+    except sqlite3.Error as e:
+        resultado['erro'] = f"Erro ao gravar no banco de dados: {e}"
+    return resultado
+
+def gravar_jsons(jsons_gerados, pasta, args):
+    """Grava os JSONs do arquivo na pasta, divididos como na Aba 1. Retorna os nomes dos arquivos gravados."""
+    exportacao = ExportacaoJson(jsons_gerados, args.criterio_lote, args.tamanho_lote, args.limite_kb * 1024, args.formato, args.backend)
+    for nome_arquivo, dados in exportacao.membros():
+        with open(os.path.join(pasta, nome_arquivo), 'wb') as saida:
+            saida.write(dados)
+    return [arquivo[0] for arquivo in exportacao.arquivos]
+
+def concluir_arquivo(caminho, abas, segundos_conversao, gerenciador, args):
+    """
+    Grava no banco e em disco o resultado de um arquivo e imprime o resumo dele. Retorna (itens, linhas, sucesso).
+    Sem `segundos_conversao`, `abas` vem de `abas_em_blocos` e a conversão acontece aqui, intercalada com a gravação.
+    """
+    inicio = time.perf_counter()
+    streaming = segundos_conversao is None
+    nome_base = os.path.basename(caminho).rsplit('.', 1)[0]
+    jsons_gerados = {}
+    itens = linhas = total_abas = 0
+    sucesso = True
+    mensagens = []
+    contagens = {'novos_itens': 0, 'novas_combinacoes': 0, 'novos_atributos': 0}
+    for sheet_name, eventos in abas:
+        total_abas += 1
+        resultado = tratar_aba(eventos, gerenciador, streaming)
+        linhas += resultado['linhas']
+        for chave, valor in resultado['contagens'].items():
+            contagens[chave] += valor
+        mensagens.extend(f"  aviso na aba '{sheet_name}': {aviso}" for aviso in resultado['avisos'])
+        if resultado['erro']:
+            sucesso = False
+            mensagens.append(f"  erro na aba '{sheet_name}': {resultado['erro']}")
+        if resultado['json'] is not None:
+            jsons_gerados[f"{nome_base}_{sheet_name}"] = resultado['json']
+            itens += len(resultado['json'])
+
+    gravados = gravar_jsons(jsons_gerados, args.saida, args) if args.saida else []
+    segundos_gravacao = time.perf_counter() - inicio
+
+    resumo = f"{os.path.basename(caminho)}: {total_abas} aba(s), {linhas} linhas, {itens} itens "
+    if streaming:
+        resumo += f"em {segundos_gravacao:.2f} s (conversão e gravação bloco a bloco)"
+    else:
+        segundos = segundos_conversao + segundos_gravacao
+        resumo += f"em {segundos:.2f} s (conversão {segundos_conversao:.2f} s, gravação {segundos_gravacao:.2f} s)"
+    if gerenciador is not None:
+        resumo += (f"; novos: {contagens['novos_itens']} peças, {contagens['novas_combinacoes']} combinações NCM x atributo, "
+                   f"{contagens['novos_atributos']} atributos")
+    if gravados:
+        resumo += f"; {len(gravados)} arquivo(s) JSON"
+    print(resumo, flush=True)
+    for mensagem in mensagens:
+        print(mensagem, file=sys.stderr, flush=True)
+    return itens, linhas, sucesso
+
+def executar(args, importar):
+    arquivos = listar_planilhas(args.caminhos)
+    if not arquivos:
+        print("Nenhuma planilha (.xlsx/.csv) encontrada.", file=sys.stderr)
+        return 1
+    if args.saida:
+        os.makedirs(args.saida, exist_ok=True)
+
+    gerenciador = None
+    if importar:
+        gerenciador = GerenciadorConexoes(args.banco)
+        with gerenciador.escrita() as conn:
+            aplicar_migracoes(conn)
+
+    inicio = time.perf_counter()
+    total_itens = total_linhas = total_bytes = falhas = 0
+
+    def registrar(caminho, abas, segundos_conversao):
+        nonlocal total_itens, total_linhas, falhas
+        itens, linhas, sucesso = concluir_arquivo(caminho, abas, segundos_conversao, gerenciador, args)
+        total_itens += itens
+        total_linhas += linhas
+        falhas += not sucesso
+
+    def registrar_falha(caminho, erro):
+        nonlocal falhas
+        falhas += 1
+        print(f"{os.path.basename(caminho)}: erro ao processar o arquivo: {erro}", file=sys.stderr, flush=True)
+
+    def converter_em_blocos(caminho):
+        try:
+            registrar(caminho, abas_em_blocos(caminho, args.cpf_cnpj_raiz, args.tamanho_bloco), None)
+        except Exception as e:
+            registrar_falha(caminho, e)
+
+    tarefas = []
+    for caminho in arquivos:
+        try:
+            tamanho = os.path.getsize(caminho)
+        except OSError as e:
+            registrar_falha(caminho, e)
+            continue
+        total_bytes += tamanho
+        tarefas.append((caminho, args.streaming or tamanho > LIMITE_STREAMING_BYTES))
+
+    # Arquivos em modo streaming são sempre lidos, convertidos e gravados bloco a bloco no processo principal:
+    # no pool, o processo filho teria de montar e devolver de uma vez os eventos de todos os blocos
+    if args.workers <= 1:
+        # Em série, no próprio processo
+        for caminho, streaming in tarefas:
+            if streaming:
+                converter_em_blocos(caminho)
+                continue
+            try:
+                abas, segundos = converter_arquivo(caminho, args.cpf_cnpj_raiz, streaming, args.tamanho_bloco)
+            except Exception as e:
+                registrar_falha(caminho, e)
+                continue
+            registrar(caminho, abas, segundos)
+    else:
+        # Conversão nos processos do pool; a gravação acontece aqui, no processo principal, o único escritor do banco
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futuros = {
+                pool.submit(converter_arquivo, caminho, args.cpf_cnpj_raiz, streaming, args.tamanho_bloco): caminho
+                for caminho, streaming in tarefas if not streaming
+            }
+            # Os arquivos em modo streaming são tratados aqui enquanto o pool converte os demais
+            for caminho, streaming in tarefas:
+                if streaming:
+                    converter_em_blocos(caminho)
+            for futuro in as_completed(futuros):
+                try:
+                    abas, segundos = futuro.result()
+                except Exception as e:
+                    registrar_falha(futuros[futuro], e)
+                    continue
+                registrar(futuros[futuro], abas, segundos)
+
+    duracao = time.perf_counter() - inicio
+    print(
+        f"Total: {len(arquivos)} arquivo(s), {falhas} com erro, {total_linhas} linhas, {total_itens} itens em {duracao:.2f} s "
+        f"({total_itens / duracao:.0f} itens/s, {total_bytes / 1e6 / duracao:.2f} MB/s de planilhas) com {max(args.workers, 1)} processo(s)",
+        flush=True
+    )
+    return 1 if falhas else 0
+
+def criar_parser():
+    parser = argparse.ArgumentParser(prog='bytebook', description="Conversão e importação de planilhas de peças em lote.")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    comum = argparse.ArgumentParser(add_help=False)
+    comum.add_argument('caminhos', nargs='+', help="planilhas (.xlsx/.csv) ou pastas com planilhas")
+    comum.add_argument('--cpf-cnpj-raiz', required=True, help="CPF/CNPJ raiz gravado nos itens do JSON")
+    comum.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="arquivos convertidos ao mesmo tempo (padrão: número de CPUs)")
+    comum.add_argument('--streaming', action='store_true',
+                       help=f"lê as planilhas em blocos (automático para arquivos acima de {LIMITE_STREAMING_BYTES // (1024 * 1024)} MB)")
+    comum.add_argument('--tamanho-bloco', type=int, default=TAMANHO_BLOCO_STREAMING, help="linhas por bloco no modo streaming")
+    comum.add_argument('--criterio-lote', choices=list(CRITERIOS_LOTE), default=CRITERIO_LOTE_PADRAO, help="divisão dos arquivos JSON")
+    comum.add_argument('--tamanho-lote', type=int, default=TAMANHO_LOTE_PADRAO, help="itens por arquivo JSON (critério 'itens')")
+    comum.add_argument('--limite-kb', type=int, default=LIMITE_BYTES_LOTE_PADRAO // 1024, help="tamanho máximo de cada arquivo JSON em KB (critérios 'bytes' e 'ncm'; 0 = sem limite)")
+    comum.add_argument('--formato', choices=list(FORMATOS_JSON), default=FORMATO_JSON_PADRAO, help="formato dos arquivos JSON")
+    comum.add_argument('--backend', choices=list(BACKENDS_JSON), default=BACKEND_JSON_PADRAO,
+                       help="codificador JSON (orjson é mais rápido, mas escreve NaN como null)")
+
+    convert = subparsers.add_parser('convert', parents=[comum], help="converte as planilhas em arquivos JSON, sem gravar no banco")
+    convert.add_argument('--saida', required=True, help="pasta onde os arquivos JSON são gravados")
+
+    importar = subparsers.add_parser('import', parents=[comum], help="converte as planilhas e atualiza o banco de dados")
+    importar.add_argument('--banco', default=CAMINHO_BANCO, help=f"arquivo do banco de dados (padrão: {CAMINHO_BANCO})")
+    importar.add_argument('--saida', help="pasta onde os arquivos JSON também são gravados (opcional)")
+    return parser
+
+def main(argv=None):
+    args = criar_parser().parse_args(argv)
+    return executar(args, importar=args.comando == 'import')
+
+if __name__ == "__main__":
+    sys.exit(main())
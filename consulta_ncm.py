@@ -0,0 +1,91 @@
+import re
+
+import pandas as pd
+
+from paginacao import escapar_glob
+
+# Consulta de atributos por NCM (exata, por prefixo e em lote), sem dependência do Streamlit.
+# Todas as consultas são parametrizadas e usam os índices de NCM_X_ATRIB (NCM, ATRIB) e COD_ATRIBUTOS (CODIGO_ATRIB).
+
+COLUNAS_RESULTADO = ['NCM', 'Código do Atributo', 'Descrição do Atributo']
+
+# NCMs e códigos de atributo podem se repetir nas tabelas legadas (sem chave primária):
+# cada par NCM x atributo aparece uma vez e a descrição vem da primeira linha de COD_ATRIBUTOS do código
+_SQL_ATRIBUTOS = '''
+    SELECT n.NCM, n.ATRIB,
+           (SELECT c.NOME_ATRIBUTO FROM COD_ATRIBUTOS AS c WHERE c.CODIGO_ATRIB = n.ATRIB LIMIT 1)
+    FROM (SELECT DISTINCT NCM, ATRIB FROM NCM_X_ATRIB WHERE {condicao}) AS n
+    ORDER BY n.NCM, n.ATRIB
+'''
+
+# Números só valem como NCM ou prefixo quando isolados: dígitos dentro de uma palavra (ATT_10627, PN8708X) são ignorados
+_RE_NCM = re.compile(r'(?<![\w.])(\d{4})\.?(\d{2})\.?(\d{2})(?![\w.])')
+_RE_PREFIXO = re.compile(r'(?<![\w.])(\d{2,7})[%*]?(?![\w.%*])')
+
+def normalizar_ncm(valor):
+    """NCM somente com dígitos (remove pontos e espaços, como em 8708.29.99)."""
+    return re.sub(r'\D', '', str(valor))
+
+def extrair_ncms(texto):
+    """NCMs de 8 dígitos (com ou sem pontos) encontrados em um texto, sem repetições e na ordem em que aparecem."""
+    return list(dict.fromkeys("".join(partes) for partes in _RE_NCM.findall(str(texto))))
+
+def extrair_prefixo(texto):
+    """Primeiro prefixo de NCM (2 a 7 dígitos, com % ou * opcional, como 87 ou 8708%) encontrado no texto, ou None."""
+    encontrado = _RE_PREFIXO.search(str(texto))
+    return encontrado.group(1) if encontrado else None
+
+def _consultar(conn, condicao, parametros):
+    linhas = conn.execute(_SQL_ATRIBUTOS.format(condicao=condicao), parametros).fetchall()
+    return pd.DataFrame(linhas, columns=COLUNAS_RESULTADO)
+
+def atributos_do_ncm(conn, ncm):
+    """Atributos de um NCM."""
+    return _consultar(conn, "NCM = ?", [normalizar_ncm(ncm)])
+
+def atributos_por_prefixo(conn, prefixo):
+    """Atributos de todos os NCMs que começam com o prefixo (capítulo, posição ou subposição, como 87 ou 8708)."""
+    # GLOB com prefixo literal é resolvido como faixa no índice de NCM
+    return _consultar(conn, "NCM GLOB ?", [escapar_glob(normalizar_ncm(prefixo)) + "*"])
+
+def ncms_da_planilha(arquivo):
+    """
+    Lê os NCMs de um arquivo enviado para consulta em lote: coluna NCM de uma planilha (.xlsx/.csv)
+    ou, sem essa coluna, a primeira coluna; arquivos de texto são lidos inteiros.
+    """
+    nome = arquivo.name.lower()
+    if nome.endswith('.txt'):
+        return extrair_ncms(arquivo.read().decode('utf-8', errors='ignore'))
+    if nome.endswith('.csv'):
+        df = pd.read_csv(arquivo, dtype=str, sep=None, engine='python')
+    else:
+        df = pd.read_excel(arquivo, dtype=str, engine='openpyxl')
+    coluna = next((col for col in df.columns if str(col).strip().upper() == 'NCM'), df.columns[0] if len(df.columns) else None)
+    if coluna is None:
+        return []
+    return extrair_ncms(" ".join(df[coluna].dropna().tolist()))
+
+class MapaAtributosNcm:
+    """
+    Mapa em memória NCM -> [(código do atributo, descrição)], carregado com uma única leitura do banco.
+    Usado nas consultas em lote, em que cada NCM da lista é resolvido por dicionário, sem nova consulta.
+    """
+
+    def __init__(self, conn):
+        self.atributos = {}
+        for ncm, atrib, descricao in conn.execute(_SQL_ATRIBUTOS.format(condicao="1")):
+            self.atributos.setdefault(ncm, []).append((atrib, descricao))
+
+    def _como_df(self, ncms):
+        return pd.DataFrame(
+            [(ncm, atrib, descricao) for ncm in ncms for atrib, descricao in self.atributos.get(ncm, [])],
+            columns=COLUNAS_RESULTADO
+        )
+
+    def em_lote(self, ncms):
+        """Atributos de todos os NCMs da lista, na ordem da lista."""
+        return self._como_df([normalizar_ncm(ncm) for ncm in ncms])
+
+    def sem_atributos(self, ncms):
+        """NCMs da lista que não têm nenhum atributo cadastrado."""
+        return [ncm for ncm in (normalizar_ncm(ncm) for ncm in ncms) if ncm not in self.atributos]
@@ -6,6 +6,8 @@ import math
 import io
 import sqlite3
 
+from processamento import ler_tabela, limpar_textos
+
 # --- Funções para Processamento de Dados ---
 # Mantenha as funções 'extrair_valor', 'normalizar_colunas', 'encontrar_coluna',
 # 'converter_para_json' e 'criar_df_pecas' exatamente como na sua última versão.
@@ -202,9 +204,9 @@ create_table()
 uploaded_file = st.file_uploader("Envie sua planilha Excel", type="xlsx")
 
 if uploaded_file:
-    df = pd.read_excel(uploaded_file, engine="openpyxl")
-    # Remove espaços em branco de todas as células do tipo texto
-    df = df.applymap(lambda x: x.strip() if isinstance(x, str) else x)
+    df = ler_tabela(uploaded_file) # Part number e NCM lidos como texto
+    # Remove espaços em branco das colunas de texto (células só com espaços viram vazias)
+    df = limpar_textos(df)
     df = normalizar_colunas(df)
     df = df.dropna(how='all')
 
@@ -0,0 +1,425 @@
+import csv
+import io
+import json
+import math
+import tempfile
+import threading
+import zipfile
+from array import array
+from openpyxl import Workbook
+
+try:
+    import orjson # Codificador rápido opcional; sem ele usamos o módulo json da biblioteca padrão
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow # Opcional: sem ele a exportação em Parquet não é oferecida
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Exportação dos JSONs gerados (arquivos individuais e ZIP) e das tabelas do banco, sem dependência do Streamlit.
+
+TAMANHO_LOTE_PADRAO = 100 # Itens por arquivo JSON quando a divisão é por quantidade de itens
+LIMITE_BYTES_LOTE_PADRAO = 5 * 1024 * 1024 # Tamanho máximo de cada arquivo quando a divisão é por tamanho
+NIVEL_COMPRESSAO_PADRAO = 6 # Nível do DEFLATE no ZIP (0 = sem compressão, 9 = máxima)
+LIMITE_ARQUIVO_EM_MEMORIA = 32 * 1024 * 1024 # Acima deste tamanho o arquivo em montagem passa da memória para um arquivo temporário
+
+# Formatos de saída: rótulo exibido, extensão dos arquivos e tipo MIME
+FORMATOS_JSON = {
+    'indentado': ("JSON indentado (legível)", "json", "application/json"),
+    'compacto': ("JSON compacto (sem espaços)", "json", "application/json"),
+    'ndjson': ("NDJSON (um item por linha)", "ndjson", "application/x-ndjson"),
+}
+FORMATO_JSON_PADRAO = 'indentado'
+BACKENDS_JSON = ('json', 'orjson') if orjson is not None else ('json',)
+# O padrão é sempre o módulo json, para que a saída não dependa do que está instalado na máquina.
+# orjson é opcional e mais rápido, mas escreve NaN como null e não aceita inteiros acima de 64 bits.
+BACKEND_JSON_PADRAO = 'json'
+
+def _item_ndjson_stdlib(item):
+    return json.dumps(item, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b"\n"
+
+def _item_ndjson_orjson(item):
+    return orjson.dumps(item, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY)
+
+def gerar_ndjson(itens, backend=BACKEND_JSON_PADRAO):
+    """Gera as linhas NDJSON (bytes UTF-8, uma por item, terminadas em quebra de linha) sem montar o arquivo inteiro."""
+    serializar_item = _item_ndjson_orjson if backend == 'orjson' else _item_ndjson_stdlib
+    for item in itens:
+        yield serializar_item(item)
+
+def serializar_json(itens, formato=FORMATO_JSON_PADRAO, backend=BACKEND_JSON_PADRAO):
+    """
+    Serializa uma lista de itens em bytes UTF-8 no formato pedido.
+    Com o codificador padrão (json), o formato indentado é idêntico ao de json.dumps(ensure_ascii=False, indent=2).
+    Com orjson, valores NaN saem como null e inteiros acima de 64 bits geram erro.
+    """
+    if formato == 'ndjson':
+        return b"".join(gerar_ndjson(itens, backend))
+    if backend == 'orjson':
+        opcoes = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if formato == 'indentado' else 0)
+        return orjson.dumps(itens, option=opcoes)
+    if formato == 'indentado':
+        return json.dumps(itens, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(itens, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+ITENS_POR_LEITURA = 1000 # Itens lidos do arquivo temporário por vez ao percorrer um ItensEmDisco
+
+class ItensEmDisco:
+    """
+    Lista de itens JSON guardada em um arquivo temporário NDJSON, usada pelas abas processadas em modo streaming.
+    Cada bloco convertido é acrescentado ao arquivo e sai da memória; apenas a posição de cada linha fica guardada.
+    Aceita len(), iteração, índices e fatias, o que basta para calcular_lotes e ExportacaoJson lerem os itens do disco.
+    """
+
+    def __init__(self):
+        self._arquivo = tempfile.TemporaryFile()
+        self._inicios = array('q', [0]) # Posição de cada linha no arquivo, mais o fim da última
+        self._lock = threading.Lock()
+
+    def extend(self, itens):
+        """Acrescenta os itens ao final do arquivo."""
+        with self._lock:
+            self._arquivo.seek(self._inicios[-1])
+            for linha in gerar_ndjson(itens):
+                self._arquivo.write(linha)
+                self._inicios.append(self._inicios[-1] + len(linha))
+
+    def _ler(self, inicio, fim):
+        """Itens das posições inicio..fim-1, lidos do arquivo de uma só vez."""
+        if inicio >= fim:
+            return []
+        with self._lock:
+            self._arquivo.seek(self._inicios[inicio])
+            dados = self._arquivo.read(self._inicios[fim] - self._inicios[inicio])
+        return [json.loads(linha) for linha in dados.split(b"\n")[:-1]]
+
+    def __len__(self):
+        return len(self._inicios) - 1
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            inicio, fim, passo = indice.indices(len(self))
+            if passo == 1:
+                return self._ler(inicio, fim)
+            return [self[posicao] for posicao in range(inicio, fim, passo)]
+        posicao = indice + len(self) if indice < 0 else indice
+        if not 0 <= posicao < len(self):
+            raise IndexError("índice fora do intervalo")
+        return self._ler(posicao, posicao + 1)[0]
+
+    def __iter__(self):
+        for inicio in range(0, len(self), ITENS_POR_LEITURA):
+            yield from self._ler(inicio, min(inicio + ITENS_POR_LEITURA, len(self)))
+
+    def close(self):
+        self._arquivo.close()
+
+# Critérios de divisão dos itens de cada planilha em arquivos
+CRITERIOS_LOTE = {
+    'nenhum': "Um único arquivo por planilha",
+    'itens': "Por quantidade de itens",
+    'bytes': "Por tamanho máximo do arquivo",
+    'ncm': "Um arquivo por NCM",
+}
+CRITERIO_LOTE_PADRAO = 'itens'
+
+def tamanhos_serializados(itens, formato=FORMATO_JSON_PADRAO, backend=BACKEND_JSON_PADRAO):
+    """
+    Quantos bytes cada item ocupa dentro de um arquivo no formato pedido, já contando separador e recuo.
+    Retorna (tamanhos, moldura): o arquivo com os itens i..j-1 tem sum(tamanhos[i:j]) + moldura bytes.
+    """
+    if formato == 'ndjson':
+        return [len(linha) for linha in gerar_ndjson(itens, backend)], 0
+    if formato == 'compacto':
+        # "[" + itens separados por "," + "]"
+        return [len(serializar_json(item, 'compacto', backend)) + 1 for item in itens], 1
+    # Dentro da lista indentada cada linha do item ganha 2 espaços e os itens são separados por ",\n";
+    # a lista acrescenta "[\n" e "\n]"
+    tamanhos = []
+    for item in itens:
+        dados = serializar_json(item, 'indentado', backend)
+        tamanhos.append(len(dados) + 2 * (dados.count(b"\n") + 1) + 2)
+    return tamanhos, 2
+
+def cortar_por_bytes(tamanhos, limite_bytes, moldura=0):
+    """
+    Divide uma sequência de itens em fatias contíguas (inicio, fim) cujo arquivo não passe de limite_bytes.
+    Uma única passada gulosa: cada fatia recebe o máximo de itens que cabe, o que resulta no menor número de arquivos.
+    Um item que sozinho já passa do limite fica em um arquivo só para ele.
+    """
+    fatias = []
+    inicio = 0
+    acumulado = moldura
+    for posicao, tamanho in enumerate(tamanhos):
+        if posicao > inicio and acumulado + tamanho > limite_bytes:
+            fatias.append((inicio, posicao))
+            inicio = posicao
+            acumulado = moldura
+        acumulado += tamanho
+    if inicio < len(tamanhos):
+        fatias.append((inicio, len(tamanhos)))
+    return fatias
+
+def calcular_lotes(itens, criterio=CRITERIO_LOTE_PADRAO, tamanho_lote=TAMANHO_LOTE_PADRAO, limite_bytes=None,
+                   formato=FORMATO_JSON_PADRAO, backend=BACKEND_JSON_PADRAO):
+    """
+    Define os arquivos de uma planilha como uma lista de (sufixo, indices), onde indices é um range
+    (fatia contígua) ou uma lista de posições em itens. O sufixo vazio indica um arquivo único.
+    No critério 'ncm', limite_bytes (opcional) ainda divide NCMs que não caibam em um único arquivo.
+    """
+    if criterio == 'nenhum' or (criterio == 'bytes' and not limite_bytes):
+        return [("", range(len(itens)))]
+    if criterio == 'itens':
+        total_lotes = math.ceil(len(itens) / tamanho_lote)
+        return [
+            (f"_lote_{i+1}", range(i * tamanho_lote, min((i + 1) * tamanho_lote, len(itens))))
+            for i in range(total_lotes)
+        ]
+    if criterio == 'bytes':
+        tamanhos, moldura = tamanhos_serializados(itens, formato, backend)
+        return [
+            (f"_lote_{i+1}", range(inicio, fim))
+            for i, (inicio, fim) in enumerate(cortar_por_bytes(tamanhos, limite_bytes, moldura))
+        ]
+    if criterio == 'ncm':
+        posicoes_por_ncm = {}
+        for posicao, item in enumerate(itens):
+            posicoes_por_ncm.setdefault(str(item.get('ncm', '')), []).append(posicao)
+        tamanhos, moldura = tamanhos_serializados(itens, formato, backend) if limite_bytes else (None, 0)
+        lotes = []
+        for ncm, posicoes in posicoes_por_ncm.items():
+            if not limite_bytes:
+                lotes.append((f"_ncm_{ncm}", posicoes))
+                continue
+            fatias = cortar_por_bytes([tamanhos[posicao] for posicao in posicoes], limite_bytes, moldura)
+            if len(fatias) == 1:
+                lotes.append((f"_ncm_{ncm}", posicoes))
+            else:
+                lotes.extend((f"_ncm_{ncm}_lote_{i+1}", posicoes[inicio:fim]) for i, (inicio, fim) in enumerate(fatias))
+        return lotes
+    raise ValueError(f"Critério de divisão desconhecido: {criterio}")
+
+class _SaidaEmPedacos:
+    """Destino de escrita não posicionável para o zipfile: acumula os bytes até serem retirados."""
+
+    def __init__(self):
+        self._pedacos = []
+
+    def write(self, dados):
+        self._pedacos.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        dados = b"".join(self._pedacos)
+        self._pedacos = []
+        return dados
+
+def gerar_zip(membros, nivel_compressao=NIVEL_COMPRESSAO_PADRAO):
+    """
+    Gera um arquivo ZIP em pedaços a partir de um iterável de (nome_arquivo, conteudo_bytes).
+    Cada membro é comprimido e devolvido assim que é lido, sem manter o arquivo completo em memória.
+    """
+    saida = _SaidaEmPedacos()
+    with zipfile.ZipFile(saida, "w", zipfile.ZIP_DEFLATED, compresslevel=nivel_compressao) as zip_file:
+        for nome_arquivo, conteudo in membros:
+            zip_file.writestr(nome_arquivo, conteudo)
+            yield saida.retirar()
+    yield saida.retirar() # Diretório central, escrito ao fechar o ZIP
+
+class ExportacaoJson:
+    """
+    Organiza os JSONs gerados em arquivos para download e os serializa sob demanda.
+    Cada arquivo só é convertido em texto na primeira vez em que é pedido (botão individual ou ZIP);
+    o resultado fica guardado e é reaproveitado pelos dois caminhos.
+    """
+
+    def __init__(self, jsons_gerados, criterio_lote=CRITERIO_LOTE_PADRAO, tamanho_lote=TAMANHO_LOTE_PADRAO,
+                 limite_bytes=LIMITE_BYTES_LOTE_PADRAO, formato=FORMATO_JSON_PADRAO, backend=BACKEND_JSON_PADRAO):
+        self.jsons_gerados = jsons_gerados
+        self.formato = formato
+        self.backend = backend
+        _, extensao, self.mime = FORMATOS_JSON[formato]
+        self.arquivos = [] # (nome_arquivo, nome_base, indices), na ordem de exibição
+        for nome_base, json_data in jsons_gerados.items():
+            for sufixo, indices in calcular_lotes(json_data, criterio_lote, tamanho_lote, limite_bytes, formato, backend):
+                self.arquivos.append((f"{nome_base}{sufixo}.{extensao}", nome_base, indices))
+        self._posicoes = {arquivo[0]: arquivo for arquivo in self.arquivos}
+        self._serializados = {}
+        self._lock = threading.Lock()
+
+    def _serializar(self, nome_base, indices):
+        itens = self.jsons_gerados[nome_base]
+        if isinstance(indices, range):
+            itens = itens[indices.start:indices.stop]
+        else:
+            itens = [itens[posicao] for posicao in indices]
+        return serializar_json(itens, self.formato, self.backend)
+
+    def conteudo(self, nome_arquivo):
+        """Conteúdo (bytes UTF-8) de um arquivo, serializado apenas na primeira chamada."""
+        with self._lock:
+            dados = self._serializados.get(nome_arquivo)
+        if dados is None:
+            _, nome_base, indices = self._posicoes[nome_arquivo]
+            dados = self._serializar(nome_base, indices)
+            with self._lock:
+                self._serializados[nome_arquivo] = dados
+        return dados
+
+    def membros(self):
+        """
+        Percorre os arquivos na ordem de exibição devolvendo (nome_arquivo, conteudo).
+        Serializações já feitas são reaproveitadas; as demais são descartadas após o uso para manter a memória estável.
+        """
+        for nome_arquivo, nome_base, indices in self.arquivos:
+            with self._lock:
+                dados = self._serializados.get(nome_arquivo)
+            if dados is None:
+                dados = self._serializar(nome_base, indices)
+            yield nome_arquivo, dados
+
+    def produtor(self, nome_arquivo):
+        """Função sem argumentos que devolve o conteúdo do arquivo, para geração no momento do download."""
+        return lambda: self.conteudo(nome_arquivo)
+
+    def zip_em_arquivo(self, nivel_compressao=NIVEL_COMPRESSAO_PADRAO):
+        """
+        Monta o ZIP com todos os arquivos JSON em um arquivo temporário (em memória até LIMITE_ARQUIVO_EM_MEMORIA, depois em disco).
+        Devolve o arquivo posicionado no início; quem chama é responsável por fechá-lo.
+        """
+        arquivo = tempfile.SpooledTemporaryFile(max_size=LIMITE_ARQUIVO_EM_MEMORIA)
+        for pedaco in gerar_zip(self.membros(), nivel_compressao):
+            arquivo.write(pedaco)
+        arquivo.seek(0)
+        return arquivo
+
+    def zip(self, nivel_compressao=NIVEL_COMPRESSAO_PADRAO):
+        """Conteúdo do ZIP com todos os arquivos JSON, lido uma única vez do arquivo temporário."""
+        with self.zip_em_arquivo(nivel_compressao) as arquivo:
+            return arquivo.read()
+
+    def produtor_zip(self, nivel_compressao=NIVEL_COMPRESSAO_PADRAO):
+        """Função sem argumentos que gera o ZIP no momento do download."""
+        return lambda: self.zip(nivel_compressao)
+
+
+# --- Exportação de tabelas do banco ---
+
+TAMANHO_LOTE_LEITURA = 5000 # Linhas lidas do cursor por vez durante a exportação
+
+# Formatos de exportação de tabelas: rótulo exibido, extensão e tipo MIME
+FORMATOS_TABELA = {
+    'xlsx': ("Excel (.xlsx)", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    'csv': ("CSV (.csv)", "csv", "text/csv"),
+}
+if pyarrow is not None:
+    FORMATOS_TABELA['parquet'] = ("Parquet (.parquet)", "parquet", "application/vnd.apache.parquet")
+
+def ler_em_lotes(cursor, tamanho_lote=TAMANHO_LOTE_LEITURA):
+    """Percorre o resultado de um cursor em listas de até tamanho_lote linhas."""
+    while True:
+        linhas = cursor.fetchmany(tamanho_lote)
+        if not linhas:
+            return
+        yield linhas
+
+def _escrever_xlsx(lotes, cabecalho, destino, nome_aba):
+    # No modo write_only o openpyxl grava cada linha assim que ela é adicionada, sem manter a planilha em memória
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(nome_aba)
+    worksheet.append(cabecalho)
+    for linhas in lotes:
+        for linha in linhas:
+            worksheet.append(linha)
+    workbook.save(destino)
+
+def _escrever_csv(lotes, cabecalho, destino):
+    # BOM no início para que o Excel reconheça o UTF-8 ao abrir o arquivo
+    texto = io.TextIOWrapper(destino, encoding='utf-8-sig', newline='')
+    writer = csv.writer(texto)
+    writer.writerow(cabecalho)
+    for linhas in lotes:
+        writer.writerows(linhas)
+    texto.flush()
+    texto.detach() # Mantém o destino aberto para quem chamou
+
+def _tipo_parquet(tipo_declarado):
+    tipo_declarado = (tipo_declarado or "").upper()
+    if "INT" in tipo_declarado:
+        return pyarrow.int64()
+    if any(tipo in tipo_declarado for tipo in ("REAL", "FLOA", "DOUB")):
+        return pyarrow.float64()
+    return pyarrow.string()
+
+def _tipos_parquet(conn, tabela_sql, info_colunas):
+    """
+    Tipo Parquet de cada coluna a partir do tipo declarado. O SQLite não impõe tipos: uma coluna INTEGER ou REAL
+    que guarda algum valor de outro tipo (texto, por exemplo) é exportada como texto, sem perder valores.
+    """
+    tipos = []
+    for col in info_colunas:
+        tipo = _tipo_parquet(col[2])
+        if tipo != pyarrow.string():
+            aceitos = ('null', 'integer') if tipo == pyarrow.int64() else ('null', 'integer', 'real')
+            coluna_sql = '"' + col[1].replace('"', '""') + '"'
+            misturada, = conn.execute(
+                f"SELECT EXISTS (SELECT 1 FROM {tabela_sql} WHERE typeof({coluna_sql}) NOT IN ({', '.join('?' * len(aceitos))}))",
+                aceitos
+            ).fetchone()
+            if misturada:
+                tipo = pyarrow.string()
+        tipos.append(tipo)
+    return tipos
+
+def _escrever_parquet(lotes, cabecalho, tipos, destino):
+    esquema = pyarrow.schema(list(zip(cabecalho, tipos)))
+    # O SQLite não impõe tipos: valores de colunas de texto são convertidos para que cada lote siga o esquema
+    colunas_texto = [campo.type == pyarrow.string() for campo in esquema]
+    with pyarrow.parquet.ParquetWriter(destino, esquema) as writer:
+        for linhas in lotes:
+            colunas = [
+                [None if valor is None else str(valor) for valor in coluna] if texto else list(coluna)
+                for coluna, texto in zip(zip(*linhas), colunas_texto)
+            ]
+            writer.write_table(pyarrow.Table.from_arrays(colunas, schema=esquema))
+
+def exportar_tabela(conn, tabela, formato, destino, renomear_colunas=None, nome_aba=None):
+    """
+    Escreve todas as linhas de uma tabela em destino (arquivo binário aberto) no formato pedido.
+    As linhas vêm do cursor em lotes de TAMANHO_LOTE_LEITURA, de modo que a memória não cresce com o tamanho da tabela.
+    renomear_colunas troca os nomes das colunas no cabeçalho; nome_aba é usado apenas no Excel.
+    """
+    if formato not in FORMATOS_TABELA:
+        raise ValueError(f"Formato de exportação indisponível: {formato}")
+    tabela_sql = '"' + tabela.replace('"', '""') + '"'
+    info_colunas = conn.execute(f"PRAGMA table_info({tabela_sql})").fetchall()
+    if not info_colunas:
+        raise ValueError(f"Tabela inexistente: {tabela}")
+    renomear_colunas = renomear_colunas or {}
+    cabecalho = [renomear_colunas.get(col[1], col[1]) for col in info_colunas]
+    colunas_sql = ", ".join('"' + col[1].replace('"', '""') + '"' for col in info_colunas)
+
+    cursor = conn.execute(f"SELECT {colunas_sql} FROM {tabela_sql}")
+    lotes = ler_em_lotes(cursor)
+    if formato == 'xlsx':
+        _escrever_xlsx(lotes, cabecalho, destino, nome_aba or tabela[:31])
+    elif formato == 'csv':
+        _escrever_csv(lotes, cabecalho, destino)
+    else:
+        _escrever_parquet(lotes, cabecalho, _tipos_parquet(conn, tabela_sql, info_colunas), destino)
+
+def exportar_tabela_em_arquivo(conn, tabela, formato, renomear_colunas=None, nome_aba=None):
+    """
+    Exporta a tabela para um arquivo temporário (em memória até LIMITE_ARQUIVO_EM_MEMORIA, depois em disco).
+    Devolve o arquivo posicionado no início; quem chama é responsável por fechá-lo.
+    """
+    arquivo = tempfile.SpooledTemporaryFile(max_size=LIMITE_ARQUIVO_EM_MEMORIA)
+    exportar_tabela(conn, tabela, formato, arquivo, renomear_colunas, nome_aba)
+    arquivo.seek(0)
+    return arquivo
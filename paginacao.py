@@ -0,0 +1,160 @@
+import pandas as pd
+
+# Consultas paginadas às tabelas do banco, sem dependência do Streamlit.
+# A paginação é por chave (keyset): cada página continua a partir da chave da última linha da anterior,
+# então abrir a página N custa o mesmo que abrir a primeira, sem OFFSET.
+
+TAMANHO_PAGINA_PADRAO = 50
+
+OPERADORES_FILTRO = {
+    'contem': "contém",
+    'comeca': "começa com",
+    'igual': "igual a",
+}
+
+def _identificador(nome):
+    """Nome de tabela/coluna entre aspas duplas para uso seguro no SQL."""
+    return '"' + str(nome).replace('"', '""') + '"'
+
+def _coluna_chave(nome):
+    """Coluna de ordenação no SQL; o rowid é uma pseudocoluna e não leva aspas."""
+    return 'rowid' if nome == 'rowid' else _identificador(nome)
+
+def escapar_glob(texto):
+    """Escapa os caracteres especiais do GLOB para buscar o texto literalmente."""
+    return "".join(f"[{c}]" if c in "*?[" else c for c in texto)
+
+def listar_tabelas(conn):
+    """Nomes das tabelas de usuário do banco."""
+    return [linha[0] for linha in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    )]
+
+def colunas_tabela(conn, tabela):
+    """Colunas da tabela, na ordem de definição."""
+    return [col[1] for col in conn.execute(f"PRAGMA table_info({_identificador(tabela)})")]
+
+def colunas_ordenaveis(conn, tabela):
+    """Colunas que lideram algum índice (inclusive a chave primária): ordenar por elas não exige ler a tabela inteira."""
+    colunas = []
+    for indice in conn.execute(f"PRAGMA index_list({_identificador(tabela)})").fetchall():
+        info = conn.execute(f"PRAGMA index_info({_identificador(indice[1])})").fetchall()
+        if info and info[0][2] is not None and info[0][2] not in colunas:
+            colunas.append(info[0][2])
+    # Chave primária INTEGER é o próprio rowid e não aparece em index_list
+    for col in conn.execute(f"PRAGMA table_info({_identificador(tabela)})").fetchall():
+        if col[5] == 1 and col[2].upper() == 'INTEGER' and col[1] not in colunas:
+            colunas.append(col[1])
+    return colunas
+
+def colunas_desempate(conn, tabela):
+    """Colunas que identificam cada linha de forma única: o rowid ou, em tabelas WITHOUT ROWID, a chave primária."""
+    try:
+        conn.execute(f"SELECT rowid FROM {_identificador(tabela)} LIMIT 0")
+        return ['rowid']
+    except Exception:
+        info = conn.execute(f"PRAGMA table_info({_identificador(tabela)})").fetchall()
+        return [col[1] for col in sorted(info, key=lambda col: col[5]) if col[5] > 0]
+
+class ConsultaPaginada:
+    """
+    Consulta a uma tabela com ordenação e filtro feitos no banco, lida uma página por vez.
+    O cursor de cada página é a tupla de valores de ordenação da última linha da página anterior.
+    """
+
+    def __init__(self, conn, tabela, ordenar_por=None, decrescente=False, filtro_coluna=None,
+                 filtro_operador='contem', filtro_valor=None, tamanho_pagina=TAMANHO_PAGINA_PADRAO):
+        if tabela not in listar_tabelas(conn):
+            raise ValueError(f"Tabela inexistente: {tabela}")
+        colunas = colunas_tabela(conn, tabela)
+        if ordenar_por is not None and ordenar_por not in colunas:
+            raise ValueError(f"Coluna de ordenação inexistente: {ordenar_por}")
+        if filtro_coluna is not None and filtro_coluna not in colunas:
+            raise ValueError(f"Coluna de filtro inexistente: {filtro_coluna}")
+        if filtro_operador not in OPERADORES_FILTRO:
+            raise ValueError(f"Operador de filtro desconhecido: {filtro_operador}")
+
+        self.tabela = tabela
+        self.ordenar_por = ordenar_por
+        self.decrescente = decrescente
+        self.tamanho_pagina = tamanho_pagina
+        desempate = colunas_desempate(conn, tabela)
+        self.chaves = ([ordenar_por] if ordenar_por is not None else []) + [col for col in desempate if col != ordenar_por]
+
+        self._filtro_sql, self._filtro_parametros = "", []
+        if filtro_coluna is not None and filtro_valor not in (None, ""):
+            coluna = _identificador(filtro_coluna)
+            if filtro_operador == 'igual':
+                self._filtro_sql, self._filtro_parametros = f"{coluna} = ?", [filtro_valor]
+            elif filtro_operador == 'comeca':
+                # GLOB com prefixo literal aproveita o índice da coluna
+                self._filtro_sql, self._filtro_parametros = f"{coluna} GLOB ?", [escapar_glob(filtro_valor) + "*"]
+            else:
+                self._filtro_sql, self._filtro_parametros = f"instr({coluna}, ?) > 0", [filtro_valor]
+
+    @property
+    def filtrada(self):
+        return bool(self._filtro_sql)
+
+    def contar(self, conn):
+        """Total de linhas que atendem ao filtro (sem filtro, o SQLite conta pelo menor índice da tabela)."""
+        where = f" WHERE {self._filtro_sql}" if self._filtro_sql else ""
+        return conn.execute(f"SELECT COUNT(*) FROM {_identificador(self.tabela)}{where}", self._filtro_parametros).fetchone()[0]
+
+    def _trechos(self, cursor):
+        """
+        Condições (sql, parametros) dos trechos a ler, em ordem, para continuar a partir do cursor.
+        A comparação de tuplas (coluna, desempate) > (?, ?) usa o índice para ir direto ao ponto de partida,
+        mas nunca é verdadeira para NULL; por isso as linhas com NULL na coluna de ordenação formam um trecho
+        à parte, lido antes das demais na ordem crescente e depois delas na decrescente.
+        """
+        comparador = "<" if self.decrescente else ">"
+        chaves_sql = [_coluna_chave(col) for col in self.chaves]
+        if self.ordenar_por is None:
+            if cursor is None:
+                return [("1", [])]
+            return [(f"({', '.join(chaves_sql)}) {comparador} ({', '.join('?' * len(cursor))})", list(cursor))]
+
+        coluna, desempate_sql = chaves_sql[0], ", ".join(chaves_sql[1:])
+        nulos, nao_nulos = (f"{coluna} IS NULL", []), (f"{coluna} IS NOT NULL", [])
+        if cursor is None:
+            return [nao_nulos, nulos] if self.decrescente else [nulos, nao_nulos]
+        if cursor[0] is None:
+            depois_nulos = (
+                f"{coluna} IS NULL AND ({desempate_sql}) {comparador} ({', '.join('?' * (len(cursor) - 1))})",
+                list(cursor[1:])
+            )
+            return [depois_nulos] if self.decrescente else [depois_nulos, nao_nulos]
+        depois_valor = (f"({', '.join(chaves_sql)}) {comparador} ({', '.join('?' * len(cursor))})", list(cursor))
+        return [depois_valor, nulos] if self.decrescente else [depois_valor]
+
+    def pagina(self, conn, cursor=None):
+        """
+        Lê uma página a partir do cursor (None para a primeira).
+        Retorna (DataFrame da página, cursor da próxima página ou None se esta for a última).
+        """
+        direcao = " DESC" if self.decrescente else ""
+        colunas_chave = ", ".join(f"{_coluna_chave(col)} AS _chave_{i}" for i, col in enumerate(self.chaves))
+        ordem = ", ".join(f"{_coluna_chave(col)}{direcao}" for col in self.chaves)
+        filtro = f" AND ({self._filtro_sql})" if self._filtro_sql else ""
+
+        # Uma linha a mais indica se existe próxima página
+        linhas, nomes = [], None
+        for condicao, parametros in self._trechos(cursor):
+            faltam = self.tamanho_pagina + 1 - len(linhas)
+            if faltam <= 0:
+                break
+            resultado = conn.execute(
+                f"SELECT {colunas_chave}, * FROM {_identificador(self.tabela)} WHERE ({condicao}){filtro} ORDER BY {ordem} LIMIT ?",
+                parametros + self._filtro_parametros + [faltam]
+            )
+            nomes = [descricao[0] for descricao in resultado.description]
+            linhas.extend(resultado.fetchall())
+
+        total_chaves = len(self.chaves)
+        proximo_cursor = None
+        if len(linhas) > self.tamanho_pagina:
+            linhas = linhas[:self.tamanho_pagina]
+            proximo_cursor = tuple(linhas[-1][:total_chaves])
+        df = pd.DataFrame([linha[total_chaves:] for linha in linhas], columns=nomes[total_chaves:])
+        return df, proximo_cursor
@@ -0,0 +1,727 @@
+import pandas as pd
+import numpy as np
+import json
+import re
+import unicodedata
+import io
+from collections import Counter
+from typing import NamedTuple
+import openpyxl
+
+# Núcleo de leitura, conversão e validação das planilhas, sem dependência do Streamlit.
+# As funções daqui podem rodar em processos separados (pool de processos da Aba 1 e da linha de comando).
+
+TAMANHO_BLOCO_STREAMING = 5000 # Linhas lidas e processadas por vez no modo streaming
+LIMITE_STREAMING_BYTES = 20 * 1024 * 1024 # Arquivos maiores que isso são processados em modo streaming automaticamente
+
+def extrair_valor(categoria):
+    """Extrai o valor antes do hífen em uma string."""
+    if pd.isna(categoria):
+        return ""
+    return str(categoria).split('-')[0].strip()
+
+def normalizar_nome_coluna(col):
+    """Normaliza o nome de uma coluna, removendo acentos e espaços."""
+    return unicodedata.normalize('NFKD', col).encode('ascii', 'ignore').decode('utf-8').strip()
+
+def normalizar_colunas(df):
+    """Normaliza os nomes das colunas, removendo acentos e espaços."""
+    df.columns = [normalizar_nome_coluna(col) for col in df.columns]
+    return df
+
+def chave_coluna(nome):
+    """Forma canônica de um nome de coluna para comparação: sem acentos, minúscula e com espaços, hífens e _ unificados."""
+    return re.sub(r'[\s_\-]+', '_', normalizar_nome_coluna(str(nome)).lower()).strip('_')
+
+# Nomes alternativos aceitos para os campos principais da planilha, comparados apenas por igualdade
+ALIASES_CAMPOS = {
+    'PART_NUMBER': ('partnumber', 'codigo_interno', 'codigo_da_peca', 'pn'),
+    'NCM': ('codigo_ncm',),
+    'Descricao': ('descricao_do_produto',),
+    'Denominacao': ('denominacao_do_produto',),
+}
+
+def texto_chave(valor):
+    """
+    Valor de uma célula de coluna-chave como texto, para comparação por igualdade:
+    números inteiros sem o '.0' da leitura como float e células vazias como NaN.
+    """
+    if pd.isna(valor):
+        return np.nan
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    texto = str(valor).strip()
+    return texto if texto else np.nan
+
+def ncm_como_texto(valor):
+    """
+    NCM como texto de 8 dígitos. Valores de 7 dígitos, numéricos ou em texto (CSV), recebem de volta o zero à esquerda
+    perdido ao passar por um número (1012100 -> 01012100); texto no formato 0000.00.00 perde os pontos.
+    Os demais valores ficam como estão.
+    """
+    texto = texto_chave(valor)
+    if not isinstance(texto, str):
+        return texto
+    if re.fullmatch(r'\d{4}\.\d{2}\.\d{2}', texto):
+        return texto.replace('.', '')
+    return texto.zfill(8) if texto.isdigit() and len(texto) == 7 else texto
+
+# Esquema de leitura: colunas-chave lidas como texto já na leitura da planilha (converters do pandas)
+CONVERSORES_CHAVE = {
+    'PART_NUMBER': texto_chave,
+    'NCM': ncm_como_texto,
+}
+
+class ResolvedorColunas:
+    """
+    Localiza as colunas de uma planilha pelo nome, construído uma vez para o conjunto de colunas e compartilhado
+    por todas as etapas (conversão, validação e NCM_X_ATRIB), para que todas resolvam os campos da mesma forma.
+    A busca segue a ordem: nome exato, aliases exatos e, por fim, o nome como parte do nome da coluna.
+    Os campos de ALIASES_CAMPOS são resolvidos na construção; os demais, na primeira consulta.
+    """
+
+    def __init__(self, colunas):
+        self.colunas = list(colunas)
+        self._chaves = [chave_coluna(col) for col in self.colunas]
+        self._exatas = {}
+        for posicao, chave in enumerate(self._chaves):
+            self._exatas.setdefault(chave, posicao) # Em nomes repetidos vale a primeira coluna
+        self._posicoes = {campo: self._resolver(campo) for campo in ALIASES_CAMPOS}
+
+    def _resolver(self, nome):
+        chave = chave_coluna(nome)
+        for candidata in (chave,) + ALIASES_CAMPOS.get(nome, ()):
+            if candidata in self._exatas:
+                return self._exatas[candidata]
+        return next((posicao for posicao, chave_col in enumerate(self._chaves) if chave in chave_col), None)
+
+    def posicao(self, nome):
+        """Posição da coluna correspondente ao nome, ou None se não houver."""
+        if nome not in self._posicoes:
+            self._posicoes[nome] = self._resolver(nome)
+        return self._posicoes[nome]
+
+    def coluna(self, nome):
+        """Nome original da coluna correspondente, ou None se não houver."""
+        posicao = self.posicao(nome)
+        return None if posicao is None else self.colunas[posicao]
+
+    def valores(self, df, nome, padrao=""):
+        """
+        Valores da coluna correspondente em um DataFrame com as mesmas colunas (na mesma ordem, mesmo que renomeadas),
+        ou uma lista com o valor padrão se a coluna não existir.
+        """
+        posicao = self.posicao(nome)
+        if posicao is None:
+            return [padrao] * len(df)
+        return df.iloc[:, posicao].tolist()
+
+    def textos(self, df, nome):
+        """
+        Valores da coluna como texto, com "" nas células vazias. Colunas lidas pelo esquema de leitura já chegam
+        como texto; as demais (de DataFrames montados de outra forma) passam pelo conversor do campo.
+        """
+        posicao = self.posicao(nome)
+        if posicao is None:
+            return [""] * len(df)
+        serie = df.iloc[:, posicao]
+        if not isinstance(serie.dtype, pd.CategoricalDtype) and pd.api.types.infer_dtype(serie, skipna=True) not in ('string', 'empty'):
+            serie = serie.map(CONVERSORES_CHAVE.get(nome, texto_chave))
+        return serie.astype(object).where(serie.notna(), "").tolist()
+
+    def conversores(self):
+        """Conversores de leitura (converters do pandas, por posição) das colunas-chave encontradas."""
+        conversores = {}
+        for campo, conversor in CONVERSORES_CHAVE.items():
+            posicao = self.posicao(campo)
+            if posicao is not None:
+                conversores.setdefault(posicao, conversor)
+        return conversores
+
+class RegistroPeca(NamedTuple):
+    """Campos principais de uma linha da planilha; part number e NCM já como texto ("" quando vazios)."""
+    part_number: str
+    ncm: str
+    descricao: object
+    denominacao: object
+
+def registros_pecas(df, resolvedor=None):
+    """Campos principais de cada linha do DataFrame, como RegistroPeca, na ordem das linhas."""
+    if resolvedor is None:
+        resolvedor = ResolvedorColunas(df.columns)
+    return [RegistroPeca(*campos) for campos in zip(
+        resolvedor.textos(df, "PART_NUMBER"),
+        resolvedor.textos(df, "NCM"),
+        resolvedor.valores(df, "Descricao"),
+        resolvedor.valores(df, "Denominacao"),
+    )]
+
+# Tipo string com ausentes como NaN (o padrão do pandas 3); em versões sem ele, as colunas de texto ficam como object
+try:
+    TIPO_TEXTO = pd.StringDtype(na_value=np.nan)
+except TypeError:
+    TIPO_TEXTO = None
+
+# Colunas de texto com até esta proporção de valores distintos viram categoria (NCM, respostas ok/nok etc.)
+PROPORCAO_MAXIMA_CATEGORIAS = 0.5
+
+def limpar_textos(df):
+    """
+    Remove os espaços nas pontas dos textos e troca textos vazios por ausentes (NaN), uma coluna por vez e
+    apenas nas colunas de texto (object/string), com as operações vetorizadas de .str.
+    Colunas só com textos passam para o tipo string ou, quando os valores se repetem muito, para categoria;
+    colunas com textos misturados a números ou datas continuam object, com os demais valores intactos.
+    """
+    df = df.copy()
+    for posicao, tipo in enumerate(df.dtypes):
+        if not (pd.api.types.is_object_dtype(tipo) or pd.api.types.is_string_dtype(tipo)):
+            continue
+        serie = df.iloc[:, posicao]
+        conteudo = pd.api.types.infer_dtype(serie, skipna=True)
+        if conteudo not in ('string', 'mixed', 'mixed-integer'):
+            continue
+
+        # .str devolve NaN nas células que não são texto
+        limpos = serie.str.strip()
+        so_texto = conteudo == 'string'
+        if not so_texto:
+            limpos = limpos.where(limpos.notna(), serie)
+        limpos = limpos.mask(limpos == "")
+
+        if so_texto and limpos.notna().any():
+            if limpos.nunique() <= PROPORCAO_MAXIMA_CATEGORIAS * limpos.count():
+                limpos = limpos.astype('category')
+            elif TIPO_TEXTO is not None:
+                limpos = limpos.astype(TIPO_TEXTO)
+        df.isetitem(posicao, limpos)
+    return df
+
+def validar_formato_atributos(df):
+    """Verifica se há colunas de atributos com formato potencialmente incorreto (ex: AXT_ em vez de ATT_)."""
+    colunas_problematicas = []
+    # Regex para encontrar padrões como 'XXX_12345' que não começam com ATT
+    padrao_atributo = re.compile(r'^[A-Z]{3}_\d+$', re.IGNORECASE)
+
+    for col in df.columns:
+        if padrao_atributo.match(col) and not col.upper().startswith('ATT_'):
+            colunas_problematicas.append(col)
+    
+    return colunas_problematicas
+
+def mapear_colunas_atributos(colunas):
+    """
+    Identifica as colunas de atributos nos padrões "ATT_..." e "Nome - ATT_...".
+    Para cada uma, retorna o código usado no JSON e na NCM_X_ATRIB e o nome/código usados na COD_ATRIBUTOS.
+    """
+    colunas_atributos = []
+    for nome_original in colunas:
+        nome_upper = nome_original.upper()
+        codigo_normalizado = normalizar_nome_coluna(nome_original).upper()
+        direto = codigo_normalizado.startswith('ATT_') # Apenas estas entram no JSON e na NCM_X_ATRIB
+
+        if ' - ATT_' in nome_upper:
+            nome_atributo, codigo_atrib = nome_original.rsplit(' - ', 1)
+            nome_atributo, codigo_atrib = nome_atributo.strip(), codigo_atrib.strip()
+        elif direto:
+            nome_atributo = codigo_atrib = codigo_normalizado
+        else:
+            continue
+
+        colunas_atributos.append({
+            'coluna': nome_original,
+            'codigo': codigo_normalizado if direto else codigo_atrib,
+            'direto': direto,
+            'nome_atributo': nome_atributo,
+            'codigo_atrib': codigo_atrib
+        })
+    return colunas_atributos
+
+def classificar_coluna_atributo(serie, attr_code):
+    """
+    Classifica de uma só vez todas as células preenchidas de uma coluna de atributo.
+    Retorna as posições das linhas preenchidas, os valores já tratados (ok/nok, texto puro ou extrair_valor)
+    e se cada valor é booleano.
+    """
+    preenchidos = serie.notna().to_numpy()
+    if not preenchidos.any():
+        return [], [], []
+
+    texto = serie[preenchidos].astype(str)
+    normalizado = texto.str.strip().str.lower()
+
+    if attr_code == 'ATT_10824':
+        # Tratamento de texto puro para caso especial
+        valores = texto.str.strip()
+    else:
+        # Tratamento padrão (mesma regra de extrair_valor, aplicada à coluna inteira)
+        valores = texto.str.split('-', n=1).str[0].str.strip()
+
+    # Tratamento booleano tem prioridade sobre os demais
+    valores = valores.mask(normalizado == 'ok', 'true').mask(normalizado == 'nok', 'false')
+    booleanos = normalizado.isin(['ok', 'nok'])
+
+    return preenchidos.nonzero()[0].tolist(), valores.tolist(), booleanos.tolist()
+
+def extrair_tabela_atributos(df_original):
+    """
+    Classifica uma única vez todas as células de atributos da aba e devolve uma tabela "longa",
+    com uma linha por célula preenchida: posição da linha, coluna de origem, código do atributo,
+    valor normalizado e se o valor é booleano (ok/nok).
+    JSON, NCM_X_ATRIB e COD_ATRIBUTOS são projetados a partir desta tabela.
+    """
+    colunas_atributos = mapear_colunas_atributos(df_original.columns)
+    dados = {'linha': [], 'coluna': [], 'ATRIB': [], 'valor': [], 'booleano': [], 'direto': []}
+
+    for indice, spec in enumerate(colunas_atributos):
+        posicoes, valores, booleanos = classificar_coluna_atributo(df_original[spec['coluna']], spec['codigo'])
+        dados['linha'].extend(posicoes)
+        dados['coluna'].extend([indice] * len(posicoes))
+        dados['ATRIB'].extend([spec['codigo']] * len(posicoes))
+        dados['valor'].extend(valores)
+        dados['booleano'].extend(booleanos)
+        dados['direto'].extend([spec['direto']] * len(posicoes))
+
+    tabela = pd.DataFrame(dados).astype({'linha': 'int64', 'coluna': 'int64', 'ATRIB': 'object', 'valor': 'object', 'booleano': 'bool', 'direto': 'bool'})
+    tabela.attrs['colunas_atributos'] = colunas_atributos
+    return tabela
+
+def converter_para_json(df, progress_bar=None, cpf_cnpj_raiz_selecionado=None, tabela_atributos=None, seq_inicial=1, resolvedor=None):
+    """Converte um DataFrame em uma lista de dicionários no formato JSON desejado de forma dinâmica."""
+    total_rows = len(df)
+    if resolvedor is None:
+        resolvedor = ResolvedorColunas(df.columns)
+
+    if tabela_atributos is None:
+        tabela_atributos = extrair_tabela_atributos(df)
+    if progress_bar:
+        progress_bar.progress(0.5)
+
+    # Distribui os atributos para as linhas; a tabela já está na ordem das colunas da planilha
+    atributos_por_linha = [[] for _ in range(total_rows)]
+    diretos = tabela_atributos[tabela_atributos['direto']]
+    for linha, attr_code, valor in zip(diretos['linha'].tolist(), diretos['ATRIB'].tolist(), diretos['valor'].tolist()):
+        atributos_por_linha[linha].append({"atributo": attr_code, "valor": valor})
+
+    cpf_cnpj_raiz = cpf_cnpj_raiz_selecionado if cpf_cnpj_raiz_selecionado else "39318225" # Usa o valor selecionado ou o padrão
+
+    dados_convertidos = []
+    for seq, (registro, atributos) in enumerate(zip(registros_pecas(df, resolvedor), atributos_por_linha), start=seq_inicial):
+        dado = {
+            "seq": seq,
+            "descricao": registro.descricao,
+            "denominacao": registro.denominacao,
+            "cpfCnpjRaiz": cpf_cnpj_raiz,
+            "situacao": "Ativado",
+            "modalidade": "IMPORTACAO",
+            "ncm": registro.ncm,
+            "atributos": atributos,
+            "codigosInterno": [registro.part_number],
+            "atributosMultivalorados": [],
+            "atributosCompostos": [],
+            "atributosCompostosMultivalorados": []
+        }
+        dados_convertidos.append(dado)
+
+    if progress_bar:
+        progress_bar.progress(1.0)
+    return dados_convertidos
+
+def criar_df_pecas(json_data):
+    """Cria um DataFrame com os dados de peças prontos para o banco de dados, incluindo a descrição."""
+    dados_para_excel = []
+    for item in json_data:
+        part_number = item['codigosInterno'][0] if item['codigosInterno'] else ''
+        ncm = item.get('ncm', '')
+        descricao = item.get('descricao', '') # Inclui a descrição
+        atributos_usados = [attr['atributo'] for attr in item.get('atributos', [])]
+        atributos_str = ", ".join(atributos_usados)
+        
+        dados_processados = {
+            'part_number': part_number,
+            'descricao': descricao, # Adiciona a descrição
+            'ncm': ncm,
+            'atributos_usados': atributos_str
+        }
+        dados_para_excel.append(dados_processados)
+    return pd.DataFrame(dados_para_excel)
+
+
+def atributos_esperados_da_planilha(df):
+    """
+    Recalcula, de forma independente da conversão, os atributos esperados de cada linha a partir das
+    colunas ATT_ da planilha. Retorna um DataFrame longo com as colunas 'linha', 'atributo' e 'valor'.
+    """
+    partes = []
+    for col_name in df.columns:
+        if not col_name.upper().startswith('ATT_'):
+            continue
+        serie = df[col_name]
+        preenchidos = serie.notna().to_numpy()
+        if not preenchidos.any():
+            continue
+        attr_code = col_name.upper()
+        texto = pd.Series([str(valor) for valor in serie[preenchidos].tolist()], dtype=object)
+        minusculo = texto.str.strip().str.lower()
+        if attr_code == 'ATT_10824':
+            valor = texto.str.strip()
+        else:
+            valor = texto.str.split('-', n=1).str[0].str.strip()
+        valor = valor.where(minusculo != 'ok', 'true').where(minusculo != 'nok', 'false')
+        partes.append(pd.DataFrame({'linha': np.flatnonzero(preenchidos), 'atributo': attr_code, 'valor': valor.to_numpy(dtype=object)}))
+    if not partes:
+        return pd.DataFrame({'linha': pd.Series(dtype='int64'), 'atributo': pd.Series(dtype=object), 'valor': pd.Series(dtype=object)})
+    return pd.concat(partes, ignore_index=True)
+
+def comparar_valores(valores_json, valores_df):
+    """Compara duas sequências elemento a elemento; valores ausentes nos dois lados são considerados iguais."""
+    valores_json = np.asarray(valores_json, dtype=object)
+    valores_df = np.asarray(valores_df, dtype=object)
+    return (valores_json != valores_df) & ~(pd.isna(valores_json) & pd.isna(valores_df))
+
+def validar_json_vs_df(json_data, df, resolvedor=None):
+    """
+    Valida se os dados no JSON correspondem aos do DataFrame processado, comparando colunas inteiras.
+    Retorna (valido, mensagem, divergencias), em que divergencias lista todas as linhas que não conferem.
+    """
+    colunas_divergencias = ['Linha', 'Part Number', 'Campo', 'JSON', 'Planilha']
+    divergencias = []
+
+    # 1. Validação de contagem de linhas
+    if len(json_data) != len(df):
+        mensagem = f"Erro de validação: A contagem de itens no JSON ({len(json_data)}) não corresponde à contagem de linhas no DataFrame ({len(df)})."
+        return False, mensagem, pd.DataFrame(columns=colunas_divergencias)
+
+    total = len(df)
+    if resolvedor is None:
+        resolvedor = ResolvedorColunas(df.columns)
+
+    def valores_df(nome_procurado):
+        return resolvedor.valores(df, nome_procurado)
+
+    # 2. Campos principais, comparados coluna a coluna
+    # Part number e NCM já são texto (esquema de leitura): a comparação é por igualdade de strings
+    part_numbers_df = resolvedor.textos(df, "PART_NUMBER")
+    campos = {
+        'PART_NUMBER': (
+            [item['codigosInterno'][0] if item['codigosInterno'] else '' for item in json_data],
+            part_numbers_df,
+        ),
+        'NCM': ([item.get('ncm', '') for item in json_data], resolvedor.textos(df, "NCM")),
+        'Descrição': ([item.get('descricao', '') for item in json_data], valores_df("Descricao")),
+        'Denominação': ([item.get('denominacao', '') for item in json_data], valores_df("Denominacao")),
+    }
+    for campo, (valores_json, valores_planilha) in campos.items():
+        for index in np.flatnonzero(comparar_valores(valores_json, valores_planilha)):
+            divergencias.append((index + 2, part_numbers_df[index], campo, valores_json[index], valores_planilha[index]))
+
+    # 3. Atributos: contagem e valores por linha
+    esperados = atributos_esperados_da_planilha(df)
+    gerados = pd.DataFrame(
+        [(index, attr['atributo'], attr['valor']) for index, item in enumerate(json_data) for attr in item.get('atributos', [])],
+        columns=['linha', 'atributo', 'valor']
+    )
+    contagem_esperada = np.bincount(esperados['linha'].to_numpy(dtype='int64'), minlength=total)
+    contagem_gerada = np.bincount(gerados['linha'].to_numpy(dtype='int64'), minlength=total)
+    for index in np.flatnonzero(contagem_esperada != contagem_gerada):
+        divergencias.append((index + 2, part_numbers_df[index], 'Contagem de atributos', int(contagem_gerada[index]), int(contagem_esperada[index])))
+
+    # Nas linhas com a mesma contagem, compara os atributos ordenados lado a lado
+    mesma_contagem = contagem_esperada == contagem_gerada
+    esperados = esperados[mesma_contagem[esperados['linha'].to_numpy(dtype='int64')]].sort_values(['linha', 'atributo', 'valor'], kind='stable')
+    gerados = gerados[mesma_contagem[gerados['linha'].to_numpy(dtype='int64')]].sort_values(['linha', 'atributo', 'valor'], kind='stable')
+    diferentes = (
+        comparar_valores(gerados['atributo'].to_numpy(), esperados['atributo'].to_numpy())
+        | comparar_valores(gerados['valor'].to_numpy(), esperados['valor'].to_numpy())
+    )
+    linhas_com_diferenca = set(esperados['linha'].to_numpy()[diferentes].tolist())
+
+    def atributos_por_linha(tabela):
+        """Atributos de cada linha com diferença, agrupados de uma só vez (linha -> lista de atributos)."""
+        tabela = tabela[tabela['linha'].isin(linhas_com_diferenca)]
+        atributos, valores = tabela['atributo'].to_numpy(), tabela['valor'].to_numpy()
+        return {
+            linha: [{"atributo": atributos[posicao], "valor": valores[posicao]} for posicao in posicoes]
+            for linha, posicoes in tabela.groupby('linha', sort=False).indices.items()
+        }
+
+    if linhas_com_diferenca:
+        atributos_gerados, atributos_esperados = atributos_por_linha(gerados), atributos_por_linha(esperados)
+        for index in sorted(linhas_com_diferenca):
+            divergencias.append((
+                index + 2, part_numbers_df[index], 'Atributos',
+                json.dumps(atributos_gerados.get(index, []), ensure_ascii=False),
+                json.dumps(atributos_esperados.get(index, []), ensure_ascii=False),
+            ))
+
+    if not divergencias:
+        return True, "Validação bem-sucedida: Os dados do JSON correspondem aos da planilha.", pd.DataFrame(columns=colunas_divergencias)
+
+    df_divergencias = pd.DataFrame(divergencias, columns=colunas_divergencias).sort_values('Linha', kind='stable').reset_index(drop=True)
+    primeira = df_divergencias.iloc[0]
+    mensagem = (
+        f"Erro de validação: {len(df_divergencias)} divergência(s) em {df_divergencias['Linha'].nunique()} linha(s). "
+        f"Primeira: linha {primeira['Linha']} (Part Number: {primeira['Part Number']}), campo {primeira['Campo']} "
+        f"('{primeira['JSON']}' vs '{primeira['Planilha']}')."
+    )
+    return False, mensagem, df_divergencias
+
+
+def colunas_booleanas_da_tabela(tabela_atributos):
+    """Retorna os índices das colunas de atributo que contêm ao menos um valor ok/nok."""
+    return set(tabela_atributos.loc[tabela_atributos['booleano'], 'coluna'].unique().tolist())
+
+def projetar_cod_atributos(colunas_atributos, colunas_booleanas):
+    """
+    Monta as linhas da tabela COD_ATRIBUTOS a partir do mapeamento das colunas de atributos.
+    Colunas com valores ok/nok geram os códigos _true e _false.
+    """
+    atributos_data = []
+    for indice, spec in enumerate(colunas_atributos):
+        nome_atributo = spec['nome_atributo']
+        codigo_atrib = spec['codigo_atrib']
+        if indice in colunas_booleanas:
+            atributos_data.append({'NOME_ATRIBUTO': f"{nome_atributo} (OK)", 'CODIGO_ATRIB': f"{codigo_atrib}_true", 'MODALIDADE': 'Importação', 'ORGAO': None})
+            atributos_data.append({'NOME_ATRIBUTO': f"{nome_atributo} (NOK)", 'CODIGO_ATRIB': f"{codigo_atrib}_false", 'MODALIDADE': 'Importação', 'ORGAO': None})
+        else:
+            atributos_data.append({'NOME_ATRIBUTO': nome_atributo, 'CODIGO_ATRIB': codigo_atrib, 'MODALIDADE': 'Importação', 'ORGAO': None})
+
+    return pd.DataFrame(atributos_data, columns=['NOME_ATRIBUTO', 'CODIGO_ATRIB', 'MODALIDADE', 'ORGAO']).drop_duplicates(subset=['CODIGO_ATRIB'])
+
+def get_atributos_from_df(df_original, tabela_atributos=None):
+    """
+    Extrai atributos de colunas do DataFrame original para a tabela COD_ATRIBUTOS
+    de forma dinâmica, lidando com os padrões "Nome - COD_ATRIB" e "ATT_...".
+    """
+    if tabela_atributos is None:
+        tabela_atributos = extrair_tabela_atributos(df_original)
+
+    return projetar_cod_atributos(tabela_atributos.attrs['colunas_atributos'], colunas_booleanas_da_tabela(tabela_atributos))
+
+def converter_para_df_ncm_x_atrib(df_original, tabela_atributos=None, resolvedor=None):
+    """
+    Converte o DataFrame original em um novo DataFrame com uma linha
+    para cada combinação NCM e ATRIBUTO, de forma dinâmica.
+    """
+    if resolvedor is None:
+        resolvedor = ResolvedorColunas(df_original.columns)
+    posicao_ncm = resolvedor.posicao("NCM")
+    if posicao_ncm is None:
+        return pd.DataFrame(columns=['NCM', 'ATRIB'])
+
+    if tabela_atributos is None:
+        tabela_atributos = extrair_tabela_atributos(df_original)
+
+    # Mantém a ordem linha a linha, coluna a coluna
+    diretos = tabela_atributos[tabela_atributos['direto']].sort_values(['linha', 'coluna'], kind='stable')
+    ncms = np.asarray(resolvedor.textos(df_original, "NCM"), dtype=object)[diretos['linha'].to_numpy()]
+
+    # Atributos booleanos viram ATT_..._true / ATT_..._false
+    atribs = diretos['ATRIB'].where(~diretos['booleano'], diretos['ATRIB'] + '_' + diretos['valor'])
+
+    df_result = pd.DataFrame({'NCM': ncms, 'ATRIB': atribs.to_numpy()}, columns=['NCM', 'ATRIB'])
+    return df_result[df_result['NCM'] != ''].drop_duplicates().reset_index(drop=True)
+    
+def nomes_colunas_cabecalho(cabecalho):
+    """Gera nomes de colunas a partir da linha de cabeçalho, como o pandas faz (Unnamed: N e sufixos .1, .2 para repetidas)."""
+    nomes = []
+    contagem = Counter()
+    for posicao, valor in enumerate(cabecalho):
+        nome = f"Unnamed: {posicao}" if valor is None else str(valor)
+        if contagem[nome]:
+            nome_unico = f"{nome}.{contagem[nome]}"
+        else:
+            nome_unico = nome
+        contagem[nome] += 1
+        nomes.append(nome_unico)
+    return nomes
+
+def ler_blocos_worksheet(worksheet, tamanho_bloco):
+    """Gera DataFrames com até `tamanho_bloco` linhas de uma planilha aberta em modo somente leitura."""
+    linhas = worksheet.iter_rows(values_only=True)
+    cabecalho = next(linhas, None)
+    if cabecalho is None:
+        return
+    colunas = nomes_colunas_cabecalho(cabecalho)
+    total_colunas = len(colunas)
+    # Colunas-chave convertidas para texto antes de montar o DataFrame, como os converters da leitura com pandas
+    conversores = ResolvedorColunas(colunas).conversores()
+
+    bloco = []
+    for linha in linhas:
+        # Linhas podem vir mais curtas ou mais longas que o cabeçalho
+        linha = list((tuple(linha) + (None,) * total_colunas)[:total_colunas])
+        for posicao, conversor in conversores.items():
+            linha[posicao] = conversor(linha[posicao])
+        bloco.append(linha)
+        if len(bloco) >= tamanho_bloco:
+            yield pd.DataFrame(bloco, columns=colunas)
+            bloco = []
+    if bloco:
+        yield pd.DataFrame(bloco, columns=colunas)
+
+def ler_csv(arquivo, **opcoes):
+    """Lê um CSV com as colunas-chave (part number e NCM) como texto, resolvidas pelo cabeçalho."""
+    colunas = pd.read_csv(arquivo, nrows=0).columns
+    arquivo.seek(0)
+    return pd.read_csv(arquivo, converters=ResolvedorColunas(colunas).conversores(), **opcoes)
+
+def ler_aba_excel(excel, sheet_name):
+    """Lê uma aba de um pd.ExcelFile com as colunas-chave (part number e NCM) como texto, resolvidas pelo cabeçalho."""
+    colunas = excel.parse(sheet_name, nrows=0).columns
+    return excel.parse(sheet_name, converters=ResolvedorColunas(colunas).conversores())
+
+def ler_abas_em_blocos(arquivo, tamanho_bloco):
+    """
+    Lê um arquivo Excel ou CSV sem carregar as abas inteiras em memória.
+    Gera pares (nome_aba, blocos), onde `blocos` é um gerador de DataFrames com até `tamanho_bloco` linhas.
+    """
+    if arquivo.name.endswith('.csv'):
+        # Para CSV, ainda tratamos como uma única "aba"
+        yield arquivo.name.rsplit('.', 1)[0], ler_csv(arquivo, chunksize=tamanho_bloco)
+        return
+
+    workbook = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            yield worksheet.title, ler_blocos_worksheet(worksheet, tamanho_bloco)
+    finally:
+        workbook.close()
+
+def ler_abas(arquivo):
+    """Lê um arquivo Excel (todas as abas) ou CSV inteiro em memória. Gera pares (nome_aba, [DataFrame])."""
+    if arquivo.name.endswith('.csv'):
+        # Para CSV, ainda tratamos como uma única "aba"
+        yield arquivo.name.rsplit('.', 1)[0], [ler_csv(arquivo)]
+        return
+    # Para Excel, lemos todas as abas
+    with pd.ExcelFile(arquivo, engine="openpyxl") as excel:
+        for sheet_name in excel.sheet_names:
+            yield sheet_name, [ler_aba_excel(excel, sheet_name)]
+
+def ler_tabela(arquivo):
+    """Lê a primeira aba de um arquivo Excel (ou um CSV) inteira, com as colunas-chave como texto."""
+    if arquivo.name.endswith('.csv'):
+        return ler_csv(arquivo)
+    with pd.ExcelFile(arquivo, engine="openpyxl") as excel:
+        return ler_aba_excel(excel, 0)
+
+def ler_planilha(arquivo, streaming, tamanho_bloco):
+    """Escolhe entre a leitura bloco a bloco (streaming) e a leitura das abas inteiras."""
+    if streaming:
+        return ler_abas_em_blocos(arquivo, tamanho_bloco)
+    return ler_abas(arquivo)
+
+def converter_aba(sheet_name, blocos, cpf_cnpj_raiz, streaming=False):
+    """
+    Converte e valida uma aba, bloco a bloco, sem gravar nada no banco de dados.
+    Gera eventos (dicionários com a chave 'tipo') na ordem em que devem ser exibidos e gravados:
+    'formato_invalido', 'bloco_lido', 'duplicados', 'erro', 'bloco_convertido', 'vazia' e 'concluido'.
+    """
+    part_numbers_vistos = set()
+    combinacoes_vistas = set()
+    colunas_atributos = []
+    colunas_booleanas = set()
+    linhas_lidas = 0
+    total_itens = 0
+    duplicados_avisados = False
+    mensagem_validacao = None
+    resolvedor = None
+
+    for numero_bloco, df_original in enumerate(blocos, start=1):
+        # Células só com espaços viram ausentes, então linhas só com espaços também são descartadas
+        df_original = limpar_textos(df_original).dropna(how='all')
+        descricao_bloco = f"aba '{sheet_name}' (bloco {numero_bloco})" if streaming else f"aba '{sheet_name}'"
+
+        if numero_bloco == 1:
+            # Validação de formato de colunas
+            colunas_erradas = validar_formato_atributos(df_original)
+            if colunas_erradas:
+                yield {'tipo': 'formato_invalido', 'colunas': colunas_erradas}
+                return
+
+        if df_original.empty:
+            continue
+
+        # Adiciona a coluna 'ID' sequencial, contínua entre os blocos
+        df_original.insert(0, 'ID', range(linhas_lidas + 1, linhas_lidas + len(df_original) + 1))
+        linhas_lidas += len(df_original)
+        yield {'tipo': 'bloco_lido', 'numero': numero_bloco, 'linhas': len(df_original), 'amostra': df_original if numero_bloco == 1 else None}
+
+        # Os blocos de uma aba têm as mesmas colunas: o resolvedor é montado uma vez e usado por todas as etapas
+        if resolvedor is None or resolvedor.colunas != list(df_original.columns):
+            resolvedor = ResolvedorColunas(df_original.columns)
+        col_part_number = resolvedor.coluna("PART_NUMBER")
+        if not col_part_number:
+            yield {'tipo': 'erro', 'numero': numero_bloco, 'mensagem': f"A coluna 'PART_NUMBER' é obrigatória e não foi encontrada na aba '{sheet_name}'."}
+            return
+
+        # Duplicados dentro do bloco ou já vistos em blocos anteriores
+        duplicados = df_original.duplicated(subset=[col_part_number]) | df_original[col_part_number].isin(part_numbers_vistos)
+        if duplicados.any() and not duplicados_avisados:
+            yield {'tipo': 'duplicados'}
+            duplicados_avisados = True
+        df_original = df_original[~duplicados]
+        part_numbers_vistos.update(df_original[col_part_number].tolist())
+
+        if not cpf_cnpj_raiz:
+            yield {'tipo': 'erro', 'numero': numero_bloco, 'mensagem': "Por favor, selecione um CPF/CNPJ Raiz antes de processar a planilha."}
+            return
+
+        # Normalização e conversão; a classificação dos atributos é compartilhada por JSON, COD_ATRIBUTOS e NCM_X_ATRIB
+        df = normalizar_colunas(df_original.copy())
+        tabela_atributos = extrair_tabela_atributos(df_original)
+        json_convertido = converter_para_json(df, None, cpf_cnpj_raiz, tabela_atributos, seq_inicial=total_itens + 1, resolvedor=resolvedor)
+
+        is_valid, mensagem_validacao, divergencias = validar_json_vs_df(json_convertido, df, resolvedor)
+        if not is_valid:
+            yield {
+                'tipo': 'erro',
+                'numero': numero_bloco,
+                'mensagem': f"Falha na validação da {descricao_bloco}: {mensagem_validacao}",
+                'icone': "❌",
+                'divergencias': divergencias,
+            }
+            return
+        total_itens += len(json_convertido)
+
+        # Evita reenviar combinações já vistas em blocos anteriores da mesma aba
+        df_ncm_x_atrib = converter_para_df_ncm_x_atrib(df_original, tabela_atributos, resolvedor)
+        combinacoes = list(zip(df_ncm_x_atrib['NCM'], df_ncm_x_atrib['ATRIB']))
+        df_ncm_x_atrib = df_ncm_x_atrib[[combinacao not in combinacoes_vistas for combinacao in combinacoes]]
+        combinacoes_vistas.update(combinacoes)
+
+        yield {
+            'tipo': 'bloco_convertido',
+            'numero': numero_bloco,
+            'descricao': descricao_bloco,
+            'json': json_convertido,
+            'df_pecas': criar_df_pecas(json_convertido),
+            'df_ncm_x_atrib': df_ncm_x_atrib,
+        }
+
+        colunas_atributos = tabela_atributos.attrs['colunas_atributos']
+        colunas_booleanas |= colunas_booleanas_da_tabela(tabela_atributos)
+
+    if linhas_lidas == 0:
+        yield {'tipo': 'vazia'}
+        return
+
+    # Os códigos de atributos dependem de todos os blocos (ok/nok em qualquer bloco gera _true/_false)
+    yield {
+        'tipo': 'concluido',
+        'linhas_lidas': linhas_lidas,
+        'mensagem_validacao': mensagem_validacao,
+        'df_cod_atributos': projetar_cod_atributos(colunas_atributos, colunas_booleanas),
+    }
+
+def processar_arquivo(nome_arquivo, conteudo, cpf_cnpj_raiz, streaming, tamanho_bloco):
+    """
+    Lê e converte todas as abas de um arquivo enviado, sem acesso ao banco de dados.
+    Executada nos processos do pool; retorna uma lista de pares (nome_aba, eventos de converter_aba).
+    """
+    arquivo = io.BytesIO(conteudo)
+    arquivo.name = nome_arquivo
+    return [
+        (sheet_name, list(converter_aba(sheet_name, blocos, cpf_cnpj_raiz, streaming)))
+        for sheet_name, blocos in ler_planilha(arquivo, streaming, tamanho_bloco)
+    ]
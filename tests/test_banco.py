@@ -0,0 +1,129 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from banco import GerenciadorConexoes, aplicar_migracoes, inserir_em_lote, inserir_pecas, reconstruir_estatisticas
+
+
+@pytest.fixture
+def caminho_banco(tmp_path):
+    caminho = str(tmp_path / 'bytebook.db')
+    with GerenciadorConexoes(caminho).escrita() as conn:
+        aplicar_migracoes(conn)
+    return caminho
+
+
+def test_geracao_reflete_escritas_de_outro_gerenciador(caminho_banco):
+    # Dois gerenciadores no mesmo arquivo fazem o papel de dois processos (aplicação e linha de comando)
+    aplicacao, linha_de_comando = GerenciadorConexoes(caminho_banco), GerenciadorConexoes(caminho_banco)
+    antes = aplicacao.geracao('COD_ATRIBUTOS')
+    outra_tabela = aplicacao.geracao('cnpj_options')
+
+    with linha_de_comando.escrita('COD_ATRIBUTOS') as conn:
+        conn.execute("INSERT INTO COD_ATRIBUTOS (NOME_ATRIBUTO, CODIGO_ATRIB) VALUES ('Material', 'ATT_1')")
+
+    assert aplicacao.geracao('COD_ATRIBUTOS') != antes
+    assert aplicacao.geracao('cnpj_options') == outra_tabela
+
+
+def test_escrita_sem_tabelas_invalida_todas(caminho_banco):
+    aplicacao, outro = GerenciadorConexoes(caminho_banco), GerenciadorConexoes(caminho_banco)
+    antes = aplicacao.geracao('cnpj_options')
+    with outro.escrita() as conn:
+        conn.execute("INSERT INTO cnpj_options (name, cpf_cnpj_raiz) VALUES ('Kia', '123')")
+    assert aplicacao.geracao('cnpj_options') != antes
+
+
+def test_escrita_com_erro_nao_grava(caminho_banco):
+    gerenciador = GerenciadorConexoes(caminho_banco)
+    with pytest.raises(sqlite3.IntegrityError):
+        with gerenciador.escrita('cnpj_options') as conn:
+            conn.execute("INSERT INTO cnpj_options (name, cpf_cnpj_raiz) VALUES ('Kia', '123')")
+            conn.execute("INSERT INTO cnpj_options (name, cpf_cnpj_raiz) VALUES ('Kia', '456')")
+    with gerenciador.leitura() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM cnpj_options").fetchone()[0] == 0
+
+
+def atributos_e_frequencias(conn):
+    atributos = conn.execute("SELECT part_number, atrib FROM pn_x_atrib ORDER BY 1, 2").fetchall()
+    frequencias = conn.execute("SELECT atrib, frequencia FROM stats_attr_freq ORDER BY 1").fetchall()
+    return atributos, frequencias
+
+
+def test_alteracao_de_atributos_usados_atualiza_pn_x_atrib_e_estatisticas(caminho_banco):
+    gerenciador = GerenciadorConexoes(caminho_banco)
+    df_pecas = pd.DataFrame({
+        'part_number': ['PN1', 'PN2'], 'descricao': ['a', 'b'], 'ncm': ['87082999', '87082999'],
+        'atributos_usados': ['ATT_1, ATT_2', 'ATT_2'],
+    })
+    with gerenciador.escrita() as conn:
+        inserir_pecas(conn, df_pecas)
+        # Aspas e barras invertidas não podem quebrar a lista desmembrada pelo trigger
+        conn.execute("UPDATE ncm_x_atrib_x_pn SET atributos_usados = ? WHERE part_number = 'PN1'", (' ATT_3,,ATT_"4\\ , ATT_2',))
+        conn.execute("UPDATE ncm_x_atrib_x_pn SET part_number = 'PN3' WHERE part_number = 'PN2'")
+
+    with gerenciador.leitura() as conn:
+        atributos, frequencias = atributos_e_frequencias(conn)
+    assert atributos == [('PN1', 'ATT_"4\\'), ('PN1', 'ATT_2'), ('PN1', 'ATT_3'), ('PN3', 'ATT_2')]
+    assert frequencias == [('ATT_"4\\', 1), ('ATT_2', 2), ('ATT_3', 1)]
+
+
+def test_alteracao_para_atributos_vazios_remove_a_peca_das_estatisticas(caminho_banco):
+    gerenciador = GerenciadorConexoes(caminho_banco)
+    df_pecas = pd.DataFrame({'part_number': ['PN1'], 'descricao': ['a'], 'ncm': ['87082999'], 'atributos_usados': ['ATT_1']})
+    with gerenciador.escrita() as conn:
+        inserir_pecas(conn, df_pecas)
+        conn.execute("UPDATE ncm_x_atrib_x_pn SET atributos_usados = NULL")
+
+    with gerenciador.leitura() as conn:
+        assert atributos_e_frequencias(conn) == ([], [])
+
+
+def test_escrita_na_tabela_base_invalida_as_estatisticas_mantidas_por_triggers(caminho_banco):
+    aplicacao, outro = GerenciadorConexoes(caminho_banco), GerenciadorConexoes(caminho_banco)
+    antes = {tabela: aplicacao.geracao(tabela) for tabela in ('stats_totais', 'stats_ncm_freq', 'stats_attr_freq', 'stats_ncm_atrib')}
+    df_pecas = pd.DataFrame({'part_number': ['PN1'], 'descricao': ['a'], 'ncm': ['87082999'], 'atributos_usados': ['ATT_1']})
+    with outro.escrita('ncm_x_atrib_x_pn') as conn:
+        inserir_pecas(conn, df_pecas)
+    depois = {tabela: aplicacao.geracao(tabela) for tabela in antes}
+    assert [tabela for tabela in antes if depois[tabela] != antes[tabela]] == ['stats_totais', 'stats_ncm_freq', 'stats_attr_freq']
+
+
+def atributos_por_ncm(conn):
+    return conn.execute("SELECT NCM, atributos FROM stats_ncm_atrib ORDER BY NCM").fetchall()
+
+
+def test_alteracao_e_exclusao_em_ncm_x_atrib_mantem_estatisticas_na_ordem_de_insercao(caminho_banco):
+    gerenciador = GerenciadorConexoes(caminho_banco)
+    with gerenciador.escrita() as conn:
+        conn.executemany("INSERT INTO NCM_X_ATRIB (NCM, ATRIB) VALUES (?, ?)", [
+            ('87082999', 'ATT_3'), ('73181500', 'ATT_1'), ('87082999', 'ATT_1'), ('87082999', 'ATT_2'), ('73181500', 'ATT_9'),
+        ])
+        conn.execute("UPDATE NCM_X_ATRIB SET NCM = '73181500' WHERE NCM = '87082999' AND ATRIB = 'ATT_2'")
+        conn.execute("UPDATE NCM_X_ATRIB SET ATRIB = 'ATT_0' WHERE NCM = '87082999' AND ATRIB = 'ATT_3'")
+        conn.execute("DELETE FROM NCM_X_ATRIB WHERE ATRIB = 'ATT_9'")
+        assert atributos_por_ncm(conn) == [('73181500', 'ATT_1, ATT_2'), ('87082999', 'ATT_0, ATT_1')]
+
+        # A reconstrução completa produz o mesmo texto que os triggers
+        reconstruir_estatisticas(conn)
+        assert atributos_por_ncm(conn) == [('73181500', 'ATT_1, ATT_2'), ('87082999', 'ATT_0, ATT_1')]
+
+
+def test_inserir_em_lote_conta_so_as_linhas_gravadas(caminho_banco):
+    gerenciador = GerenciadorConexoes(caminho_banco)
+    with gerenciador.escrita() as conn:
+        conn.execute("INSERT INTO cnpj_options (id, name, cpf_cnpj_raiz) VALUES (1, 'Kia', '123')")
+        # O id 2 é novo, mas o nome já existe no índice UNIQUE de name: a linha é ignorada
+        df = pd.DataFrame({'id': [2, 3], 'name': ['Kia', 'Hyundai'], 'cpf_cnpj_raiz': ['456', '789']})
+        novos_itens, ignorados, erros, chaves_novas = inserir_em_lote(conn, df, 'cnpj_options')
+    assert (novos_itens, ignorados, erros, chaves_novas) == (1, 1, [], {(3,)})
+
+
+def test_inserir_pecas_nao_conta_as_linhas_dos_triggers(caminho_banco):
+    df_pecas = pd.DataFrame({
+        'part_number': ['PN1', 'PN2', 'PN1'], 'descricao': ['a', 'b', 'c'], 'ncm': ['87082999'] * 3,
+        'atributos_usados': ['ATT_1, ATT_2', 'ATT_2', 'ATT_3'],
+    })
+    with GerenciadorConexoes(caminho_banco).escrita() as conn:
+        assert inserir_pecas(conn, df_pecas) == (2, [])
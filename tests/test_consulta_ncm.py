@@ -0,0 +1,18 @@
+from consulta_ncm import extrair_ncms, extrair_prefixo
+
+
+def test_prefixo_isolado_e_reconhecido():
+    assert extrair_prefixo('87') == '87'
+    assert extrair_prefixo('8708%') == '8708'
+    assert extrair_prefixo('atributos do 8708*') == '8708'
+    assert extrair_prefixo('NCM 8708, por favor') == '8708'
+
+
+def test_digitos_dentro_de_palavras_nao_sao_prefixo():
+    assert extrair_prefixo('ATT_10627') is None
+    assert extrair_prefixo('PN8708X') is None
+    assert extrair_prefixo('8708%X') is None
+
+
+def test_ncm_dentro_de_palavras_nao_e_extraido():
+    assert extrair_ncms('8708.29.99 e ncm:73181500; ATT_87082999 PN01012100X') == ['87082999', '73181500']
@@ -0,0 +1,73 @@
+import json
+import math
+import sqlite3
+
+import pytest
+
+from exportacao import BACKEND_JSON_PADRAO, ExportacaoJson, ItensEmDisco, exportar_tabela_em_arquivo, serializar_json
+
+ITENS = [
+    {"seq": 1, "descricao": math.nan, "denominacao": "Peça", "ncm": "87082999", "codigosInterno": [str(2 ** 70)]},
+    {"seq": 2 ** 70, "descricao": "Para-choque", "denominacao": None, "ncm": "", "codigosInterno": [""]},
+]
+
+
+def test_codificador_padrao_e_o_modulo_json():
+    assert BACKEND_JSON_PADRAO == 'json'
+
+
+def test_formato_indentado_padrao_igual_ao_json_dumps():
+    esperado = json.dumps(ITENS, ensure_ascii=False, indent=2).encode('utf-8')
+    assert serializar_json(ITENS) == esperado
+    assert serializar_json(ITENS, 'indentado') == esperado
+
+
+def test_exportacao_usa_o_codificador_padrao():
+    exportacao = ExportacaoJson({"planilha": ITENS}, criterio_lote='nenhum')
+    [(nome_arquivo, _, _)] = exportacao.arquivos
+    assert exportacao.conteudo(nome_arquivo) == json.dumps(ITENS, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def itens_de_teste(quantidade):
+    return [
+        {"seq": i, "descricao": f"Peça {i}\nlinha 2", "ncm": f"8708{i % 3:04d}", "valor": math.nan if i % 5 == 0 else i / 3}
+        for i in range(1, quantidade + 1)
+    ]
+
+
+def test_itens_em_disco_se_comportam_como_lista():
+    itens = itens_de_teste(25)
+    em_disco = ItensEmDisco()
+    em_disco.extend(itens[:10])
+    em_disco.extend(itens[10:])
+    assert len(em_disco) == 25
+    assert json.dumps(list(em_disco)) == json.dumps(itens)
+    assert json.dumps(em_disco[3:12]) == json.dumps(itens[3:12])
+    assert json.dumps(em_disco[-1]) == json.dumps(itens[-1])
+    assert em_disco[30:40] == []
+
+
+@pytest.mark.parametrize('criterio', ['nenhum', 'itens', 'bytes', 'ncm'])
+def test_exportacao_de_itens_em_disco_igual_a_da_lista(criterio):
+    itens = itens_de_teste(250)
+    em_disco = ItensEmDisco()
+    em_disco.extend(itens)
+    opcoes = {'criterio_lote': criterio, 'tamanho_lote': 40, 'limite_bytes': 4096}
+    da_lista = ExportacaoJson({"planilha": itens}, **opcoes)
+    do_disco = ExportacaoJson({"planilha": em_disco}, **opcoes)
+    assert list(do_disco.membros()) == list(da_lista.membros())
+
+
+def test_parquet_exporta_como_texto_coluna_numerica_com_valores_de_outro_tipo():
+    parquet = pytest.importorskip('pyarrow.parquet')
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE pecas (id INTEGER, preco REAL, quantidade INTEGER, nome TEXT)")
+    conn.executemany("INSERT INTO pecas VALUES (?, ?, ?, ?)", [
+        (1, 1.5, 10, 'a'), (2, 2, 'dez', 'b'), (3, None, None, 7),
+    ])
+    with exportar_tabela_em_arquivo(conn, 'pecas', 'parquet') as arquivo:
+        tabela = parquet.read_table(arquivo)
+    assert [str(campo.type) for campo in tabela.schema] == ['int64', 'double', 'string', 'string']
+    assert tabela.to_pydict() == {
+        'id': [1, 2, 3], 'preco': [1.5, 2.0, None], 'quantidade': ['10', 'dez', None], 'nome': ['a', 'b', '7'],
+    }
@@ -0,0 +1,118 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+from processamento import converter_aba, converter_para_json, ler_abas, ler_csv, limpar_textos, ncm_como_texto, validar_json_vs_df
+
+
+def converter(df):
+    """Eventos de converter_aba para um DataFrame, como uma aba lida inteira."""
+    return list(converter_aba('aba', [df], '39318225'))
+
+
+def json_convertido(eventos):
+    return [item for evento in eventos if evento['tipo'] == 'bloco_convertido' for item in evento['json']]
+
+
+def test_limpar_textos_ignora_colunas_de_numeros_misturados():
+    df = pd.DataFrame({'valores': pd.Series([1, 2.5, None], dtype=object)})
+    limpo = limpar_textos(df)
+    assert limpo['valores'].tolist()[:2] == [1, 2.5]
+    assert pd.isna(limpo['valores'].tolist()[2])
+
+
+def test_limpar_textos_remove_espacos_e_troca_vazios_por_ausentes():
+    df = pd.DataFrame({'texto': ['  a ', '   ', None], 'misto': pd.Series([1, ' b ', '  '], dtype=object)})
+    limpo = limpar_textos(df)
+    assert limpo['texto'].iloc[0] == 'a'
+    assert limpo['texto'].iloc[1:].isna().all()
+    assert limpo['misto'].iloc[:2].tolist() == [1, 'b']
+    assert pd.isna(limpo['misto'].iloc[2])
+
+
+def test_aba_com_coluna_de_inteiros_e_decimais_e_convertida():
+    df = pd.DataFrame({
+        'PART_NUMBER': ['PN1', 'PN2', 'PN3'],
+        'NCM': ['87082999'] * 3,
+        'Observacao': pd.Series([1, 2.5, None], dtype=object),
+    })
+    eventos = converter(df)
+    assert eventos[-1]['tipo'] == 'concluido'
+    assert len(json_convertido(eventos)) == 3
+
+
+def test_celula_de_atributo_so_com_espacos_nao_gera_atributo():
+    # Células só com espaços são tratadas como vazias: o atributo não aparece no JSON (antes saía com valor "")
+    df = pd.DataFrame({
+        'PART_NUMBER': ['PN1', 'PN2'],
+        'NCM': ['87082999', '87082999'],
+        'ATT_1': ['   ', '10 - Dez'],
+    })
+    itens = json_convertido(converter(df))
+    assert itens[0]['atributos'] == []
+    assert itens[1]['atributos'] == [{'atributo': 'ATT_1', 'valor': '10'}]
+    json.dumps(itens)
+
+
+def test_validacao_lista_os_atributos_de_cada_linha_divergente():
+    df = pd.DataFrame({
+        'PART_NUMBER': ['PN1', 'PN2', 'PN3'],
+        'NCM': ['87082999'] * 3,
+        'ATT_1': ['1 - Um', '2 - Dois', '3 - Três'],
+        'ATT_2': ['ok', 'nok', None],
+    })
+    itens = converter_para_json(df.copy(), cpf_cnpj_raiz_selecionado='39318225')
+    itens[0]['atributos'][0]['valor'] = '9'
+    itens[2]['atributos'][0]['valor'] = '8'
+
+    valido, _, divergencias = validar_json_vs_df(itens, df)
+
+    assert not valido
+    atributos = divergencias[divergencias['Campo'] == 'Atributos']
+    assert atributos['Linha'].tolist() == [2, 4]
+    assert json.loads(atributos['JSON'].iloc[0]) == [{'atributo': 'ATT_1', 'valor': '9'}, {'atributo': 'ATT_2', 'valor': 'true'}]
+    assert json.loads(atributos['Planilha'].iloc[0]) == [{'atributo': 'ATT_1', 'valor': '1'}, {'atributo': 'ATT_2', 'valor': 'true'}]
+    assert json.loads(atributos['JSON'].iloc[1]) == [{'atributo': 'ATT_1', 'valor': '8'}]
+    assert json.loads(atributos['Planilha'].iloc[1]) == [{'atributo': 'ATT_1', 'valor': '3'}]
+
+
+def test_ncm_numerico_de_sete_digitos_recupera_o_zero_a_esquerda():
+    assert ncm_como_texto(1012100) == '01012100'
+    assert ncm_como_texto(1012100.0) == '01012100'
+    assert ncm_como_texto(np.int64(1012100)) == '01012100'
+    assert ncm_como_texto(87082999) == '87082999'
+
+
+def test_ncm_numerico_fora_do_padrao_nao_e_completado():
+    assert ncm_como_texto(8708) == '8708'
+    assert ncm_como_texto(8708.29) == '8708.29'
+    assert ncm_como_texto(123456789) == '123456789'
+
+
+def test_ncm_em_texto_perde_os_pontos_da_mascara_e_recupera_o_zero():
+    assert ncm_como_texto('8708.29.99') == '87082999'
+    assert ncm_como_texto('0101.21.00') == '01012100'
+    assert ncm_como_texto('8708.29') == '8708.29'
+    assert ncm_como_texto('8708') == '8708'
+    assert ncm_como_texto('1012100') == '01012100'
+    assert pd.isna(ncm_como_texto('  '))
+
+
+def test_csv_le_o_ncm_como_texto_com_os_zeros_completados():
+    arquivo = io.BytesIO("PART_NUMBER,NCM\n001,1012100\n002,8708.29.99\n003,8708.29\n".encode('utf-8'))
+    df = ler_csv(arquivo)
+    assert df['PART_NUMBER'].tolist() == ['001', '002', '003']
+    assert df['NCM'].tolist() == ['01012100', '87082999', '8708.29']
+
+
+def test_ncm_de_sete_digitos_igual_no_excel_e_no_csv():
+    excel = io.BytesIO()
+    pd.DataFrame({'PART_NUMBER': ['001'], 'NCM': [1012100]}).to_excel(excel, index=False)
+    excel.seek(0)
+    excel.name = 'pecas.xlsx'
+    csv = io.BytesIO(b"PART_NUMBER,NCM\n001,1012100\n")
+    csv.name = 'pecas.csv'
+    [(_, [df_excel])], [(_, [df_csv])] = list(ler_abas(excel)), list(ler_abas(csv))
+    assert df_excel['NCM'].tolist() == df_csv['NCM'].tolist() == ['01012100']
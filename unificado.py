@@ -1,12 +1,28 @@
 import streamlit as st
 import pandas as pd
-import json
-import unicodedata
-import math
-import io
 import sqlite3
-from collections import Counter
-import zipfile
+from collections import OrderedDict
+import threading
+import os
+import hashlib
+import pickle
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from banco import (
+    CAMINHO_BANCO, GerenciadorConexoes, aplicar_migracoes, inserir_dados, inserir_pecas,
+    reconstruir_pn_x_atrib, reconstruir_estatisticas
+)
+from processamento import (
+    ler_planilha, ler_tabela, converter_aba, processar_arquivo, TAMANHO_BLOCO_STREAMING, LIMITE_STREAMING_BYTES
+)
+from consulta_ncm import MapaAtributosNcm, atributos_do_ncm, atributos_por_prefixo, extrair_ncms, extrair_prefixo, ncms_da_planilha
+from paginacao import ConsultaPaginada, OPERADORES_FILTRO, TAMANHO_PAGINA_PADRAO, colunas_tabela, colunas_ordenaveis
+from exportacao import (
+    ExportacaoJson, ItensEmDisco, NIVEL_COMPRESSAO_PADRAO, FORMATOS_JSON, FORMATO_JSON_PADRAO,
+    CRITERIOS_LOTE, CRITERIO_LOTE_PADRAO, TAMANHO_LOTE_PADRAO, LIMITE_BYTES_LOTE_PADRAO,
+    FORMATOS_TABELA, exportar_tabela_em_arquivo
+)
 
 # --- Configuração da Página Streamlit ---
 st.set_page_config(
@@ -16,271 +32,13 @@ st.set_page_config(
 )
 
 # --- Funções para Processamento de Dados ---
-def extrair_valor(categoria):
-    """Extrai o valor antes do hífen em uma string."""
-    if pd.isna(categoria):
-        return ""
-    return str(categoria).split('-')[0].strip()
-
-def normalizar_colunas(df):
-    """Normaliza os nomes das colunas, removendo acentos e espaços."""
-    df.columns = [
-        unicodedata.normalize('NFKD', col).encode('ascii', 'ignore').decode('utf-8').strip()
-        for col in df.columns
-    ]
-    return df
-
-def encontrar_coluna(df, nome_procurado):
-    """Encontra uma coluna no DataFrame com base em um nome aproximado."""
-    # Prioriza a correspondência exata (ignorando maiúsculas/minúsculas)
-    for col in df.columns:
-        if nome_procurado.lower() == col.lower():
-            return col
-    # Se não encontrar, busca por substring
-    for col in df.columns:
-        if nome_procurado.lower() in col.lower():
-            return col
-    return None
-
-
-def validar_formato_atributos(df):
-    """Verifica se há colunas de atributos com formato potencialmente incorreto (ex: AXT_ em vez de ATT_)."""
-    import re
-    colunas_problematicas = []
-    # Regex para encontrar padrões como 'XXX_12345' que não começam com ATT
-    padrao_atributo = re.compile(r'^[A-Z]{3}_\d+$', re.IGNORECASE)
-
-    for col in df.columns:
-        if padrao_atributo.match(col) and not col.upper().startswith('ATT_'):
-            colunas_problematicas.append(col)
-    
-    return colunas_problematicas
-
-def converter_para_json(df, progress_bar=None, cpf_cnpj_raiz_selecionado=None):
-    """Converte um DataFrame em uma lista de dicionários no formato JSON desejado de forma dinâmica."""
-    dados_convertidos = []
-    seq = 1
-    total_rows = len(df)
-    current_row_count = 0 # Novo contador para o progresso
-
-    # Identifica colunas de atributos (começam com ATT_)
-    colunas_atributos = [col for col in df.columns if col.upper().startswith('ATT_')]
-
-    for _, row in df.iterrows(): # Usar '_' pois o índice original não é mais necessário para o progresso
-        atributos = []
-        
-        for col_name in colunas_atributos:
-            if pd.notna(row.get(col_name)):
-                valor = row[col_name]
-                attr_code = col_name.upper()
-
-                # Determina o tratamento dinamicamente
-                valor_str = str(valor).strip().lower()
-                if valor_str in ['ok', 'nok']:
-                    # Tratamento booleano
-                    if valor_str == 'ok':
-                        atributos.append({"atributo": attr_code, "valor": "true"})
-                    elif valor_str == 'nok':
-                        atributos.append({"atributo": attr_code, "valor": "false"})
-                elif attr_code == 'ATT_10824':
-                    # Tratamento de texto puro para caso especial
-                    atributos.append({"atributo": attr_code, "valor": str(valor).strip()})
-                else:
-                    # Tratamento padrão
-                    atributos.append({"atributo": attr_code, "valor": extrair_valor(valor)})
-
-        dado = {
-            "seq": seq,
-            "descricao": row.get("Descricao", ""),
-            "denominacao": row.get("Denominacao", ""),
-            "cpfCnpjRaiz": cpf_cnpj_raiz_selecionado if cpf_cnpj_raiz_selecionado else "39318225", # Usa o valor selecionado ou o padrão
-            "situacao": "Ativado",
-            "modalidade": "IMPORTACAO",
-            "ncm": str(row.get("NCM", "")),
-            "atributos": atributos,
-            "codigosInterno": [str(row.get("PART_NUMBER", ""))],
-            "atributosMultivalorados": [],
-            "atributosCompostos": [],
-            "atributosCompostosMultivalorados": []
-        }
-        dados_convertidos.append(dado)
-        seq += 1
-        current_row_count += 1 # Incrementa o contador
-        if progress_bar:
-            progress_bar.progress(current_row_count / total_rows) # Usa o contador para o progresso
-    return dados_convertidos
-
-def criar_df_pecas(json_data):
-    """Cria um DataFrame com os dados de peças prontos para o banco de dados, incluindo a descrição."""
-    dados_para_excel = []
-    for item in json_data:
-        part_number = item['codigosInterno'][0] if item['codigosInterno'] else ''
-        ncm = item.get('ncm', '')
-        descricao = item.get('descricao', '') # Inclui a descrição
-        atributos_usados = [attr['atributo'] for attr in item.get('atributos', [])]
-        atributos_str = ", ".join(atributos_usados)
-        
-        dados_processados = {
-            'part_number': part_number,
-            'descricao': descricao, # Adiciona a descrição
-            'ncm': ncm,
-            'atributos_usados': atributos_str
-        }
-        dados_para_excel.append(dados_processados)
-    return pd.DataFrame(dados_para_excel)
-
-
-def validar_json_vs_df(json_data, df):
-    """Valida se os dados no JSON correspondem aos do DataFrame processado."""
-    # 1. Validação de contagem de linhas
-    if len(json_data) != len(df):
-        return False, f"Erro de validação: A contagem de itens no JSON ({len(json_data)}) não corresponde à contagem de linhas no DataFrame ({len(df)})."
-
-    # 2. Validação de conteúdo, linha por linha
-    for index, json_item in enumerate(json_data):
-        df_row = df.iloc[index]
-        
-        # Comparar campos principais
-        part_number_json = str(json_item['codigosInterno'][0]).strip() if json_item['codigosInterno'] else ''
-        # Encontrar a coluna PART_NUMBER dinamicamente no DataFrame
-        col_part_number_df = encontrar_coluna(df, "PART_NUMBER")
-        part_number_df = str(df_row.get(col_part_number_df, "")).strip()
-        if part_number_json != part_number_df:
-            return False, f"Erro na linha {index+2}: PART_NUMBER não corresponde ('{part_number_json}' vs '{part_number_df}')."
-
-        ncm_json = json_item.get('ncm', '')
-        col_ncm_df = encontrar_coluna(df, "NCM")
-        ncm_df = str(df_row.get(col_ncm_df, ''))
-        if ncm_json != ncm_df:
-             return False, f"Erro na linha {index+2}: NCM não corresponde ('{ncm_json}' vs '{ncm_df}')."
-
-        # Comparar descrição e denominação
-        descricao_json = json_item.get('descricao', '')
-        col_descricao_df = encontrar_coluna(df, "Descricao")
-        descricao_df = df_row.get(col_descricao_df, "")
-        if descricao_json != descricao_df:
-            return False, f"Erro na linha {index+2} (Part Number: {part_number_df}): Descrição não corresponde ('{descricao_json}' vs '{descricao_df}')."
-
-        denominacao_json = json_item.get('denominacao', '')
-        col_denominacao_df = encontrar_coluna(df, "Denominacao")
-        denominacao_df = df_row.get(col_denominacao_df, "")
-        if denominacao_json != denominacao_df:
-            return False, f"Erro na linha {index+2} (Part Number: {part_number_df}): Denominação não corresponde ('{denominacao_json}' vs '{denominacao_df}')."
-
-        # Validação de atributos: contagem e valores
-        colunas_atributos_df = [col for col in df.columns if col.upper().startswith('ATT_')]
-        atributos_esperados = []
-        for col_name in colunas_atributos_df:
-            if pd.notna(df_row.get(col_name)):
-                valor = df_row[col_name]
-                attr_code = col_name.upper()
-                valor_str = str(valor).strip().lower()
-
-                if valor_str in ['ok', 'nok']:
-                    if valor_str == 'ok':
-                        atributos_esperados.append({"atributo": attr_code, "valor": "true"})
-                    elif valor_str == 'nok':
-                        atributos_esperados.append({"atributo": attr_code, "valor": "false"})
-                elif attr_code == 'ATT_10824':
-                    atributos_esperados.append({"atributo": attr_code, "valor": str(valor).strip()})
-                else:
-                    atributos_esperados.append({"atributo": attr_code, "valor": extrair_valor(valor)})
-        
-        atributos_no_json = json_item.get('atributos', [])
-
-        if len(atributos_esperados) != len(atributos_no_json):
-            return False, f"Erro na linha {index+2} (Part Number: {part_number_df}): A contagem de atributos não corresponde (Planilha: {len(atributos_esperados)}, JSON: {len(atributos_no_json)})."
-
-        # Ordenar listas de atributos para comparação consistente
-        atributos_esperados_sorted = sorted(atributos_esperados, key=lambda x: x['atributo'])
-        atributos_no_json_sorted = sorted(atributos_no_json, key=lambda x: x['atributo'])
-
-        if atributos_esperados_sorted != atributos_no_json_sorted:
-            return False, (
-                f"Erro na linha {index+2} (Part Number: {part_number_df}): Os atributos gerados no JSON não correspondem aos esperados da planilha.\n"
-                f"Atributos Esperados (Planilha): {json.dumps(atributos_esperados_sorted, ensure_ascii=False, indent=2)}\n"
-                f"Atributos Gerados (JSON): {json.dumps(atributos_no_json_sorted, ensure_ascii=False, indent=2)}"
-            )
-
-    return True, "Validação bem-sucedida: Os dados do JSON correspondem aos da planilha."
-
-
-def get_atributos_from_df(df_original):
-    """
-    Extrai atributos de colunas do DataFrame original para a tabela COD_ATRIBUTOS
-    de forma dinâmica, lidando com os padrões "Nome - COD_ATRIB" e "ATT_...".
-    """
-    atributos_data = []
-    
-    for nome_original in df_original.columns:
-        nome_upper = nome_original.upper()
-        
-        # Caso 1: Padrão "Nome - ATT_..."
-        if ' - ATT_' in nome_upper:
-            try:
-                nome_atributo_completo, codigo_atributo = nome_original.rsplit(' - ', 1)
-                codigo_atributo_limpo = codigo_atributo.strip()
-                col_data = df_original[nome_original].astype(str).str.strip().str.lower()
-
-                if 'ok' in col_data.values or 'nok' in col_data.values:
-                    atributos_data.append({'NOME_ATRIBUTO': f"{nome_atributo_completo.strip()} (OK)", 'CODIGO_ATRIB': f"{codigo_atributo_limpo}_true", 'MODALIDADE': 'Importação', 'ORGAO': None})
-                    atributos_data.append({'NOME_ATRIBUTO': f"{nome_atributo_completo.strip()} (NOK)", 'CODIGO_ATRIB': f"{codigo_atributo_limpo}_false", 'MODALIDADE': 'Importação', 'ORGAO': None})
-                else:
-                    atributos_data.append({'NOME_ATRIBUTO': nome_atributo_completo.strip(), 'CODIGO_ATRIB': codigo_atributo_limpo, 'MODALIDADE': 'Importação', 'ORGAO': None})
-            except ValueError:
-                continue
-        # Caso 2: Padrão "ATT_..."
-        elif nome_upper.startswith('ATT_'):
-            codigo_atributo_limpo = nome_upper
-            col_data = df_original[nome_original].astype(str).str.strip().str.lower()
-
-            if 'ok' in col_data.values or 'nok' in col_data.values:
-                atributos_data.append({'NOME_ATRIBUTO': f"{codigo_atributo_limpo} (OK)", 'CODIGO_ATRIB': f"{codigo_atributo_limpo}_true", 'MODALIDADE': 'Importação', 'ORGAO': None})
-                atributos_data.append({'NOME_ATRIBUTO': f"{codigo_atributo_limpo} (NOK)", 'CODIGO_ATRIB': f"{codigo_atributo_limpo}_false", 'MODALIDADE': 'Importação', 'ORGAO': None})
-            else:
-                atributos_data.append({'NOME_ATRIBUTO': codigo_atributo_limpo, 'CODIGO_ATRIB': codigo_atributo_limpo, 'MODALIDADE': 'Importação', 'ORGAO': None})
-
-    return pd.DataFrame(atributos_data).drop_duplicates(subset=['CODIGO_ATRIB'])
+# A leitura, conversão e validação das planilhas ficam em processamento.py, que não depende do Streamlit
 
-def converter_para_df_ncm_x_atrib(df_original):
-    """
-    Converte o DataFrame original em um novo DataFrame com uma linha
-    para cada combinação NCM e ATRIBUTO, de forma dinâmica.
-    """
-    dados_para_tabela = []
-    col_ncm = encontrar_coluna(df_original, "NCM")
-    
-    # Identifica colunas de atributos (começam com ATT_)
-    colunas_atributos = [col for col in df_original.columns if col.upper().startswith('ATT_')]
-
-    for _, row in df_original.iterrows():
-        ncm = str(row.get(col_ncm, "")).strip()
-        if not ncm:
-            continue
-            
-        for col_name in colunas_atributos:
-            if pd.notna(row.get(col_name)):
-                attr_code = col_name.upper()
-                valor = row[col_name]
-                valor_str = str(valor).strip().lower()
-
-                if valor_str in ['ok', 'nok']:
-                    if valor_str == 'ok':
-                        dados_para_tabela.append({'NCM': ncm, 'ATRIB': f"{attr_code}_true"})
-                    elif valor_str == 'nok':
-                        dados_para_tabela.append({'NCM': ncm, 'ATRIB': f"{attr_code}_false"})
-                else:
-                    dados_para_tabela.append({'NCM': ncm, 'ATRIB': attr_code})
-    
-    return pd.DataFrame(dados_para_tabela).drop_duplicates()
-    
 def converter_df_excel_para_ncm_x_atrib(df_original):
     """
     Converte um DataFrame com múltiplas colunas de atributos
     em um novo DataFrame com uma linha para cada combinação NCM e ATRIBUTO.
     """
-    dados_para_tabela = []
-    
     # Identifica a coluna NCM e todas as colunas de atributos
     col_ncm = None
     col_atributos = []
@@ -294,199 +52,550 @@ def converter_df_excel_para_ncm_x_atrib(df_original):
         st.error("Coluna 'NCM' não encontrada na planilha.")
         return pd.DataFrame(columns=['NCM', 'ATRIB'])
     
-    for _, row in df_original.iterrows():
-        ncm_valor = str(row.get(col_ncm, "")).strip()
-        if not ncm_valor:
-            continue
-            
-        for col_atrib in col_atributos:
-            atrib_valor = str(row.get(col_atrib, "")).strip()
-            if atrib_valor: # Garante que o atributo não seja vazio
-                dados_para_tabela.append({
-                    'NCM': ncm_valor,
-                    'ATRIB': atrib_valor
-                })
-    
-    # Cria o DataFrame e remove linhas duplicadas
-    df_result = pd.DataFrame(dados_para_tabela).drop_duplicates()
+    # NCM já vem como texto de 8 dígitos (esquema de leitura); os pares saem linha a linha, coluna a coluna
+    ncms = pd.Series(df_original[col_ncm].to_numpy(dtype=object).repeat(len(col_atributos)))
+    atribs = pd.Series(df_original[col_atributos].to_numpy(dtype=object).ravel())
+    preenchidos = ncms.notna() & atribs.notna()
+    df_result = pd.DataFrame({
+        'NCM': ncms[preenchidos].astype(str).str.strip(),
+        'ATRIB': atribs[preenchidos].astype(str).str.strip(),
+    })
+    # Remove pares com NCM ou atributo vazio e linhas duplicadas
+    df_result = df_result[(df_result['NCM'] != '') & (df_result['ATRIB'] != '')].drop_duplicates().reset_index(drop=True)
     return df_result
 
 
 # --- Funções para o Banco de Dados SQLite ---
-def get_db_connection():
-    """Cria e retorna uma nova conexão com o banco de dados para cada uso."""
-    return sqlite3.connect('bytebook.db')
-
-def create_table_ncm_x_atrib_x_pn():
-    """Cria a tabela de pecas se ela não existir, com a nova coluna 'descricao'."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS ncm_x_atrib_x_pn (
-            part_number TEXT PRIMARY KEY,
-            descricao TEXT,
-            ncm TEXT,
-            atributos_usados TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def create_table_cod_atributos():
-    """Cria a tabela COD_ATRIBUTOS se ela não existir."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS COD_ATRIBUTOS (
-            NOME_ATRIBUTO TEXT,
-            CODIGO_ATRIB TEXT PRIMARY KEY,
-            MODALIDADE TEXT,
-            ORGAO TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def create_table_ncm_x_atrib():
-    """Cria a tabela NCM_X_ATRIB se ela não existir, com chave primária composta."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS NCM_X_ATRIB (
-            NCM TEXT,
-            ATRIB TEXT,
-            PRIMARY KEY (NCM, ATRIB)
-        )
-    ''')
-    conn.commit()
-    conn.close()
+@st.cache_resource
+def get_gerenciador_conexoes():
+    """Cria o gerenciador de conexões uma única vez por processo, reaproveitado entre reruns e sessões."""
+    return GerenciadorConexoes(CAMINHO_BANCO)
+
+def conexao_leitura():
+    """Conexão de leitura do pool compartilhado (usar com `with`)."""
+    return get_gerenciador_conexoes().leitura()
 
+def conexao_escrita(*tabelas):
+    """
+    Conexão de escrita serializada compartilhada (usar com `with`); faz commit ao sair do bloco.
+    Informe as tabelas alteradas para invalidar apenas o cache delas; sem tabelas, todo o cache é invalidado.
+    """
+    return get_gerenciador_conexoes().escrita(*tabelas)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _ler_tabela_em_cache(consulta, caminho_banco, geracao):
+    """Executa a consulta; o resultado fica em memória até a próxima escrita na tabela (nova geração)."""
+    with conexao_leitura() as conn:
+        return pd.read_sql_query(consulta, conn)
+
+def ler_tabela_referencia(tabela, consulta):
+    """Lê uma tabela de referência pequena, servindo do cache enquanto ela não for alterada."""
+    gerenciador = get_gerenciador_conexoes()
+    return _ler_tabela_em_cache(consulta, gerenciador.caminho_banco, gerenciador.geracao(tabela))
+
+def get_cod_atributos():
+    """Códigos e nomes de atributos da tabela COD_ATRIBUTOS (em cache)."""
+    return ler_tabela_referencia('COD_ATRIBUTOS', "SELECT CODIGO_ATRIB, NOME_ATRIBUTO FROM COD_ATRIBUTOS")
+
+def get_ncm_x_atrib():
+    """Combinações NCM x atributo da tabela NCM_X_ATRIB (em cache)."""
+    return ler_tabela_referencia('NCM_X_ATRIB', "SELECT NCM, ATRIB FROM NCM_X_ATRIB")
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _mapa_atributos_em_cache(caminho_banco, geracao):
+    """Carrega o mapa NCM -> atributos; uma nova geração de NCM_X_ATRIB ou COD_ATRIBUTOS gera um novo mapa."""
+    with conexao_leitura() as conn:
+        return MapaAtributosNcm(conn)
+
+def get_mapa_atributos_ncm():
+    """Mapa em memória NCM -> atributos, compartilhado entre sessões e recarregado quando as tabelas mudam."""
+    gerenciador = get_gerenciador_conexoes()
+    geracao = gerenciador.geracao('NCM_X_ATRIB') + gerenciador.geracao('COD_ATRIBUTOS')
+    return _mapa_atributos_em_cache(gerenciador.caminho_banco, geracao)
 
 def insert_new_items(df_new_items):
     """Insere novos itens na base de dados, ignorando duplicatas."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    novos_itens = 0
-    
-    sql_insert = "INSERT OR IGNORE INTO ncm_x_atrib_x_pn (part_number, descricao, ncm, atributos_usados) VALUES (?, ?, ?, ?)"
-    
-    for _, row in df_new_items.iterrows():
-        try:
-            cursor.execute(sql_insert, (row['part_number'], row['descricao'], row['ncm'], row['atributos_usados']))
-            if cursor.rowcount > 0:
-                novos_itens += 1
-        except Exception as e:
-            st.error(f"Erro ao inserir item {row['part_number']}: {e}")
-    
-    conn.commit()
-    conn.close()
+    with conexao_escrita('ncm_x_atrib_x_pn', 'pn_x_atrib') as conn:
+        novos_itens, erros = inserir_pecas(conn, df_new_items)
+    for linha, e in erros:
+        st.error(f"Erro ao inserir item {linha[0]}: {e}")
     return novos_itens
 
 def insert_data_from_df(df, table_name):
     """Insere dados de um DataFrame em uma tabela especificada."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    novos_itens = 0
-    
-    # Use tuple(df.columns) para garantir a ordem e evitar erros
-    columns = ", ".join(df.columns)
-    placeholders = ", ".join("?" * len(df.columns))
-    
-    sql_insert = f"INSERT OR IGNORE INTO {table_name} ({columns}) VALUES ({placeholders})"
-    
-    for _, row in df.iterrows():
-        try:
-            cursor.execute(sql_insert, tuple(row))
-            if cursor.rowcount > 0:
-                novos_itens += 1
-        except Exception as e:
-            st.error(f"Erro ao inserir dados na tabela {table_name}: {e}")
-            
-    conn.commit()
-    conn.close()
+    try:
+        with conexao_escrita(table_name, 'pn_x_atrib') as conn:
+            novos_itens, erros = inserir_dados(conn, df, table_name)
+    except sqlite3.Error as e:
+        st.error(f"Erro ao inserir dados na tabela {table_name}: {e}")
+        return 0
+    for linha, e in erros:
+        st.error(f"Erro ao inserir dados na tabela {table_name}: {e}")
     return novos_itens
 
-def get_all_items():
-    """Recupera todos os itens da base de dados e os retorna como DataFrame."""
-    conn = get_db_connection()
-    df = pd.read_sql_query("SELECT * FROM ncm_x_atrib_x_pn", conn)
-    conn.close()
-    
-    df.rename(columns={'part_number': 'Part Number', 'atributos_usados': 'Atributos Usados'}, inplace=True)
-    return df
-
-def create_table_cnpj_options():
-    """Cria a tabela cnpj_options se ela não existir."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cnpj_options (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            cpf_cnpj_raiz TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
+# Cabeçalhos da base de peças exportada, como na planilha gerada pelas versões anteriores
+COLUNAS_EXPORTACAO_BASE = {'part_number': 'Part Number', 'atributos_usados': 'Atributos Usados'}
+
+def produtor_exportacao_base(formato):
+    """
+    Função sem argumentos que exporta a base de peças (ncm_x_atrib_x_pn) no formato pedido, no momento do download.
+    O download é gerado fora da thread do script, por isso o gerenciador de conexões é capturado aqui.
+    """
+    gerenciador = get_gerenciador_conexoes()
+
+    def exportar():
+        with gerenciador.leitura() as conn:
+            with exportar_tabela_em_arquivo(conn, 'ncm_x_atrib_x_pn', formato, COLUNAS_EXPORTACAO_BASE, 'Base_de_Pecas') as arquivo:
+                return arquivo.read()
+    return exportar
+
+# Totais mantidos pelos gatilhos de stats_totais, usados no lugar de COUNT(*) quando não há filtro
+CONTAGENS_MATERIALIZADAS = {'ncm_x_atrib_x_pn': 'part_numbers'}
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _contar_em_cache(tabela, filtro_coluna, filtro_operador, filtro_valor, caminho_banco, geracao):
+    """Conta os registros de uma tabela; o resultado vale até a próxima escrita na tabela (nova geração)."""
+    with conexao_leitura() as conn:
+        if not filtro_valor and tabela.lower() in CONTAGENS_MATERIALIZADAS:
+            linha = conn.execute("SELECT valor FROM stats_totais WHERE chave = ?", (CONTAGENS_MATERIALIZADAS[tabela.lower()],)).fetchone()
+            if linha is not None:
+                return linha[0]
+        return ConsultaPaginada(conn, tabela, filtro_coluna=filtro_coluna, filtro_operador=filtro_operador, filtro_valor=filtro_valor).contar(conn)
+
+def contar_registros(tabela, filtro_coluna=None, filtro_operador='contem', filtro_valor=None):
+    """Total de registros de uma tabela (com filtro opcional), servido do cache enquanto a tabela não for alterada."""
+    gerenciador = get_gerenciador_conexoes()
+    return _contar_em_cache(tabela, filtro_coluna, filtro_operador, filtro_valor, gerenciador.caminho_banco, gerenciador.geracao(tabela))
+
+def _mudar_pagina(chave_estado, cursor):
+    """Callback dos botões de navegação: None volta à primeira página, 'anterior' recua e um cursor avança."""
+    cursores = st.session_state[chave_estado]['cursores']
+    if cursor is None:
+        del cursores[1:]
+    elif cursor == 'anterior':
+        if len(cursores) > 1:
+            cursores.pop()
+    else:
+        cursores.append(cursor)
+
+def navegador_tabela(tabela, chave, ordenar_por=None, decrescente=False, tamanho_pagina=TAMANHO_PAGINA_PADRAO):
+    """
+    Exibe uma tabela do banco página por página, com ordenação e filtro executados no SQLite.
+    Cada interação lê apenas a página exibida; a posição da navegação fica em st.session_state.
+    """
+    with conexao_leitura() as conn:
+        colunas = colunas_tabela(conn, tabela)
+        opcoes_ordem = [None] + colunas_ordenaveis(conn, tabela)
+
+    col_ordem, col_direcao, col_filtro, col_operador, col_valor = st.columns([2, 1, 2, 1, 2])
+    ordenar_por = col_ordem.selectbox(
+        "Ordenar por",
+        opcoes_ordem,
+        index=opcoes_ordem.index(ordenar_por) if ordenar_por in opcoes_ordem else 0,
+        format_func=lambda col: "Ordem de inserção" if col is None else col,
+        help="Apenas colunas indexadas, para que a ordenação não precise ler a tabela inteira.",
+        key=f"{chave}_ordem"
+    )
+    decrescente = col_direcao.toggle("Decrescente", value=decrescente, key=f"{chave}_decrescente")
+    filtro_coluna = col_filtro.selectbox(
+        "Filtrar pela coluna",
+        [None] + colunas,
+        format_func=lambda col: "(sem filtro)" if col is None else col,
+        key=f"{chave}_filtro_coluna"
+    )
+    filtro_operador = col_operador.selectbox(
+        "Condição", list(OPERADORES_FILTRO), format_func=OPERADORES_FILTRO.get, key=f"{chave}_filtro_operador"
+    )
+    filtro_valor = col_valor.text_input("Valor", key=f"{chave}_filtro_valor") if filtro_coluna else ""
+
+    # Qualquer mudança na consulta volta para a primeira página
+    chave_estado = f"{chave}_navegacao"
+    assinatura = (tabela, ordenar_por, decrescente, filtro_coluna, filtro_operador, filtro_valor, tamanho_pagina)
+    if st.session_state.get(chave_estado, {}).get('assinatura') != assinatura:
+        st.session_state[chave_estado] = {'assinatura': assinatura, 'cursores': [None]}
+    cursores = st.session_state[chave_estado]['cursores']
+
+    with conexao_leitura() as conn:
+        consulta = ConsultaPaginada(conn, tabela, ordenar_por, decrescente, filtro_coluna, filtro_operador, filtro_valor, tamanho_pagina)
+        df_pagina, proximo_cursor = consulta.pagina(conn, cursores[-1])
+    total = contar_registros(tabela, filtro_coluna, filtro_operador, filtro_valor)
+
+    st.dataframe(df_pagina)
+    col_primeira, col_anterior, col_proxima, col_info = st.columns([1, 1, 1, 4])
+    col_primeira.button("⏮ Primeira", key=f"{chave}_primeira", disabled=len(cursores) == 1,
+                        on_click=_mudar_pagina, args=(chave_estado, None))
+    col_anterior.button("◀ Anterior", key=f"{chave}_anterior", disabled=len(cursores) == 1,
+                        on_click=_mudar_pagina, args=(chave_estado, 'anterior'))
+    col_proxima.button("Próxima ▶", key=f"{chave}_proxima", disabled=proximo_cursor is None,
+                       on_click=_mudar_pagina, args=(chave_estado, proximo_cursor))
+    total_paginas = max(1, -(-total // tamanho_pagina))
+    col_info.caption(f"Página {len(cursores)} de {total_paginas} · {total} registros")
 
 def insert_cnpj_option(name, cpf_cnpj_raiz):
     """Insere uma nova opção de CNPJ/CPF Raiz na tabela cnpj_options."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("INSERT INTO cnpj_options (name, cpf_cnpj_raiz) VALUES (?, ?)", (name, cpf_cnpj_raiz))
-        conn.commit()
+        with conexao_escrita('cnpj_options') as conn:
+            conn.execute("INSERT INTO cnpj_options (name, cpf_cnpj_raiz) VALUES (?, ?)", (name, cpf_cnpj_raiz))
         return True
     except sqlite3.IntegrityError:
         st.error(f"Erro: Já existe uma opção com o nome '{name}'.")
         return False
-    finally:
-        conn.close()
 
 def get_cnpj_options():
-    """Recupera todas as opções de CNPJ/CPF Raiz da tabela cnpj_options."""
-    conn = get_db_connection()
-    df = pd.read_sql_query("SELECT id, name, cpf_cnpj_raiz FROM cnpj_options ORDER BY name", conn)
-    conn.close()
-    return df
+    """Recupera todas as opções de CNPJ/CPF Raiz da tabela cnpj_options (em cache até a próxima alteração)."""
+    return ler_tabela_referencia('cnpj_options', "SELECT id, name, cpf_cnpj_raiz FROM cnpj_options ORDER BY name")
 
 def update_cnpj_option(option_id, new_name, new_cpf_cnpj_raiz):
     """Atualiza uma opção de CNPJ/CPF Raiz existente na tabela cnpj_options."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("UPDATE cnpj_options SET name = ?, cpf_cnpj_raiz = ? WHERE id = ?", (new_name, new_cpf_cnpj_raiz, option_id))
-        conn.commit()
+        with conexao_escrita('cnpj_options') as conn:
+            conn.execute("UPDATE cnpj_options SET name = ?, cpf_cnpj_raiz = ? WHERE id = ?", (new_name, new_cpf_cnpj_raiz, option_id))
         return True
     except sqlite3.IntegrityError:
         st.error(f"Erro: Já existe uma opção com o nome '{new_name}'.")
         return False
-    finally:
-        conn.close()
 
 def delete_cnpj_option(option_id):
     """Deleta uma opção de CNPJ/CPF Raiz da tabela cnpj_options."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM cnpj_options WHERE id = ?", (option_id,))
-        conn.commit()
+        with conexao_escrita('cnpj_options') as conn:
+            conn.execute("DELETE FROM cnpj_options WHERE id = ?", (option_id,))
         return True
     except Exception as e:
         st.error(f"Erro ao deletar a opção: {e}")
         return False
-    finally:
-        conn.close()
+
+@st.cache_resource
+def inicializar_banco():
+    """Garante o esquema do banco atualizado. Executa uma vez por processo; os reruns não fazem nenhum DDL."""
+    with conexao_escrita() as conn:
+        return aplicar_migracoes(conn)
+
+# --- Processamento de Planilhas (Aba 1) ---
+MAX_PROCESSOS = os.cpu_count() or 1 # Arquivos lidos e convertidos ao mesmo tempo quando vários são enviados
+MAX_BYTES_CACHE_RESULTADOS = 512 * 1024 * 1024 # Limite de memória do cache de resultados por conteúdo de arquivo
+
+class CacheResultados:
+    """
+    Cache LRU, em memória e compartilhado entre as sessões, dos resultados de leitura, conversão e validação
+    de cada arquivo enviado (os eventos de `converter_aba` por aba). A chave é o hash do conteúdo do arquivo
+    mais os parâmetros da conversão, então reenviar a mesma planilha não repete o trabalho pesado.
+    Os resultados ficam serializados com pickle: o tamanho de cada entrada é exato e cada leitura devolve
+    uma cópia independente. As entradas menos usadas são descartadas ao passar de `max_bytes`.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES_CACHE_RESULTADOS):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._itens = OrderedDict()
+        self._total_bytes = 0
+
+    def obter(self, chave):
+        """Retorna o resultado guardado para a chave (marcando-o como usado) ou None."""
+        with self._lock:
+            dados = self._itens.get(chave)
+            if dados is None:
+                return None
+            self._itens.move_to_end(chave)
+        return pickle.loads(dados)
+
+    def guardar(self, chave, abas):
+        """Guarda o resultado de um arquivo; resultados maiores que o limite inteiro não são guardados."""
+        dados = pickle.dumps(abas, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(dados) > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._itens.pop(chave, None)
+            if anterior is not None:
+                self._total_bytes -= len(anterior)
+            self._itens[chave] = dados
+            self._total_bytes += len(dados)
+            while self._total_bytes > self.max_bytes:
+                _, descartado = self._itens.popitem(last=False)
+                self._total_bytes -= len(descartado)
+
+@st.cache_resource
+def get_cache_resultados():
+    """Cria o cache de resultados uma única vez por processo."""
+    return CacheResultados(MAX_BYTES_CACHE_RESULTADOS)
+
+def chave_cache_arquivo(conteudo, cpf_cnpj_raiz, streaming):
+    """Chave do cache: hash do conteúdo do arquivo mais tudo o que altera o resultado da conversão."""
+    return (hashlib.sha256(conteudo).hexdigest(), cpf_cnpj_raiz, streaming, TAMANHO_BLOCO_STREAMING)
+
+def registrar_eventos(eventos, registro):
+    """Repassa os eventos de uma aba à medida que são consumidos, guardando uma cópia em `registro`."""
+    for evento in eventos:
+        registro.append(evento)
+        yield evento
+
+def resumir_evento(evento):
+    """Cópia do evento sem os dados pesados (JSON e linhas para o banco), suficiente para reexibir a aba."""
+    if evento['tipo'] == 'bloco_convertido' and 'json' in evento:
+        return {'tipo': 'bloco_convertido', 'numero': evento['numero'], 'descricao': evento['descricao'], 'itens': len(evento['json'])}
+    if evento['tipo'] == 'concluido':
+        return {chave: valor for chave, valor in evento.items() if chave != 'df_cod_atributos'}
+    return evento
+
+def processar_aba(nome_arquivo, sheet_name, eventos, streaming=False, contagens=None):
+    """
+    Exibe o andamento de uma aba e grava no banco de dados os blocos convertidos, na ordem em que chegam.
+    `eventos` vem de `converter_aba`: no processamento em série ele é consumido bloco a bloco (no modo
+    streaming, apenas um bloco fica em memória por vez); no processamento paralelo, já chega pronto do pool.
+    Toda gravação acontece aqui, na thread do script, que funciona como o único escritor do banco.
+
+    Retorna o resumo da aba ({'eventos', 'contagens'}), guardado no job da sessão. Quando `contagens` é
+    informado (reexibição de um job já processado), apenas as mensagens são refeitas, sem tocar no banco.
+    """
+    gravar = contagens is None
+    st.subheader(f"Processando aba: **{sheet_name}**")
+    if streaming:
+        st.info(f"Modo streaming: a aba '{sheet_name}' será lida e processada em blocos de até {TAMANHO_BLOCO_STREAMING} linhas.")
+
+    # Áreas reservadas para manter a ordem das mensagens, mesmo processando bloco a bloco
+    area_conversao = st.container()
+    area_banco = st.container()
+
+    # No modo streaming o JSON da aba vai para um arquivo temporário, bloco a bloco, em vez de ficar em memória
+    json_aba = ItensEmDisco() if streaming and gravar else []
+    total_itens = 0
+    eventos_resumidos = []
+    if gravar:
+        contagens = {'novos_itens': 0, 'novas_combinacoes': 0, 'novos_atributos': 0}
+
+    with area_banco:
+        db_progress_text = st.empty()
+        db_progress_bar = st.empty()
+
+    for evento in eventos:
+        tipo = evento['tipo']
+        eventos_resumidos.append(resumir_evento(evento))
+
+        if tipo == 'formato_invalido':
+            with area_conversao:
+                st.error(f"Erro de Formato na Aba '{sheet_name}' do Arquivo: '{nome_arquivo}'")
+                st.warning("As seguintes colunas parecem ser atributos, mas estão com formato incorreto (o correto é 'ATT_...'):")
+                st.code(', '.join(evento['colunas']))
+            break
+
+        if tipo == 'bloco_lido':
+            with area_conversao:
+                if not streaming:
+                    st.info(f"Total de linhas na aba '{sheet_name}': **{evento['linhas']}**")
+                if evento['amostra'] is not None:
+                    st.dataframe(evento['amostra'], hide_index=True, width='stretch') # No modo streaming, mostra apenas o primeiro bloco
+
+        elif tipo == 'duplicados':
+            with area_conversao:
+                st.warning(f"Part Numbers duplicados encontrados na aba '{sheet_name}'. Apenas a primeira ocorrência será processada.")
+
+        elif tipo == 'erro':
+            with area_conversao:
+                st.error(evento['mensagem'], icon=evento.get('icone'))
+                divergencias = evento.get('divergencias')
+                if divergencias is not None and not divergencias.empty:
+                    st.dataframe(divergencias, hide_index=True, width='stretch')
+                if evento['numero'] > 1:
+                    st.warning(f"Os {total_itens} itens dos blocos anteriores já foram gravados no banco de dados.")
+            break
+
+        elif tipo == 'bloco_convertido':
+            total_itens += eventos_resumidos[-1]['itens']
+            if gravar:
+                json_aba.extend(evento['json'])
+
+                # Inserção no banco de dados, bloco a bloco
+                with area_banco:
+                    db_progress_text.text(f"Inserindo novas peças ({evento['descricao']})...")
+                    contagens['novos_itens'] += insert_new_items(evento['df_pecas'])
+                    db_progress_bar.progress(0.5)
+
+                    db_progress_text.text(f"Inserindo novas combinações NCM x Atributo ({evento['descricao']})...")
+                    contagens['novas_combinacoes'] += insert_data_from_df(evento['df_ncm_x_atrib'], 'NCM_X_ATRIB')
+                    db_progress_bar.progress(0.9)
+
+        elif tipo == 'vazia':
+            with area_conversao:
+                st.info(f"A aba '{sheet_name}' não possui linhas para processar.")
+            break
+
+        elif tipo == 'concluido':
+            with area_conversao:
+                if streaming:
+                    st.info(f"Total de linhas na aba '{sheet_name}': **{evento['linhas_lidas']}**")
+                st.success(f"Conversão JSON da aba '{sheet_name}' concluída! {total_itens} itens processados.", icon="✅")
+                st.success(f"Validação da aba '{sheet_name}' bem-sucedida: {evento['mensagem_validacao']}", icon="✅")
+
+            if gravar:
+                # Armazena o JSON gerado no estado da sessão
+                nome_base_arquivo = nome_arquivo.rsplit('.', 1)[0]
+                st.session_state.generated_jsons[f"{nome_base_arquivo}_{sheet_name}"] = json_aba
+
+                with area_banco:
+                    db_progress_text.text("Inserindo novos atributos...")
+                    contagens['novos_atributos'] = insert_data_from_df(evento['df_cod_atributos'], 'COD_ATRIBUTOS')
+                    db_progress_bar.progress(1.0)
+
+            with area_banco:
+                db_progress_text.empty()
+                db_progress_bar.empty()
+                st.markdown("---")
+                st.subheader(f"Atualizando Banco de Dados para a aba '{sheet_name}'")
+                st.success(f"Atualização do Banco de Dados para a aba '{sheet_name}' concluída!", icon="✅")
+
+                # Exibição de Resultados
+                st.markdown("---")
+                st.subheader(f"Resumo da Atualização do Banco de Dados para a aba '{sheet_name}'")
+
+                if contagens['novos_itens'] > 0:
+                    st.success(f"**Peças:** {contagens['novos_itens']} novos itens adicionados da aba '{sheet_name}'.", icon="✅")
+                else:
+                    st.info(f"**Peças:** Base de dados já estava atualizada para a aba '{sheet_name}'.", icon="ℹ️")
+
+                if contagens['novos_atributos'] > 0:
+                    st.success(f"**Atributos:** {contagens['novos_atributos']} novos códigos de atributos adicionados da aba '{sheet_name}'.", icon="✅")
+                else:
+                    st.info(f"**Atributos:** Tabela de códigos de atributos já estava atualizada para a aba '{sheet_name}'.", icon="ℹ️")
+
+                if contagens['novas_combinacoes'] > 0:
+                    st.success(f"**NCM x Atributo:** {contagens['novas_combinacoes']} novas combinações adicionadas da aba '{sheet_name}'.", icon="✅")
+                else:
+                    st.info(f"**NCM x Atributo:** Tabela de combinações já estava atualizada para a aba '{sheet_name}'.", icon="ℹ️")
+                st.markdown("---") # Separador entre abas
+
+    db_progress_text.empty()
+    db_progress_bar.empty()
+    return {'eventos': eventos_resumidos, 'contagens': contagens}
+
+def registrar_aviso(resumo_arquivo, tipo, mensagem):
+    """Exibe um aviso sobre o arquivo (st.caption, st.error...) e o guarda no resumo do arquivo para os reruns."""
+    getattr(st, tipo)(mensagem)
+    resumo_arquivo['avisos'].append((tipo, mensagem))
+
+def novo_resumo_arquivo(uploaded_file, streaming):
+    """Resumo de um arquivo dentro do job: avisos e, para cada aba, o resumo devolvido por `processar_aba`."""
+    return {'nome': uploaded_file.name, 'streaming': streaming, 'avisos': [], 'abas': []}
+
+def processar_arquivo_em_serie(uploaded_file, cpf_cnpj_raiz):
+    """
+    Lê, converte e grava um arquivo na thread do script, aproveitando o cache de resultados. Retorna o resumo do arquivo.
+    Arquivos em modo streaming não passam pelo cache: guardar os eventos de todos os blocos manteria a planilha
+    inteira em memória, justamente o que a leitura bloco a bloco evita.
+    """
+    streaming = st.session_state.modo_streaming or uploaded_file.size > LIMITE_STREAMING_BYTES
+    resumo_arquivo = novo_resumo_arquivo(uploaded_file, streaming)
+    if streaming:
+        # Leitura bloco a bloco: apenas um bloco fica em memória por vez
+        for sheet_name, blocos in ler_planilha(uploaded_file, streaming, TAMANHO_BLOCO_STREAMING):
+            resumo_aba = processar_aba(uploaded_file.name, sheet_name, converter_aba(sheet_name, blocos, cpf_cnpj_raiz, streaming), streaming=streaming)
+            resumo_arquivo['abas'].append((sheet_name, resumo_aba))
+        return resumo_arquivo
+
+    cache = get_cache_resultados()
+    chave = chave_cache_arquivo(uploaded_file.getvalue(), cpf_cnpj_raiz, streaming)
+    abas = cache.obter(chave)
+    if abas is not None:
+        # Arquivo já processado antes: apenas exibe e grava o resultado guardado
+        registrar_aviso(resumo_arquivo, 'caption', "Resultado reaproveitado do cache: este arquivo já havia sido processado.")
+        for sheet_name, eventos in abas:
+            resumo_arquivo['abas'].append((sheet_name, processar_aba(uploaded_file.name, sheet_name, eventos, streaming=streaming)))
+        return resumo_arquivo
+
+    abas = []
+    for sheet_name, blocos in ler_planilha(uploaded_file, streaming, TAMANHO_BLOCO_STREAMING):
+        eventos = []
+        resumo_aba = processar_aba(uploaded_file.name, sheet_name, registrar_eventos(converter_aba(sheet_name, blocos, cpf_cnpj_raiz, streaming), eventos), streaming=streaming)
+        resumo_arquivo['abas'].append((sheet_name, resumo_aba))
+        abas.append((sheet_name, eventos))
+    cache.guardar(chave, abas)
+    return resumo_arquivo
+
+@st.cache_resource
+def get_pool_processos():
+    """
+    Pool de processos compartilhado por todas as sessões, usado para ler e converter vários arquivos ao mesmo tempo.
+    Usa 'spawn' para que os processos filhos não herdem as threads e conexões do servidor Streamlit.
+    """
+    return ProcessPoolExecutor(max_workers=MAX_PROCESSOS, mp_context=multiprocessing.get_context('spawn'))
+
+def processar_arquivos_em_paralelo(arquivos, cpf_cnpj_raiz):
+    """
+    Envia cada arquivo para o pool de processos e, conforme cada um termina, exibe e grava suas abas no
+    expander correspondente. `arquivos` é uma lista de pares (arquivo enviado, expander).
+    Arquivos em modo streaming não vão para o pool: o processo filho teria de montar e devolver os eventos de
+    todos os blocos de uma vez. Eles são processados bloco a bloco aqui, enquanto o pool converte os demais.
+    Retorna os resumos dos arquivos na ordem do envio.
+    """
+    pool = get_pool_processos()
+    cache = get_cache_resultados()
+    resumos = []
+    tarefas = {}
+    em_blocos = []
+    for uploaded_file, expander in arquivos:
+        streaming = st.session_state.modo_streaming or uploaded_file.size > LIMITE_STREAMING_BYTES
+        if streaming:
+            resumos.append(None) # Preenchido por processar_arquivo_em_serie, depois de enviados os demais ao pool
+            em_blocos.append((len(resumos) - 1, uploaded_file, expander))
+            continue
+        resumo_arquivo = novo_resumo_arquivo(uploaded_file, streaming)
+        resumos.append(resumo_arquivo)
+        conteudo = uploaded_file.getvalue()
+        chave = chave_cache_arquivo(conteudo, cpf_cnpj_raiz, streaming)
+        abas = cache.obter(chave)
+        if abas is not None:
+            # Arquivo já processado antes: apenas exibe e grava o resultado guardado
+            with expander:
+                registrar_aviso(resumo_arquivo, 'caption', "Resultado reaproveitado do cache: este arquivo já havia sido processado.")
+                for sheet_name, eventos in abas:
+                    resumo_arquivo['abas'].append((sheet_name, processar_aba(uploaded_file.name, sheet_name, eventos, streaming=streaming)))
+            continue
+        with expander:
+            aguardando = st.empty()
+            aguardando.info("Aguardando o processamento paralelo do arquivo...")
+        futuro = pool.submit(processar_arquivo, uploaded_file.name, conteudo, cpf_cnpj_raiz, streaming, TAMANHO_BLOCO_STREAMING)
+        tarefas[futuro] = (uploaded_file, expander, aguardando, resumo_arquivo, chave)
+
+    for posicao, uploaded_file, expander in em_blocos:
+        with expander:
+            resumos[posicao] = processar_arquivo_em_serie(uploaded_file, cpf_cnpj_raiz)
+
+    for futuro in as_completed(tarefas):
+        uploaded_file, expander, aguardando, resumo_arquivo, chave = tarefas[futuro]
+        with expander:
+            aguardando.empty()
+            try:
+                abas = futuro.result()
+                cache.guardar(chave, abas)
+            except BrokenProcessPool:
+                # Um processo filho morreu; o pool é recriado na próxima execução
+                get_pool_processos.clear()
+                registrar_aviso(resumo_arquivo, 'error', f"O processamento paralelo do arquivo '{uploaded_file.name}' foi interrompido. Envie o arquivo novamente.")
+                continue
+            except Exception as e:
+                registrar_aviso(resumo_arquivo, 'error', f"Erro ao processar o arquivo '{uploaded_file.name}': {e}")
+                continue
+            for sheet_name, eventos in abas:
+                resumo_arquivo['abas'].append((sheet_name, processar_aba(uploaded_file.name, sheet_name, eventos, streaming=resumo_arquivo['streaming'])))
+    return resumos
+
+def chave_conjunto_upload(uploaded_files, cpf_cnpj_raiz, modo_streaming):
+    """Identifica o conjunto de arquivos enviados e as opções que mudam o resultado do processamento."""
+    arquivos = tuple((getattr(uploaded_file, 'file_id', None), uploaded_file.name, uploaded_file.size) for uploaded_file in uploaded_files)
+    return (arquivos, cpf_cnpj_raiz, modo_streaming)
+
+def exibir_job(job):
+    """Reexibe os resultados de um job já processado, sem ler planilhas nem gravar no banco."""
+    for resumo_arquivo in job['arquivos']:
+        with st.expander(f"Processando arquivo: {resumo_arquivo['nome']}", expanded=st.session_state.expand_all):
+            for tipo, mensagem in resumo_arquivo['avisos']:
+                getattr(st, tipo)(mensagem)
+            for sheet_name, resumo_aba in resumo_arquivo['abas']:
+                processar_aba(resumo_arquivo['nome'], sheet_name, resumo_aba['eventos'], streaming=resumo_arquivo['streaming'], contagens=resumo_aba['contagens'])
 
 # --- Lógica Principal da Aplicação Streamlit ---
 
-# Garante que as tabelas do banco de dados existam
-create_table_ncm_x_atrib_x_pn()
-create_table_cod_atributos()
-create_table_ncm_x_atrib()
-create_table_cnpj_options()
+# Aplica as migrações pendentes do esquema (apenas uma vez por processo)
+inicializar_banco()
 
 # Inicializa o estado da sessão para armazenar os JSONs gerados
 if 'generated_jsons' not in st.session_state:
@@ -499,14 +608,29 @@ if 'selected_cpf_cnpj_raiz' not in st.session_state:
     st.session_state.selected_cpf_cnpj_raiz = None
 if 'confirm_delete_cnpj_id' not in st.session_state:
     st.session_state.confirm_delete_cnpj_id = None
-if 'split_json_files' not in st.session_state:
-    st.session_state.split_json_files = True # Default: quebrar em lotes de 100
-
-# Cria as abas na parte superior
-tab1, tab2, tab3, tab4, tab5 = st.tabs(["Processamento de Planilhas", "Gerenciamento do Banco de Dados", "Análises e Estatísticas", "Consulta de Atributos", "Configuração de CNPJ/CPF Raiz"])
+if 'criterio_lote' not in st.session_state:
+    st.session_state.criterio_lote = CRITERIO_LOTE_PADRAO # Default: quebrar em lotes de 100 itens
+if 'tamanho_lote' not in st.session_state:
+    st.session_state.tamanho_lote = TAMANHO_LOTE_PADRAO
+if 'limite_lote_kb' not in st.session_state:
+    st.session_state.limite_lote_kb = LIMITE_BYTES_LOTE_PADRAO // 1024
+if 'formato_json' not in st.session_state:
+    st.session_state.formato_json = FORMATO_JSON_PADRAO
+if 'nivel_compressao_zip' not in st.session_state:
+    st.session_state.nivel_compressao_zip = NIVEL_COMPRESSAO_PADRAO
+if 'modo_streaming' not in st.session_state:
+    st.session_state.modo_streaming = False
+if 'job_processamento' not in st.session_state:
+    st.session_state.job_processamento = None # Resultado do último conjunto de arquivos processado na Aba 1
+
+# Cada aba é uma página; apenas a página selecionada é executada a cada interação.
+# O Streamlit descarta o estado de widgets fora da página ativa, então preservamos a opção de CNPJ escolhida.
+if 'cnpj_selector' in st.session_state:
+    st.session_state.cnpj_selector = st.session_state.cnpj_selector
 
 # Conteúdo da Aba 1: Processamento de Planilhas
-with tab1:
+def pagina_processamento():
+    """Aba 1: conversão de planilhas em JSON e atualização da base."""
     st.title("Conversor e Atualizador de Base de Dados de Peças")
     st.markdown("Envie uma ou mais planilhas Excel para converter em JSON e atualizar a base de dados.")
 
@@ -528,10 +652,38 @@ with tab1:
 
     st.divider() # Separador visual mais elegante
 
-    st.session_state.split_json_files = st.checkbox(
-        "Quebrar arquivos JSON em lotes de 100 itens (desmarque para gerar um único arquivo por planilha)",
-        value=st.session_state.split_json_files,
-        key="split_json_checkbox"
+    st.session_state.criterio_lote = st.selectbox(
+        "Divisão dos arquivos JSON de cada planilha:",
+        list(CRITERIOS_LOTE),
+        index=list(CRITERIOS_LOTE).index(st.session_state.criterio_lote),
+        format_func=lambda criterio: CRITERIOS_LOTE[criterio],
+        key="criterio_lote_selector"
+    )
+    if st.session_state.criterio_lote == 'itens':
+        st.session_state.tamanho_lote = st.number_input(
+            "Itens por arquivo", min_value=1, value=st.session_state.tamanho_lote, step=50, key="tamanho_lote_input"
+        )
+    elif st.session_state.criterio_lote in ('bytes', 'ncm'):
+        st.session_state.limite_lote_kb = st.number_input(
+            "Tamanho máximo de cada arquivo, em KB (0 = sem limite)",
+            min_value=0,
+            value=st.session_state.limite_lote_kb,
+            step=512,
+            key="limite_lote_input"
+        )
+
+    st.session_state.formato_json = st.selectbox(
+        "Formato dos arquivos gerados (compacto e NDJSON são menores e mais rápidos, indicados para integração entre sistemas)",
+        list(FORMATOS_JSON),
+        index=list(FORMATOS_JSON).index(st.session_state.formato_json),
+        format_func=lambda formato: FORMATOS_JSON[formato][0],
+        key="formato_json_selector"
+    )
+
+    st.session_state.modo_streaming = st.checkbox(
+        f"Modo streaming para planilhas muito grandes (lê e processa em blocos de {TAMANHO_BLOCO_STREAMING} linhas; ativado automaticamente para arquivos acima de {LIMITE_STREAMING_BYTES // (1024 * 1024)} MB)",
+        value=st.session_state.modo_streaming,
+        key="modo_streaming_checkbox"
     )
 
     uploaded_files = st.file_uploader(
@@ -541,13 +693,17 @@ with tab1:
         key=f"uploader_{st.session_state.uploader_key}"
     )
 
-    if uploaded_files:
+    # O Streamlit descarta os arquivos do uploader quando outra página é exibida; o último job processado
+    # continua guardado na sessão e é reexibido, com os downloads, mesmo sem arquivos no uploader
+    job = st.session_state.job_processamento
+    if uploaded_files or job is not None:
         # Organiza os botões em colunas
         col1, col2, col3 = st.columns(3)
         with col1:
             if st.button("Limpar Lista de Arquivos", width='stretch'):
                 st.session_state.uploader_key += 1
                 st.session_state.generated_jsons = {}
+                st.session_state.job_processamento = None
                 st.rerun()
         with col2:
             if st.button("Expandir Todos", width='stretch'):
@@ -556,243 +712,143 @@ with tab1:
             if st.button("Recolher Todos", width='stretch'):
                 st.session_state.expand_all = False
 
-        st.session_state.generated_jsons = {} # Limpa os resultados anteriores a cada novo upload
-        
-        total_files = len(uploaded_files)
-        overall_progress_text = st.empty()
-        overall_progress_bar = st.progress(0)
-
-        for i, uploaded_file in enumerate(uploaded_files):
-            overall_progress_text.text(f"Processando arquivo {i+1} de {total_files}: {uploaded_file.name}")
-            overall_progress_bar.progress((i + 1) / total_files)
-
-            with st.expander(f"Processando arquivo: {uploaded_file.name}", expanded=st.session_state.expand_all):
+    if uploaded_files:
+        # O processamento roda uma única vez por conjunto de arquivos; os reruns (cliques em botões,
+        # downloads, expandir/recolher) apenas reexibem o job guardado na sessão
+        chave_upload = chave_conjunto_upload(uploaded_files, st.session_state.selected_cpf_cnpj_raiz, st.session_state.modo_streaming)
+        if job is not None and job['chave'] == chave_upload:
+            exibir_job(job)
+        else:
+            st.session_state.job_processamento = None
+            st.session_state.generated_jsons = {} # Limpa os resultados anteriores a cada novo upload
+
+            total_files = len(uploaded_files)
+            overall_progress_text = st.empty()
+            overall_progress_bar = st.progress(0)
+
+            if total_files > 1 and MAX_PROCESSOS > 1:
+                # Vários arquivos: leitura e conversão em paralelo no pool de processos; a gravação segue em série aqui
+                overall_progress_text.text(f"Processando {total_files} arquivos em paralelo ({min(total_files, MAX_PROCESSOS)} processos)...")
+                arquivos = [
+                    (uploaded_file, st.expander(f"Processando arquivo: {uploaded_file.name}", expanded=st.session_state.expand_all))
+                    for uploaded_file in uploaded_files
+                ]
                 with st.spinner("Analisando e processando..."):
-                    # Leitura e pré-processamento
-                    # Leitura e pré-processamento
-                    if uploaded_file.name.endswith('.csv'):
-                        # Para CSV, ainda tratamos como uma única "aba"
-                        dfs = {uploaded_file.name.rsplit('.', 1)[0]: pd.read_csv(uploaded_file)}
-                    else:
-                        # Para Excel, lemos todas as abas
-                        dfs = pd.read_excel(uploaded_file, sheet_name=None, engine="openpyxl")
-                    
-                    for sheet_name, df_original in dfs.items():
-                        st.subheader(f"Processando aba: **{sheet_name}**")
-                        df_original = df_original.dropna(how='all')
-
-                        # Validação de formato de colunas
-                        colunas_erradas = validar_formato_atributos(df_original)
-                        if colunas_erradas:
-                            st.error(f"Erro de Formato na Aba '{sheet_name}' do Arquivo: '{uploaded_file.name}'")
-                            st.warning("As seguintes colunas parecem ser atributos, mas estão com formato incorreto (o correto é 'ATT_...'):")
-                            st.code(', '.join(colunas_erradas))
-                            continue
-
-                        st.info(f"Total de linhas na aba '{sheet_name}': **{len(df_original)}**")
-                        # Adiciona a coluna 'ID' sequencial
-                        df_original.insert(0, 'ID', range(1, len(df_original) + 1))
-                        st.dataframe(df_original, hide_index=True, width='stretch') # Removido .head(3) para mostrar todos os registros
-                        df_original = df_original.map(lambda x: x.strip() if isinstance(x, str) else x)
-
-                        col_part_number = encontrar_coluna(df_original, "PART_NUMBER")
-                        if not col_part_number:
-                            st.error(f"A coluna 'PART_NUMBER' é obrigatória e não foi encontrada na aba '{sheet_name}'.")
-                            continue
-                        
-                        if df_original.duplicated(subset=[col_part_number]).any():
-                            st.warning(f"Part Numbers duplicados encontrados na aba '{sheet_name}'. Apenas a primeira ocorrência será processada.")
-                        df_original.drop_duplicates(subset=[col_part_number], keep='first', inplace=True)
-
-                        # Normalização e conversão
-                        json_progress_text = st.empty()
-                        json_progress_bar = st.progress(0)
-                        json_progress_text.text(f"Convertendo aba '{sheet_name}' para JSON...")
-                        df = normalizar_colunas(df_original.copy())
-                        
-                        if st.session_state.selected_cpf_cnpj_raiz:
-                            json_convertido = converter_para_json(df, json_progress_bar, st.session_state.selected_cpf_cnpj_raiz)
-                        else:
-                            st.error("Por favor, selecione um CPF/CNPJ Raiz antes de processar a planilha.")
-                            continue # Pula para o próximo arquivo ou encerra o processamento
-                        
-                        json_progress_text.empty() # Remove o texto de progresso
-                        json_progress_bar.empty() # Remove a barra de progresso
-                        st.success(f"Conversão JSON da aba '{sheet_name}' concluída! {len(json_convertido)} itens processados.", icon="✅")
-                        
-                        is_valid, message = validar_json_vs_df(json_convertido, df)
-                        if not is_valid:
-                            st.error(f"Falha na validação da aba '{sheet_name}': {message}", icon="❌")
-                            continue
-                        else:
-                            st.success(f"Validação da aba '{sheet_name}' bem-sucedida: {message}", icon="✅")
-
-                        # Armazena o JSON gerado no estado da sessão
-                        nome_base_arquivo = uploaded_file.name.rsplit('.', 1)[0]
-                        st.session_state.generated_jsons[f"{nome_base_arquivo}_{sheet_name}"] = json_convertido
-
-                        # Inserção no banco de dados
-                        st.markdown("---")
-                        st.subheader(f"Atualizando Banco de Dados para a aba '{sheet_name}'")
-                        db_progress_text = st.empty()
-                        db_progress_bar = st.progress(0)
-
-                        df_novos_itens = criar_df_pecas(json_convertido)
-                        db_progress_text.text("Inserindo novas peças...")
-                        num_novos_itens = insert_new_items(df_novos_itens)
-                        db_progress_bar.progress(0.33)
-                        
-                        df_atributos_para_inserir = get_atributos_from_df(df_original)
-                        db_progress_text.text("Inserindo novos atributos...")
-                        num_novos_atributos = insert_data_from_df(df_atributos_para_inserir, 'COD_ATRIBUTOS')
-                        db_progress_bar.progress(0.66)
-                        
-                        df_ncm_x_atrib = converter_para_df_ncm_x_atrib(df_original)
-                        db_progress_text.text("Inserindo novas combinações NCM x Atributo...")
-                        num_ncm_atrib_novos = insert_data_from_df(df_ncm_x_atrib, 'NCM_X_ATRIB')
-                        db_progress_bar.progress(1.0)
-
-                        db_progress_text.empty()
-                        db_progress_bar.empty()
-                        st.success(f"Atualização do Banco de Dados para a aba '{sheet_name}' concluída!", icon="✅")
-
-                        # Exibição de Resultados
-                        st.markdown("---")
-                        st.subheader(f"Resumo da Atualização do Banco de Dados para a aba '{sheet_name}'")
-                        
-                        if num_novos_itens > 0:
-                            st.success(f"**Peças:** {num_novos_itens} novos itens adicionados da aba '{sheet_name}'.", icon="✅")
-                        else:
-                            st.info(f"**Peças:** Base de dados já estava atualizada para a aba '{sheet_name}'.", icon="ℹ️")
-
-                        if num_novos_atributos > 0:
-                            st.success(f"**Atributos:** {num_novos_atributos} novos códigos de atributos adicionados da aba '{sheet_name}'.", icon="✅")
-                        else:
-                            st.info(f"**Atributos:** Tabela de códigos de atributos já estava atualizada para a aba '{sheet_name}'.", icon="ℹ️")
-
-                        if num_ncm_atrib_novos > 0:
-                            st.success(f"**NCM x Atributo:** {num_ncm_atrib_novos} novas combinações adicionadas da aba '{sheet_name}'.", icon="✅")
-                        else:
-                            st.info(f"**NCM x Atributo:** Tabela de combinações já estava atualizada para a aba '{sheet_name}'.", icon="ℹ️")
-                        st.markdown("---") # Separador entre abas
-
-        # --- Seção de Download dos Resultados ---
-        if st.session_state.generated_jsons:
-            st.divider()
-            with st.expander("Download dos Resultados Gerados", expanded=True):
-                st.subheader("Download dos Arquivos JSON Gerados")
-
-                # Botões de download individuais
-                for nome_base, json_data in st.session_state.generated_jsons.items():
-                    if st.session_state.split_json_files:
-                        tamanho_lote = 100
-                        total_lotes = math.ceil(len(json_data) / tamanho_lote)
-                        
-                        for i in range(total_lotes):
-                            inicio = i * tamanho_lote
-                            fim = inicio + tamanho_lote
-                            lote = json_data[inicio:fim]
-                            json_string = json.dumps(lote, ensure_ascii=False, indent=2)
-                            nome_arquivo = f"{nome_base}_lote_{i+1}.json"
-                            st.download_button(
-                                label=f"Baixar {nome_arquivo}",
-                                data=json_string,
-                                file_name=nome_arquivo,
-                                mime="application/json",
-                                key=f"download_{nome_base}_{i}"
-                            )
-                    else:
-                        json_string = json.dumps(json_data, ensure_ascii=False, indent=2)
-                        nome_arquivo = f"{nome_base}.json"
-                        st.download_button(
-                            label=f"Baixar {nome_arquivo}",
-                            data=json_string,
-                            file_name=nome_arquivo,
-                            mime="application/json",
-                            key=f"download_{nome_base}_single"
-                        )
-
-            # Botão para baixar todos como ZIP
-            if len(st.session_state.generated_jsons) > 0: # Alterado para > 0, pois pode haver 1 arquivo sem lotes
-                total_json_files_in_zip = 0
-                zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
-                    for nome_base, json_data in st.session_state.generated_jsons.items():
-                        if st.session_state.split_json_files:
-                            tamanho_lote = 100
-                            total_lotes = math.ceil(len(json_data) / tamanho_lote)
-                            total_json_files_in_zip += total_lotes # Acumula o total de arquivos
-                            for i in range(total_lotes):
-                                inicio = i * tamanho_lote
-                                fim = inicio + tamanho_lote
-                                lote = json_data[inicio:fim]
-                                json_string = json.dumps(lote, ensure_ascii=False, indent=2)
-                                nome_arquivo = f"{nome_base}_lote_{i+1}.json"
-                                zip_file.writestr(nome_arquivo, json_string)
-                        else:
-                            json_string = json.dumps(json_data, ensure_ascii=False, indent=2)
-                            nome_arquivo = f"{nome_base}.json"
-                            zip_file.writestr(nome_arquivo, json_string)
-                            total_json_files_in_zip += 1 # Acumula o total de arquivos
-                
-                st.download_button(
-                    label=f"Baixar Todos os JSONs ({total_json_files_in_zip} arquivos .zip)", # Rótulo atualizado
-                    data=zip_buffer.getvalue(),
-                    file_name="todos_jsons.zip",
-                    mime="application/zip"
+                    resumos_arquivos = processar_arquivos_em_paralelo(arquivos, st.session_state.selected_cpf_cnpj_raiz)
+                overall_progress_bar.progress(1.0)
+            else:
+                resumos_arquivos = []
+                for i, uploaded_file in enumerate(uploaded_files):
+                    overall_progress_text.text(f"Processando arquivo {i+1} de {total_files}: {uploaded_file.name}")
+                    overall_progress_bar.progress((i + 1) / total_files)
+
+                    with st.expander(f"Processando arquivo: {uploaded_file.name}", expanded=st.session_state.expand_all):
+                        with st.spinner("Analisando e processando..."):
+                            resumos_arquivos.append(processar_arquivo_em_serie(uploaded_file, st.session_state.selected_cpf_cnpj_raiz))
+
+            st.session_state.job_processamento = {'chave': chave_upload, 'arquivos': resumos_arquivos}
+    elif job is not None:
+        st.caption("Resultados do último processamento. Envie os arquivos novamente para processar outro conjunto.")
+        exibir_job(job)
+
+    # --- Seção de Download dos Resultados ---
+    if st.session_state.generated_jsons:
+        st.divider()
+        with st.expander("Download dos Resultados Gerados", expanded=True):
+            st.subheader("Download dos Arquivos JSON Gerados")
+
+            # A serialização é feita sob demanda, apenas quando um botão é clicado, e é compartilhada
+            # entre os botões individuais e o ZIP; o objeto só é recriado quando os resultados, a divisão ou o formato mudam
+            chave_exportacao = (
+                id(st.session_state.generated_jsons), st.session_state.criterio_lote, st.session_state.tamanho_lote,
+                st.session_state.limite_lote_kb, st.session_state.formato_json
+            )
+            if st.session_state.get('chave_exportacao_json') != chave_exportacao:
+                st.session_state.exportacao_json = ExportacaoJson(
+                    st.session_state.generated_jsons,
+                    criterio_lote=st.session_state.criterio_lote,
+                    tamanho_lote=st.session_state.tamanho_lote,
+                    limite_bytes=st.session_state.limite_lote_kb * 1024,
+                    formato=st.session_state.formato_json
                 )
-            
-                st.divider()
-                # Seção de Download da Base de Dados de Peças Atualizada
-                st.subheader("Download da Base de Dados de Peças Atualizada")
-                
-                df_final = get_all_items()
-                
-                st.info(f"A base de dados atualizada contém {len(df_final)} itens no total.", icon="ℹ️")
-                st.dataframe(df_final.tail())
+                st.session_state.chave_exportacao_json = chave_exportacao
+            exportacao = st.session_state.exportacao_json
 
-                excel_buffer = io.BytesIO()
-                with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                    df_final.to_excel(writer, index=False, sheet_name='Base_de_Pecas')
-                excel_buffer.seek(0)
-                
+            # Botões de download individuais
+            for nome_arquivo, _, _ in exportacao.arquivos:
                 st.download_button(
-                    label="Baixar Base de Dados de Peças Atualizada (.xlsx)",
-                    data=excel_buffer,
-                    file_name="base_de_pecas.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                    label=f"Baixar {nome_arquivo}",
+                    data=exportacao.produtor(nome_arquivo),
+                    file_name=nome_arquivo,
+                    mime=exportacao.mime,
+                    key=f"download_{nome_arquivo}"
                 )
+
+        # Botão para baixar todos como ZIP
+        if len(st.session_state.generated_jsons) > 0: # Alterado para > 0, pois pode haver 1 arquivo sem lotes
+            st.session_state.nivel_compressao_zip = st.select_slider(
+                "Nível de compressão do ZIP (0 = mais rápido, 9 = menor arquivo)",
+                options=list(range(10)),
+                value=st.session_state.nivel_compressao_zip,
+                key="nivel_compressao_zip_slider"
+            )
+            # O ZIP é montado membro a membro em um arquivo temporário apenas quando o botão é clicado
+            st.download_button(
+                label=f"Baixar Todos os JSONs ({len(exportacao.arquivos)} arquivos .zip)", # Rótulo atualizado
+                data=exportacao.produtor_zip(st.session_state.nivel_compressao_zip),
+                file_name="todos_jsons.zip",
+                mime="application/zip"
+            )
         
+            st.divider()
+            # Seção de Download da Base de Dados de Peças Atualizada
+            st.subheader("Download da Base de Dados de Peças Atualizada")
+            
+            st.info(f"A base de dados atualizada contém {contar_registros('ncm_x_atrib_x_pn')} itens no total.", icon="ℹ️")
+            navegador_tabela('ncm_x_atrib_x_pn', "navegador_base_atualizada", decrescente=True, tamanho_pagina=10)
+
+            formato_base = st.selectbox(
+                "Formato do arquivo da base:",
+                list(FORMATOS_TABELA),
+                format_func=lambda formato: FORMATOS_TABELA[formato][0],
+                key="formato_base_selector"
+            )
+            _, extensao_base, mime_base = FORMATOS_TABELA[formato_base]
+            # O arquivo só é gerado quando o botão é clicado, lendo a tabela direto do cursor
+            st.download_button(
+                label=f"Baixar Base de Dados de Peças Atualizada (.{extensao_base})",
+                data=produtor_exportacao_base(formato_base),
+                file_name=f"base_de_pecas.{extensao_base}",
+                mime=mime_base
+            )
+    
 # Conteúdo da Aba 2: Gerenciamento do Banco de Dados
 # Início do conteúdo da Aba 2
-with tab2:
+def pagina_banco():
+    """Aba 2: inspeção e manutenção das tabelas do banco."""
     st.title("Gerenciamento do Banco de Dados")
     st.markdown("Use esta seção para inspecionar tabelas existentes, executar comandos SQL ou criar novas tabelas diretamente no banco de dados `bytebook.db`.")
 
     with st.expander("Visualizar Tabelas", expanded=False):
         st.subheader("Visualizar Dados de uma Tabela")
         
-        conn = get_db_connection()
         try:
-            df_tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table';", conn)
+            with conexao_leitura() as conn:
+                df_tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table';", conn)
             
             if not df_tables.empty:
                 tabela_selecionada = st.selectbox(
                     "Selecione uma tabela para visualizar:",
                     df_tables['name']
                 )
-                
+            
                 if tabela_selecionada:
-                    st.info("Mostrando os primeiros 10 registros. Use 'Executar SQL' para ver a tabela completa.")
                     st.markdown(f"**Conteúdo da Tabela `{tabela_selecionada}`:**")
-                    df_data = pd.read_sql_query(f"SELECT * FROM `{tabela_selecionada}` LIMIT 10;", conn)
-                    st.dataframe(df_data)
+                    navegador_tabela(tabela_selecionada, "navegador_visualizar")
             else:
                 st.info("Nenhuma tabela encontrada no banco de dados.")
         except Exception as e:
             st.error(f"Erro ao listar as tabelas: {e}")
-        finally:
-            conn.close()
 
     with st.expander("Executar SQL", expanded=False):
         st.subheader("Executar Comandos SQL")
@@ -803,20 +859,17 @@ with tab2:
         
         if st.button("Executar Query"):
             try:
-                conn = get_db_connection()
                 if query.strip().lower().startswith("select"):
-                    df = pd.read_sql_query(query, conn)
+                    with conexao_leitura() as conn:
+                        df = pd.read_sql_query(query, conn)
                     st.dataframe(df)
                 else:
-                    cursor = conn.cursor()
-                    cursor.execute(query)
-                    conn.commit()
+                    # Comando arbitrário: sem tabelas informadas, todo o cache de leituras é invalidado
+                    with conexao_escrita() as conn:
+                        conn.execute(query)
                     st.success("Query executada com sucesso.")
             except Exception as e:
                 st.error(f"Erro ao executar a query: {e}")
-            finally:
-                if 'conn' in locals() and conn:
-                    conn.close()
     
     with st.expander("Criar Nova Tabela", expanded=False):
         st.subheader("Criar Nova Tabela no Banco de Dados")
@@ -834,18 +887,13 @@ with tab2:
         if st.button("Criar Tabela"):
             if nome_tabela:
                 try:
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
                     colunas_sql = ", ".join([f"`{nome}` {tipo}" for nome, tipo in colunas if nome])
                     sql = f"CREATE TABLE IF NOT EXISTS `{nome_tabela}` ({colunas_sql});"
-                    cursor.execute(sql)
-                    conn.commit()
+                    with conexao_escrita() as conn:
+                        conn.execute(sql)
                     st.success(f"Tabela '{nome_tabela}' criada com sucesso.")
                 except Exception as e:
                     st.error(f"Erro ao criar a tabela: {e}")
-                finally:
-                    if 'conn' in locals() and conn:
-                        conn.close()
             else:
                 st.warning("Por favor, insira um nome para a tabela.")
 
@@ -853,149 +901,151 @@ with tab2:
         st.subheader("Carregar Dados de uma Planilha Excel")
         st.markdown("Selecione a tabela de destino e envie um arquivo Excel com colunas que correspondam à sua tabela.")
         
-        conn = get_db_connection()
         try:
-            df_tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table';", conn)
+            with conexao_leitura() as conn:
+                df_tables = pd.read_sql_query("SELECT name FROM sqlite_master WHERE type='table';", conn)
             
-            if not df_tables.empty:
-                tabela_destino = st.selectbox(
-                    "Selecione a tabela de destino:",
-                    df_tables['name']
-                )
+                if not df_tables.empty:
+                    tabela_destino = st.selectbox(
+                        "Selecione a tabela de destino:",
+                        df_tables['name']
+                    )
 
-                uploaded_file_data = st.file_uploader("Envie seu arquivo Excel (.xlsx)", type=["xlsx", "csv"], key="upload_tab2")
+                    uploaded_file_data = st.file_uploader("Envie seu arquivo Excel (.xlsx)", type=["xlsx", "csv"], key="upload_tab2")
 
-                if uploaded_file_data and tabela_destino:
-                    st.markdown("---")
-                    st.subheader("Prévia dos dados do arquivo Excel")
+                    if uploaded_file_data and tabela_destino:
+                        st.markdown("---")
+                        st.subheader("Prévia dos dados do arquivo Excel")
                     
-                    # Usa o pandas para ler o arquivo do Streamlit
-                    if uploaded_file_data.name.endswith('.csv'):
-                        df_upload = pd.read_csv(uploaded_file_data)
-                    else:
-                        df_upload = pd.read_excel(uploaded_file_data, engine="openpyxl")
-                    df_upload = df_upload.dropna(how='all')
-                    st.dataframe(df_upload.head())
-
-                    if st.button(f"Inserir dados na tabela '{tabela_destino}'"):
-                        with st.spinner("Inserindo dados..."):
-                            try:
-                                # Lógica para processar dados de forma diferente dependendo da tabela
-                                if tabela_destino.lower() == 'ncm_x_atrib':
-                                    # Usa a nova função para lidar com o formato específico da sua planilha
-                                    df_processado = converter_df_excel_para_ncm_x_atrib(df_upload)
-                                else:
-                                    # Caso contrário, usa o DataFrame original da planilha
-                                    df_processado = df_upload
-
-                                # 2. A verificação agora é feita no DataFrame processado
-                                cursor = conn.cursor()
-                                cursor.execute(f"PRAGMA table_info({tabela_destino});")
-                                table_columns = [col[1] for col in cursor.fetchall()]
-
-                                # Normaliza as colunas do DataFrame para correspondência
-                                df_processado.columns = [col.lower() for col in df_processado.columns]
-                                table_columns_lower = [col.lower() for col in table_columns]
+                        # Usa o pandas para ler o arquivo do Streamlit
+                        # NCM e part number são lidos como texto (NCM com 8 dígitos)
+                        df_upload = ler_tabela(uploaded_file_data)
+                        df_upload = df_upload.dropna(how='all')
+                        st.dataframe(df_upload.head())
+
+                        if st.button(f"Inserir dados na tabela '{tabela_destino}'"):
+                            with st.spinner("Inserindo dados..."):
+                                try:
+                                    # Lógica para processar dados de forma diferente dependendo da tabela
+                                    if tabela_destino.lower() == 'ncm_x_atrib':
+                                        # Usa a nova função para lidar com o formato específico da sua planilha
+                                        df_processado = converter_df_excel_para_ncm_x_atrib(df_upload)
+                                    else:
+                                        # Caso contrário, usa o DataFrame original da planilha
+                                        df_processado = df_upload
+
+                                    # 2. A verificação agora é feita no DataFrame processado
+                                    cursor = conn.cursor()
+                                    cursor.execute(f"PRAGMA table_info({tabela_destino});")
+                                    table_columns = [col[1] for col in cursor.fetchall()]
+
+                                    # Normaliza as colunas do DataFrame para correspondência
+                                    df_processado.columns = [col.lower() for col in df_processado.columns]
+                                    table_columns_lower = [col.lower() for col in table_columns]
                                 
-                                missing_columns = [col for col in table_columns_lower if col not in df_processado.columns]
+                                    missing_columns = [col for col in table_columns_lower if col not in df_processado.columns]
                                 
-                                if missing_columns:
-                                    st.error(f"O arquivo Excel não possui as colunas obrigatórias da tabela: {', '.join(missing_columns)}. Por favor, verifique se a sua planilha contém as colunas para gerar os dados da tabela '{tabela_destino}'.")
-                                else:
-                                    # Trata colunas extras no DataFrame
-                                    extra_columns = [col for col in df_processado.columns if col not in table_columns_lower]
-                                    if extra_columns:
-                                        st.warning(f"As seguintes colunas do Excel serão ignoradas pois não existem na tabela: {', '.join(extra_columns)}")
-                                        df_processado = df_processado[table_columns_lower]
+                                    if missing_columns:
+                                        st.error(f"O arquivo Excel não possui as colunas obrigatórias da tabela: {', '.join(missing_columns)}. Por favor, verifique se a sua planilha contém as colunas para gerar os dados da tabela '{tabela_destino}'.")
+                                    else:
+                                        # Trata colunas extras no DataFrame
+                                        extra_columns = [col for col in df_processado.columns if col not in table_columns_lower]
+                                        if extra_columns:
+                                            st.warning(f"As seguintes colunas do Excel serão ignoradas pois não existem na tabela: {', '.join(extra_columns)}")
+                                            df_processado = df_processado[table_columns_lower]
                                     
-                                    # Garante que a ordem das colunas seja a mesma da tabela
-                                    df_processado.columns = table_columns
+                                        # Garante que a ordem das colunas seja a mesma da tabela
+                                        df_processado.columns = table_columns
                                     
-                                    novos_itens = insert_data_from_df(df_processado, tabela_destino)
-                                    st.success(f"Dados inseridos com sucesso! {novos_itens} novos registros adicionados à tabela `{tabela_destino}`.")
-                                    
-                                    # Mostra os dados atualizados
-                                    st.markdown(f"**Conteúdo atualizado da Tabela `{tabela_destino}`:**")
-                                    df_data = pd.read_sql_query(f"SELECT * FROM {tabela_destino};", conn)
-                                    st.dataframe(df_data)
+                                        novos_itens = insert_data_from_df(df_processado, tabela_destino)
+                                        st.success(f"Dados inseridos com sucesso! {novos_itens} novos registros adicionados à tabela `{tabela_destino}`.")
+                                        st.session_state.tabela_carregada = tabela_destino
 
-                            except Exception as e:
-                                st.error(f"Erro ao inserir os dados: {e}")
+                                except Exception as e:
+                                    st.error(f"Erro ao inserir os dados: {e}")
 
-            else:
-                st.info("Nenhuma tabela encontrada no banco de dados. Crie uma na seção 'Criar Nova Tabela'.")
+                        # Mostra os dados atualizados, paginados, e mantém a navegação entre as interações
+                        if st.session_state.get('tabela_carregada') == tabela_destino:
+                            st.markdown(f"**Conteúdo atualizado da Tabela `{tabela_destino}`:**")
+                            navegador_tabela(tabela_destino, "navegador_carga")
+
+                else:
+                    st.info("Nenhuma tabela encontrada no banco de dados. Crie uma na seção 'Criar Nova Tabela'.")
         except Exception as e:
             st.error(f"Erro ao listar as tabelas: {e}")
-        finally:
-            if 'conn' in locals() and conn:
-                conn.close()
 
 # Conteúdo da Aba 3: Análises e Estatísticas
-with tab3:
+def pagina_analises():
+    """Aba 3: estatísticas pré-agregadas da base de peças."""
     st.title("Análises e Estatísticas")
     st.markdown("Esta seção apresenta dados e insights da sua base de dados de peças (`ncm_x_atrib_x_pn`).")
 
-    conn = get_db_connection()
     try:
-        # --- Análise de Part Numbers ---
-        st.subheader("Part Numbers")
-        df_part_numbers = pd.read_sql_query("SELECT part_number FROM ncm_x_atrib_x_pn", conn)
-        st.info(f"Total de Part Numbers únicos cadastrados: **{len(df_part_numbers)}**")
-        if not df_part_numbers.empty:
-            st.dataframe(df_part_numbers.rename(columns={'part_number': 'Part Number'}).head(10))
-
-        # --- Análise de NCMs mais utilizados ---
-        st.subheader("NCMs mais utilizados")
-        df_ncm_counts = pd.read_sql_query("SELECT ncm, COUNT(*) as Frequencia FROM ncm_x_atrib_x_pn GROUP BY ncm ORDER BY Frequencia DESC", conn)
-        st.dataframe(df_ncm_counts)
-
-        # --- Análise de Atributos mais utilizados ---
-        st.subheader("Atributos mais utilizados")
-        df_all_attributes = pd.read_sql_query("SELECT atributos_usados FROM ncm_x_atrib_x_pn", conn)
-        df_cod_atributos = pd.read_sql_query("SELECT CODIGO_ATRIB, NOME_ATRIBUTO FROM COD_ATRIBUTOS", conn)
-        
-        # Mapeia código para nome do atributo
-        attr_mapping = pd.Series(df_cod_atributos.NOME_ATRIBUTO.values, index=df_cod_atributos.CODIGO_ATRIB).to_dict()
-        
-        all_attributes_list = []
-        for index, row in df_all_attributes.iterrows():
-            if row['atributos_usados']:
-                attributes = [attr.strip() for attr in row['atributos_usados'].split(',')]
-                all_attributes_list.extend(attributes)
-                
-        attribute_counts = Counter(all_attributes_list)
-        
-        df_attr_counts = pd.DataFrame(attribute_counts.items(), columns=['Atributo', 'Frequência']).sort_values(by='Frequência', ascending=False).reset_index(drop=True)
-        
-        # Adiciona a coluna de descrição
-        df_attr_counts['Descricao'] = df_attr_counts['Atributo'].map(attr_mapping).fillna('Descrição não encontrada')
+        # As estatísticas vêm de tabelas pré-agregadas, atualizadas a cada inserção no banco
+        if st.button("Recalcular Estatísticas", help="Reconstrói as estatísticas a partir das tabelas base."):
+            with conexao_escrita() as conn_escrita:
+                reconstruir_pn_x_atrib(conn_escrita)
+                reconstruir_estatisticas(conn_escrita)
+            st.success("Estatísticas recalculadas com sucesso.")
+
+        with conexao_leitura() as conn:
+            # --- Análise de Part Numbers ---
+            st.subheader("Part Numbers")
+            linha_total = conn.execute("SELECT valor FROM stats_totais WHERE chave = 'part_numbers'").fetchone()
+            total_part_numbers = linha_total[0] if linha_total else 0
+            st.info(f"Total de Part Numbers únicos cadastrados: **{total_part_numbers}**")
+            if total_part_numbers:
+                df_part_numbers = pd.read_sql_query("SELECT part_number FROM ncm_x_atrib_x_pn LIMIT 10", conn)
+                st.dataframe(df_part_numbers.rename(columns={'part_number': 'Part Number'}))
+
+            # --- Análise de NCMs mais utilizados ---
+            st.subheader("NCMs mais utilizados")
+            df_ncm_counts = pd.read_sql_query("SELECT ncm, frequencia as Frequencia FROM stats_ncm_freq ORDER BY frequencia DESC", conn)
+            st.dataframe(df_ncm_counts)
+
+            # --- Análise de Atributos mais utilizados ---
+            st.subheader("Atributos mais utilizados")
+            # Frequência pré-agregada a partir de pn_x_atrib, com a descrição vinda de COD_ATRIBUTOS (em cache)
+            df_attr_counts = pd.read_sql_query('SELECT atrib AS Atributo, frequencia AS "Frequência" FROM stats_attr_freq ORDER BY frequencia DESC', conn)
+            df_cod_atributos = get_cod_atributos().drop_duplicates('CODIGO_ATRIB')
+            descricoes = df_cod_atributos.set_index('CODIGO_ATRIB')['NOME_ATRIBUTO']
+            df_attr_counts['Descricao'] = df_attr_counts['Atributo'].map(descricoes).fillna('Descrição não encontrada')
+            st.dataframe(df_attr_counts[['Atributo', 'Descricao', 'Frequência']])
+
+            # --- Peças que usam um atributo ---
+            st.subheader("Peças que usam um atributo")
+            atributo_consultado = st.text_input("Código do atributo (ex: ATT_10627):", key="atributo_consultado")
+            if atributo_consultado:
+                df_pecas_atributo = pd.read_sql_query('''
+                    SELECT p.part_number AS "Part Number", p.ncm AS NCM, p.descricao AS Descricao
+                    FROM pn_x_atrib a
+                    JOIN ncm_x_atrib_x_pn p ON p.part_number = a.part_number
+                    WHERE a.atrib = ?
+                    ORDER BY p.part_number
+                ''', conn, params=(atributo_consultado.strip(),))
+                st.info(f"{len(df_pecas_atributo)} peças usam o atributo '{atributo_consultado.strip()}'.")
+                st.dataframe(df_pecas_atributo)
+
+            # --- Nova Análise: Atributos por NCM (Visão Agrupada) ---
+            st.subheader("Atributos por NCM (Visão Agrupada)")
+            df_grouped = pd.read_sql_query('SELECT NCM, atributos AS "Atributos Associados" FROM stats_ncm_atrib ORDER BY NCM', conn)
         
-        st.dataframe(df_attr_counts[['Atributo', 'Descricao', 'Frequência']])
-
-        # --- Nova Análise: Atributos por NCM (Visão Agrupada) ---
-        st.subheader("Atributos por NCM (Visão Agrupada)")
-        df_ncm_atrib = pd.read_sql_query("SELECT NCM, ATRIB FROM NCM_X_ATRIB ORDER BY NCM", conn)
-        
-        if not df_ncm_atrib.empty:
-            # Agrupa os atributos por NCM
-            df_grouped = df_ncm_atrib.groupby('NCM')['ATRIB'].apply(lambda x: ', '.join(x)).reset_index()
-            df_grouped.rename(columns={'NCM': 'NCM', 'ATRIB': 'Atributos Associados'}, inplace=True)
-            st.dataframe(df_grouped)
-        else:
-            st.info("Não há dados na tabela NCM_X_ATRIB para exibir.")
+            if not df_grouped.empty:
+                st.dataframe(df_grouped)
+            else:
+                st.info("Não há dados na tabela NCM_X_ATRIB para exibir.")
         
     except Exception as e:
         st.error(f"Erro ao carregar análises: {e}")
-    finally:
-        conn.close()
 
 # Conteúdo da Aba 4: Consulta de Atributos com Linguagem Natural
-with tab4:
+def pagina_consulta():
+    """Aba 4: consulta de atributos por NCM."""
     st.title("Consulta Inteligente de Atributos")
-    st.markdown("Faça uma pergunta como: `quais são os atributos para o ncm 84143091?`")
-
-    # Importa o módulo de expressões regulares
-    import re
+    st.markdown(
+        "Faça uma pergunta como: `quais são os atributos para o ncm 84143091?`. "
+        "Também é possível buscar por prefixo (capítulo ou posição, como `87` ou `8708%`) ou informar vários NCMs de uma vez."
+    )
 
     query_text = st.text_input("Faça sua pergunta ou digite um NCM:")
 
@@ -1003,40 +1053,66 @@ with tab4:
         if not query_text:
             st.warning("Por favor, digite um NCM ou faça uma pergunta.")
         else:
-            # Tenta extrair um NCM de 8 dígitos da pergunta
-            match = re.search(r'\b(\d{8})\b', query_text)
-            ncm_encontrado = match.group(1) if match else None
+            ncms_encontrados = extrair_ncms(query_text)
+            prefixo = None if ncms_encontrados else extrair_prefixo(query_text)
 
-            if not ncm_encontrado:
-                # Se não encontrar um NCM de 8 dígitos, assume que o texto é o NCM
-                ncm_encontrado = query_text.strip()
-
-            conn = get_db_connection()
             try:
-                # Busca os atributos para o NCM encontrado
-                query = f"SELECT NCM, ATRIB FROM NCM_X_ATRIB WHERE NCM = '{ncm_encontrado}';"
-                df_result = pd.read_sql_query(query, conn)
-
-                if not df_result.empty:
-                    st.subheader(f"Atributos para o NCM: {ncm_encontrado}")
-                    
-                    # Junta com a tabela de nomes de atributos para obter as descrições
-                    df_cod_atributos = pd.read_sql_query("SELECT CODIGO_ATRIB, NOME_ATRIBUTO FROM COD_ATRIBUTOS", conn)
-                    df_final = pd.merge(df_result, df_cod_atributos, left_on='ATRIB', right_on='CODIGO_ATRIB', how='left')
-                    df_final.rename(columns={'NOME_ATRIBUTO': 'Descrição do Atributo', 'ATRIB': 'Código do Atributo'}, inplace=True)
-                    
-                    # Seleciona e exibe as colunas desejadas
-                    st.dataframe(df_final[['Código do Atributo', 'Descrição do Atributo']])
+                if len(ncms_encontrados) > 1:
+                    exibir_consulta_em_lote(ncms_encontrados)
                 else:
-                    st.info(f"Nenhum atributo encontrado para o NCM '{ncm_encontrado}'.")
-            
+                    # Se não encontrar um NCM de 8 dígitos nem um prefixo, assume que o texto é o NCM
+                    ncm_encontrado = ncms_encontrados[0] if ncms_encontrados else query_text.strip()
+                    with conexao_leitura() as conn:
+                        if prefixo:
+                            df_final = atributos_por_prefixo(conn, prefixo)
+                        else:
+                            df_final = atributos_do_ncm(conn, ncm_encontrado)
+
+                    if not df_final.empty:
+                        if prefixo:
+                            st.subheader(f"Atributos dos NCMs iniciados por {prefixo} ({df_final['NCM'].nunique()} NCMs)")
+                            st.dataframe(df_final)
+                        else:
+                            st.subheader(f"Atributos para o NCM: {ncm_encontrado}")
+                            st.dataframe(df_final[['Código do Atributo', 'Descrição do Atributo']])
+                    else:
+                        st.info(f"Nenhum atributo encontrado para o NCM '{prefixo + '*' if prefixo else ncm_encontrado}'.")
+
             except Exception as e:
                 st.error(f"Ocorreu um erro na busca: {e}")
-            finally:
-                conn.close()
+
+    st.divider()
+    st.subheader("Consulta em Lote")
+    texto_lote = st.text_area("Cole uma lista de NCMs (um por linha, ou separados por vírgula ou espaço):", key="ncms_em_lote")
+    arquivo_lote = st.file_uploader("Ou envie um arquivo com os NCMs (.xlsx, .csv ou .txt)", type=["xlsx", "csv", "txt"], key="upload_ncms_em_lote")
+
+    if st.button("Buscar Atributos em Lote"):
+        try:
+            ncms = extrair_ncms(texto_lote)
+            if arquivo_lote is not None:
+                ncms = list(dict.fromkeys(ncms + ncms_da_planilha(arquivo_lote)))
+            if ncms:
+                exibir_consulta_em_lote(ncms)
+            else:
+                st.warning("Nenhum NCM de 8 dígitos encontrado na lista ou no arquivo.")
+        except Exception as e:
+            st.error(f"Ocorreu um erro na busca: {e}")
+
+def exibir_consulta_em_lote(ncms):
+    """Mostra os atributos de vários NCMs, resolvidos pelo mapa em memória, e os NCMs sem atributos cadastrados."""
+    mapa = get_mapa_atributos_ncm()
+    df_resultado = mapa.em_lote(ncms)
+    sem_atributos = mapa.sem_atributos(ncms)
+
+    st.subheader(f"Atributos de {len(ncms) - len(sem_atributos)} de {len(ncms)} NCMs consultados")
+    if not df_resultado.empty:
+        st.dataframe(df_resultado)
+    if sem_atributos:
+        st.warning(f"NCMs sem atributos cadastrados: {', '.join(sem_atributos)}")
 
 # Conteúdo da Aba 5: Configuração de CNPJ/CPF Raiz
-with tab5:
+def pagina_cnpj():
+    """Aba 5: cadastro das opções de CPF/CNPJ Raiz."""
     st.title("Configuração de CNPJ/CPF Raiz")
     st.markdown("Cadastre e gerencie as opções de CPF/CNPJ Raiz disponíveis para a geração de JSONs.")
 
@@ -1107,3 +1183,13 @@ with tab5:
                             st.error("Falha ao deletar a opção.")
     else:
         st.info("Nenhuma opção de CPF/CNPJ Raiz cadastrada ainda.")
+
+# Navegação no topo, no lugar das antigas abas
+pagina_selecionada = st.navigation([
+    st.Page(pagina_processamento, title="Processamento de Planilhas", url_path="processamento", default=True),
+    st.Page(pagina_banco, title="Gerenciamento do Banco de Dados", url_path="banco"),
+    st.Page(pagina_analises, title="Análises e Estatísticas", url_path="analises"),
+    st.Page(pagina_consulta, title="Consulta de Atributos", url_path="consulta"),
+    st.Page(pagina_cnpj, title="Configuração de CNPJ/CPF Raiz", url_path="cnpj"),
+], position="top")
+pagina_selecionada.run()